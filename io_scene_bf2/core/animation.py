@@ -1,12 +1,17 @@
 import bpy # type: ignore
+import math
+import numpy as np
 
 from mathutils import Matrix # type: ignore
-from .bf2.bf2_animation import BF2Animation, BF2KeyFrame, BF2AnimationException
-from .utils import to_matrix, conv_bf2_to_blender, conv_blender_to_bf2, file_name
+from .bf2.bf2_animation import BF2Animation, BF2KeyFrames, BF2AnimationException
+from .utils import (file_name, DEFAULT_REPORTER, conv_bf2_to_blender_array, conv_blender_to_bf2_array,
+                    to_matrix_array, quat_to_matrix_array, matrix_decompose_array, foreach_get_array)
 from .skeleton import (ske_get_bone_rot,
                        find_animated_weapon_object, ske_weapon_part_ids)
 from .exceptions import ImportException, ExportException
 
+_DEBUG = False
+
 def get_bones_for_export(rig):
     ske_bones = rig['bf2_bones']
 
@@ -35,63 +40,209 @@ def get_bones_for_export(rig):
 def save_bones_for_export(rig, bones_to_export):
     rig['bones_to_export'] = bones_to_export
 
-def export_animation(context, rig, baf_file, bones_to_export=None, fstart=None, fend=None, world_space=False):
+def export_animation(context, rig, baf_file, bones_to_export=None, fstart=None, fend=None, world_space=False,
+                     rot_tolerance=None, pos_tolerance=None, reporter=DEFAULT_REPORTER):
     scene = context.scene
 
     fstart = scene.frame_start if fstart is None else fstart
     fend = scene.frame_end if fend is None else fend
 
-    saved_frame = scene.frame_current
-    
     ske_bones = rig['bf2_bones']
 
     if bones_to_export is None:
         bones_to_export = ske_bones
-    
+
+    bone_ids = [bone_idx for bone_idx, ske_bone in enumerate(ske_bones) if ske_bone in bones_to_export]
+    frames = range(fstart, fend + 1)
+
+    # bone matrices in armature space for all frames
+    if _can_evaluate_fcurves(rig, world_space):
+        pose_matrices = _eval_pose_matrices(rig, frames)
+        world_matrices = np.array(rig.matrix_world)
+        if _DEBUG:
+            _check_pose_matrices(context, rig, frames, pose_matrices, world_matrices)
+    else:
+        reporter.warning(f"{rig.name}: pose cannot be evaluated from the action alone (constraints, drivers, NLA etc.), "
+                         "stepping through the scene instead, export might be slow")
+        bone_names = set()
+        for bone_idx in bone_ids:
+            pose_bone = rig.pose.bones[ske_bones[bone_idx]]
+            bone_names.add(pose_bone.name)
+            if pose_bone.parent:
+                bone_names.add(pose_bone.parent.name)
+        pose_matrices, world_matrices = _sample_pose_matrices(context, rig, frames, bone_names)
+
     # initialize BF2 animation
     baf = BF2Animation()
     baf.frame_num = fend - fstart + 1
-    for bone_idx, ske_bone in enumerate(ske_bones):
-        if ske_bone in bones_to_export:
-            baf.bones[bone_idx] = list()
 
-    # for each frame...
-    for frame_idx in range(fstart, fend + 1):
-        scene.frame_set(frame_idx)
-        context.view_layer.update()
+    for bone_idx in bone_ids:
+        pose_bone = rig.pose.bones[ske_bones[bone_idx]]
 
-        # for each bone...
-        for bone_idx, ske_bone in enumerate(ske_bones):
+        # convert to parent space and fix rotations
+        if pose_bone.parent:
+            parent_rot_fix = np.array(ske_get_bone_rot(pose_bone.parent.bone).inverted())
+            parent_matrix = np.linalg.inv(pose_matrices[pose_bone.parent.name] @ parent_rot_fix)
+        elif world_space:
+            parent_matrix = world_matrices
+        else:
+            parent_matrix = np.identity(4)
+        rot_fix = np.array(ske_get_bone_rot(pose_bone.bone).inverted())
+        matrices = parent_matrix @ pose_matrices[pose_bone.name] @ rot_fix
 
-            if not bone_idx in baf.bones:
-                continue
-            
-            pose_bone = rig.pose.bones[ske_bone]
+        pos, rot = matrix_decompose_array(matrices)
+        rot, pos = conv_blender_to_bf2_array(rot, pos)
+        baf.bones[bone_idx] = BF2KeyFrames(np.column_stack((rot, pos)))
 
-            # convert to parent space and fix rotations
-            if world_space:
-                parent_matrix = rig.matrix_world.inverted()
-            else:
-                parent_matrix = Matrix.Identity(4)
+    try:
+        stats = baf.export(baf_file, rot_tolerance=rot_tolerance, pos_tolerance=pos_tolerance)
+    except BF2AnimationException as e:
+        raise ExportException(str(e)) from e
 
-            if pose_bone.parent:
-                parent_matrix = pose_bone.parent.matrix @ ske_get_bone_rot(pose_bone.parent.bone).inverted()
-            matrix = parent_matrix.inverted() @ pose_bone.matrix
-            matrix @= ske_get_bone_rot(pose_bone.bone).inverted()
+    lossless_size = sum(s.lossless_size for s in stats.values())
+    if lossless_size and (rot_tolerance is not None or pos_tolerance is not None):
+        size = sum(s.size for s in stats.values())
+        reporter.info(f"{file_name(baf_file)}: lossy compression saved {100 * (1 - size / lossless_size):.1f}% of animation data, "
+                      f"max error rot {math.degrees(max(s.max_rot_error for s in stats.values())):.4f} deg "
+                      f"pos {max(s.max_pos_error for s in stats.values()):.5f}")
+
+    # per bone compression stats, keyed by bone name
+    return {ske_bones[bone_idx]: s for bone_idx, s in stats.items()}
+
+
+def _can_evaluate_fcurves(rig, world_space):
+    """
+    tells whether the pose at any frame can be computed from the rig's action alone,
+    otherwise constraints, drivers, NLA etc. need the scene to be stepped through frame by frame
+    """
+    if rig.data.pose_position != 'POSE':
+        return False
+    for anim_data in (rig.animation_data, rig.data.animation_data):
+        if anim_data is None:
+            continue
+        if anim_data.drivers or anim_data.use_tweak_mode:
+            return False
+        if anim_data.use_nla and any(not track.mute for track in anim_data.nla_tracks):
+            return False
+    if rig.data.animation_data and rig.data.animation_data.action:
+        return False
+
+    anim_data = rig.animation_data
+    if anim_data and anim_data.action:
+        if anim_data.action_influence != 1.0 or anim_data.action_blend_type != 'REPLACE':
+            return False
+        if world_space:
+            # object transform may be animated
+            fcurves = _get_fcurves_from_anim_data(anim_data) or []
+            if any(not fcurve.data_path.startswith('pose.bones[') for fcurve in fcurves):
+                return False
+
+    if world_space and (rig.parent or any(not c.mute for c in rig.constraints)):
+        return False
+
+    for pose_bone in rig.pose.bones:
+        if any(not c.mute for c in pose_bone.constraints):
+            return False
+        if pose_bone.rotation_mode == 'AXIS_ANGLE':
+            return False
+        bone = pose_bone.bone
+        if (bone.inherit_scale != 'FULL' or not bone.use_inherit_rotation
+            or not bone.use_local_location or bone.use_relative_parent):
+            return False
+    return True
+
+def _euler_to_matrix_array(eulers, order):
+    """(N, 3) euler angles to (N, 4, 4) rotation matrices, same as Euler.to_matrix"""
+    m = np.broadcast_to(np.identity(4), (len(eulers), 4, 4)).copy()
+    for axis in order:
+        i = 'XYZ'.index(axis)
+        j, k = [a for a in range(3) if a != i]
+        cos = np.cos(eulers[:, i])
+        sin = np.sin(eulers[:, i])
+        axis_rot = np.broadcast_to(np.identity(4), (len(eulers), 4, 4)).copy()
+        axis_rot[:, j, j] = cos
+        axis_rot[:, k, k] = cos
+        axis_rot[:, k, j] = sin if i != 1 else -sin
+        axis_rot[:, j, k] = -sin if i != 1 else sin
+        m = axis_rot @ m
+    return m
+
+def _eval_pose_matrices(rig, frames):
+    """
+    evaluates the rig's action fcurves, returns armature space matrices of all bones
+    for given frames, same as pose_bone.matrix after frame_set but without updating the scene
+    """
+    frames = np.array(frames, dtype=np.float64)
+    props = ('location', 'rotation_quaternion', 'rotation_euler', 'scale')
+
+    # current values of non animated channels are kept
+    channels = dict()
+    for pose_bone in rig.pose.bones:
+        for prop in props:
+            value = np.array(getattr(pose_bone, prop), dtype=np.float64)
+            channels[pose_bone.path_from_id(prop)] = np.tile(value, (len(frames), 1))
+
+    if rig.animation_data and rig.animation_data.action:
+        for fcurve in _get_fcurves_from_anim_data(rig.animation_data) or []:
+            values = channels.get(fcurve.data_path)
+            if values is None or fcurve.mute or fcurve.array_index >= values.shape[1]:
+                continue
+            if fcurve.group and fcurve.group.mute:
+                continue
+            evaluate = fcurve.evaluate
+            values[:, fcurve.array_index] = [evaluate(frame) for frame in frames.tolist()]
+
+    pose_matrices = dict()
+    # parents first
+    for pose_bone in sorted(rig.pose.bones, key=lambda b: len(b.parent_recursive)):
+        location, rotation_quaternion, rotation_euler, scale = (channels[pose_bone.path_from_id(prop)] for prop in props)
+        if pose_bone.rotation_mode == 'QUATERNION':
+            length = np.linalg.norm(rotation_quaternion, axis=1)[:, None]
+            rotation_quaternion = np.where(length > 0, rotation_quaternion / np.where(length > 0, length, 1), (1, 0, 0, 0))
+            basis = quat_to_matrix_array(rotation_quaternion)
+        else:
+            basis = _euler_to_matrix_array(rotation_euler, pose_bone.rotation_mode)
+        basis[:, :3, :3] *= scale[:, None, :]
+        basis[:, :3, 3] = location
+
+        bone = pose_bone.bone
+        rest_matrix = np.array(bone.matrix_local)
+        if pose_bone.parent:
+            offset = np.linalg.inv(np.array(bone.parent.matrix_local)) @ rest_matrix
+            pose_matrices[pose_bone.name] = pose_matrices[pose_bone.parent.name] @ offset @ basis
+        else:
+            pose_matrices[pose_bone.name] = rest_matrix @ basis
+    return pose_matrices
 
-            pos, rot, _ = matrix.decompose()
-            pos, rot = conv_blender_to_bf2(pos, rot)
-            frame = BF2KeyFrame(pos=pos, rot=rot)
-            baf.bones[bone_idx].append(frame)
+def _sample_pose_matrices(context, rig, frames, bone_names):
+    """returns armature space matrices of given bones and world matrices of the rig by setting each frame in the scene"""
+    scene = context.scene
+    saved_frame = scene.frame_current
+
+    pose_matrices = {bone_name: np.empty((len(frames), 4, 4)) for bone_name in bone_names}
+    world_matrices = np.empty((len(frames), 4, 4))
+    for i, frame_idx in enumerate(frames):
+        scene.frame_set(frame_idx)
+        context.view_layer.update()
+        world_matrices[i] = rig.matrix_world
+        for bone_name, matrices in pose_matrices.items():
+            matrices[i] = rig.pose.bones[bone_name].matrix
 
     # revert to frame before export
     scene.frame_set(saved_frame)
-
-    try:
-        baf.export(baf_file)
-    except BF2AnimationException as e:
-        raise ExportException(str(e)) from e
-
+    return pose_matrices, world_matrices
+
+def _check_pose_matrices(context, rig, frames, pose_matrices, world_matrices):
+    """compares matrices evaluated from the action with the ones Blender computes when stepping through the frames"""
+    sampled_pose_matrices, sampled_world_matrices = _sample_pose_matrices(context, rig, frames, pose_matrices.keys())
+    checks = [(f"'{bone_name}' pose", matrices, sampled_pose_matrices[bone_name])
+              for bone_name, matrices in pose_matrices.items()]
+    checks.append(("world matrix", world_matrices, sampled_world_matrices))
+    for what, matrices, sampled_matrices in checks:
+        error = np.abs(matrices - sampled_matrices).max(axis=(1, 2))
+        if error.max() > 1e-4 * max(1.0, np.abs(sampled_matrices).max()):
+            frame = frames[int(error.argmax())]
+            raise ExportException(f"{rig.name}: evaluated {what} differs from the scene at frame {frame} by {error.max():.6f}")
 
 def import_animation(context, rig, baf_file, insert_at_frame=0, to_new_action=True):
     scene = context.scene
@@ -124,12 +275,17 @@ def import_animation(context, rig, baf_file, insert_at_frame=0, to_new_action=Tr
 
     ske_bones = rig['bf2_bones']
 
+    if rig.animation_data.action is None:
+        rig.animation_data.action = bpy.data.actions.new(rig.name + "Action")
+
     # get 'rest' pose matrix in armature space
     bone_to_rest_matrix = dict()
     for ske_bone in ske_bones:
         rest_bone = armature.bones[ske_bone]
         bone_to_rest_matrix[rest_bone.name] = rest_bone.matrix_local @ ske_get_bone_rot(rest_bone).inverted()
 
+    frame_nums = np.arange(insert_at_frame, insert_at_frame + baf.frame_num, dtype=np.float64)
+
     for bone_idx, frames in baf.bones.items():
         try:
             ske_bone = ske_bones[bone_idx]
@@ -137,34 +293,71 @@ def import_animation(context, rig, baf_file, insert_at_frame=0, to_new_action=Tr
             raise ImportException(f"Bone index {bone_idx} from the animation file does not exist in the skeleton")
         pose_bone = rig.pose.bones[ske_bone]
 
-        for frame_idx in range(baf.frame_num):
-            frame = frames[frame_idx]
-            pos, rot = conv_bf2_to_blender(frame.pos, frame.rot)
-            # bone transforms in .baf are in parent bone space
-            # bone transforms in blender are in parent and 'rest' pose space (wtf seriously)
-
-            # matrix at this frame (parent space)
-            matrix = to_matrix(pos, rot) @ ske_get_bone_rot(pose_bone.bone)
+        data = BF2KeyFrames.to_array(frames)
+        rot, pos = conv_bf2_to_blender_array(data[:, :4], data[:, 4:])
+        # bone transforms in .baf are in parent bone space
+        # bone transforms in blender are in parent and 'rest' pose space (wtf seriously)
 
-            # from parent space to armature space
-            parent_matrix = Matrix.Identity(4)
-            if pose_bone.bone.parent:
-                parent_matrix = bone_to_rest_matrix[pose_bone.bone.parent.name]
-            matrix = parent_matrix @ matrix
+        # from parent space to armature space
+        parent_matrix = Matrix.Identity(4)
+        if pose_bone.bone.parent:
+            parent_matrix = bone_to_rest_matrix[pose_bone.bone.parent.name]
 
-            # back to rest bone space
-            pose_bone.matrix_basis = pose_bone.bone.matrix_local.inverted() @ matrix
+        # back to rest bone space, same for all frames of the bone
+        to_basis = np.array(pose_bone.bone.matrix_local.inverted() @ parent_matrix)
+        bone_rot = np.array(ske_get_bone_rot(pose_bone.bone))
+        matrices = to_basis @ to_matrix_array(pos, rot) @ bone_rot
 
-            pose_bone.keyframe_insert(data_path="location", frame=insert_at_frame + frame_idx)
-            pose_bone.keyframe_insert(data_path="rotation_quaternion", frame=insert_at_frame + frame_idx)
+        location, rotation_quaternion = matrix_decompose_array(matrices)
+        _set_keyframes(rig, pose_bone.path_from_id("location"), ske_bone, frame_nums, location)
+        _set_keyframes(rig, pose_bone.path_from_id("rotation_quaternion"), ske_bone, frame_nums, rotation_quaternion)
 
     bpy.ops.object.mode_set(mode='OBJECT')
 
-    # by default keyframe_insert makes the frame selected
+    # new keyframes are selected by default
     _deselect_all_keyframes(rig.animation_data)
 
     return rig.animation_data.action
 
+def _ensure_fcurve(rig, data_path, index, group_name):
+    action = rig.animation_data.action
+    if not hasattr(bpy.types, "ActionSlot"): # < Blender 4.4, use legacy API
+        fcurve = action.fcurves.find(data_path, index=index)
+        if fcurve is None:
+            fcurve = action.fcurves.new(data_path, index=index, action_group=group_name)
+        return fcurve
+    return action.fcurve_ensure_for_datablock(rig, data_path, index=index, group_name=group_name)
+
+def _set_keyframes(rig, data_path, group_name, frame_nums, values):
+    """keyframes each column of (frames, N) `values` as N-th index of the property at `data_path`"""
+    for index in range(values.shape[1]):
+        fcurve = _ensure_fcurve(rig, data_path, index, group_name)
+        keyframe_points = fcurve.keyframe_points
+        co = np.empty((len(frame_nums), 2), dtype=np.float32)
+        co[:, 0] = frame_nums
+        co[:, 1] = values[:, index]
+        if not _has_default_keyframes(keyframe_points):
+            # points get rewritten out of order below, insert keeps interpolation and handles of the existing ones
+            for frame, value in co.tolist():
+                keyframe_points.insert(frame, value, options={'FAST'})
+        else:
+            # merge with the existing ones, replacing keyframes at the same frames
+            existing_co = foreach_get_array(keyframe_points, 'co', np.float32, 2)
+            existing_co = existing_co[~np.isin(existing_co[:, 0], co[:, 0])]
+            co = np.concatenate((existing_co, co))
+            co = co[np.argsort(co[:, 0], kind='stable')]
+            keyframe_points.add(len(co) - len(keyframe_points))
+            keyframe_points.foreach_set('co', co.ravel())
+        fcurve.update() # sorts and recalculates handles
+
+def _has_default_keyframes(keyframe_points):
+    """tells whether all keyframes are the same as the ones created by keyframe_points.add"""
+    for keyframe in keyframe_points:
+        if (keyframe.interpolation != 'BEZIER' or keyframe.type != 'KEYFRAME'
+            or keyframe.handle_left_type != 'AUTO_CLAMPED' or keyframe.handle_right_type != 'AUTO_CLAMPED'):
+            return False
+    return True
+
 def _get_fcurves_from_anim_data(animation_data):
     action = animation_data.action
     if not hasattr(bpy.types, "ActionSlot"): # < Blender 4.4, use legacy API
@@ -173,6 +366,8 @@ def _get_fcurves_from_anim_data(animation_data):
         slot = animation_data.action_slot
         if slot is None:
             return
+        if not action.layers or not action.layers[0].strips:
+            return
         channelbag = action.layers[0].strips[0].channelbag(slot)
         if channelbag is None:
             return
@@ -1,7 +1,8 @@
 from .bf2_common import Quat, Vec3
 from .fileutils import FileUtils
 import os
-import functools
+import numpy as np
+from typing import Dict
 
 def float_16_to_32(word, precision):
     flt16_mult = 32767.0 / (1 << 15 - precision)
@@ -9,6 +10,12 @@ def float_16_to_32(word, precision):
         word -= 0xFFFF
     return (word / flt16_mult)
 
+def float_16_to_32_array(words, precision):
+    flt16_mult = 32767.0 / (1 << 15 - precision)
+    words = words.astype(np.int64)
+    words[words > 32767] -= 0xFFFF
+    return words / flt16_mult
+
 def float_32_to_16(f, precision):
     flt16_mult = 32767.0 / (1 << 15 - precision)
     word = int(flt16_mult * f)
@@ -16,76 +23,123 @@ def float_32_to_16(f, precision):
         word += 0xFFFF
     return word
 
-def rle_compress(array):
-    MIN_RLE_BLOCK_SIZE = 5
-    MAX_BLOCK_SIZE = 126 # this is max frames we can encode on 7 bits
-
-    class RepeatingValue():
-        def __init__(self, count, value):
-            self.count = count
-            self.value = value
-
-    # group by value
-    grouped = list()
-    if len(array) > 0:
-        count = 1
-        value = array[0]
-        for entry in array[1:]:
-            if entry == value:
-                count += 1
-            else:
-                grouped.append(RepeatingValue(count, value))
-                count = 1
-                value = entry
-        
-        grouped.append(RepeatingValue(count, value))
-    
-    class RleChunk:
-        def __init__(self, rle=False, values=[]):
-            self.rle = rle
-            self.values = values
-    
-    # convert to list of RleChunk
-    chunk_list = list()
-    for chunk in grouped:
-        values = [chunk.value] * chunk.count
+def quantize_array(values, precision):
+    """signed 16 bit values, see float_32_to_16"""
+    flt16_mult = 32767.0 / (1 << 15 - precision)
+    quantized = np.trunc(flt16_mult * np.asarray(values, dtype=np.float64))
+    if not np.all((quantized >= -32767) & (quantized <= 0xFFFF)): # also catches NaN
+        raise BF2AnimationException(f"Animation value out of range for precision {precision}")
+    return quantized.astype(np.int64)
+
+def dequantize_array(quantized, precision):
+    flt16_mult = 32767.0 / (1 << 15 - precision)
+    return quantized / flt16_mult
+
+def quantized_to_words(quantized):
+    return np.where(quantized < 0, quantized + 0xFFFF, quantized).astype(np.uint16)
+
+MIN_RLE_BLOCK_SIZE = 5
+MAX_BLOCK_SIZE = 126 # this is max frames we can encode on 7 bits
+
+def rle_encode(words):
+    """
+    returns data blocks of the stream, each is a header word (head byte + next_header byte)
+    followed by its values. Runs longer than MIN_RLE_BLOCK_SIZE become RLE blocks with a single value,
+    other values are grouped into raw blocks, blocks longer than MAX_BLOCK_SIZE are split
+    """
+    words = np.asarray(words, dtype=np.uint16)
+    if not len(words):
+        return np.zeros(0, dtype=np.uint16)
+
+    # runs of the same value
+    run_start = np.flatnonzero(np.diff(words)) + 1
+    run_start = np.concatenate(([0], run_start))
+    run_len = np.diff(np.append(run_start, len(words)))
+    run_rle = run_len > MIN_RLE_BLOCK_SIZE
+
+    # consecutive short runs are merged into one chunk
+    new_chunk = np.ones(len(run_start), dtype=bool)
+    new_chunk[1:] = run_rle[1:] | run_rle[:-1]
+    chunk_start = run_start[new_chunk]
+    chunk_len = np.diff(np.append(chunk_start, len(words)))
+    chunk_rle = run_rle[new_chunk]
+
+    # split too long chunks
+    piece_count = -(-chunk_len // MAX_BLOCK_SIZE)
+    piece_idx = np.arange(piece_count.sum()) - np.repeat(np.cumsum(piece_count) - piece_count, piece_count)
+    block_start = np.repeat(chunk_start, piece_count) + piece_idx * MAX_BLOCK_SIZE
+    block_len = np.minimum(np.repeat(chunk_len, piece_count) - piece_idx * MAX_BLOCK_SIZE, MAX_BLOCK_SIZE)
+    block_rle = np.repeat(chunk_rle, piece_count)
+
+    # assemble header and values of each block
+    block_values = np.where(block_rle, 1, block_len)
+    next_header = block_values + 1
+    head = (block_rle.astype(np.int64) << 7) | block_len
+    block_offset = np.cumsum(next_header) - next_header
 
-        if chunk.count > MIN_RLE_BLOCK_SIZE:
-            chunk_list.append(RleChunk(True, values))
+    out = np.empty(next_header.sum(), dtype=np.uint16)
+    out[block_offset] = head | next_header << 8
+    value_idx = np.arange(block_values.sum()) - np.repeat(np.cumsum(block_values) - block_values, block_values)
+    value_block = np.repeat(np.arange(len(block_start)), block_values)
+    out[block_offset[value_block] + 1 + value_idx] = words[block_start[value_block] + value_idx]
+    return out
+
+def snap_runs(quantized, budget):
+    """
+    lossy, values of runs longer than MIN_RLE_BLOCK_SIZE which stay within `budget`
+    of their midpoint are replaced by it so that they can be encoded as RLE blocks
+    """
+    snapped = np.array(quantized, dtype=np.int64)
+    if budget <= 0 or len(snapped) <= MIN_RLE_BLOCK_SIZE:
+        return snapped
+
+    # runs can only span small steps, only regions of those need to be searched
+    small_step = np.abs(np.diff(snapped)) <= 2 * budget
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], small_step.astype(np.int8), [0]))))
+    for region_start, region_end in zip(edges[0::2].tolist(), (edges[1::2] + 1).tolist()):
+        if region_end - region_start <= MIN_RLE_BLOCK_SIZE:
             continue
-        else: # chunk not big enough, append to previuos chunk
-            if len(chunk_list) == 0:
-                prev_chunk = None
-            else:
-                prev_chunk = chunk_list[-1]
-            if prev_chunk is None or prev_chunk.rle:
-                # if this is first chunk prev chunk was rle, make new chunk
-                chunk_list.append(RleChunk(False, values))
-            else:
-                prev_chunk.values.extend(values)
-
-    # check for too long chunks
-    chunk_list_final = list()
-    for chunk in chunk_list:
-        if len(chunk.values) > MAX_BLOCK_SIZE:
-            for i in range(0, len(chunk.values), MAX_BLOCK_SIZE):
-                shrunk_values = chunk.values[i:i+MAX_BLOCK_SIZE]
-                chunk_list_final.append(RleChunk(chunk.rle, shrunk_values))
-        else:
-            chunk_list_final.append(chunk)
-
-    # just to be sure check if input length == output length
-    def flat(l):
-        return [item for sublist in l for item in sublist]
-    if len(flat(list(map(lambda x: x.values, chunk_list_final)))) != len(array):
-        raise Exception("RLE compression error")
-    return chunk_list_final
+        # greedy, each run is as long as possible
+        start = region_start
+        while start < region_end - MIN_RLE_BLOCK_SIZE:
+            window = snapped[start:region_end]
+            hi = np.maximum.accumulate(window)
+            lo = np.minimum.accumulate(window)
+            too_wide = np.flatnonzero(hi - lo > 2 * budget)
+            run_len = too_wide[0] if len(too_wide) else len(window)
+            if run_len > MIN_RLE_BLOCK_SIZE:
+                snapped[start:start + run_len] = (hi[run_len - 1] + lo[run_len - 1]) // 2
+            start += run_len
+    return snapped
+
+def rotation_error(rot, other_rot):
+    """angle (radians) between rotations of quaternions in (N, 4) arrays"""
+    rot = rot / np.maximum(np.linalg.norm(rot, axis=1, keepdims=True), 1e-12)
+    other_rot = other_rot / np.maximum(np.linalg.norm(other_rot, axis=1, keepdims=True), 1e-12)
+    # q and -q are the same rotation
+    chord = np.minimum(np.linalg.norm(rot - other_rot, axis=1), np.linalg.norm(rot + other_rot, axis=1))
+    return 4 * np.arcsin(np.minimum(chord / 2, 1.0))
 
 
 class BF2AnimationException(Exception):
     pass
 
 
+class BF2BoneExportStats:
+    """sizes are in 16 bit words of the bone's streams"""
+    def __init__(self, frame_num, lossless_size, size, max_rot_error, max_pos_error):
+        self.frame_num = frame_num
+        self.lossless_size = lossless_size
+        self.size = size
+        self.max_rot_error = max_rot_error # radians
+        self.max_pos_error = max_pos_error
+
+    @property
+    def compression_ratio(self):
+        """uncompressed size (a value per channel per frame) to the exported size"""
+        return 7 * self.frame_num / self.size if self.size else 1.0
+
+
 class BF2KeyFrame:
     def __init__(self, pos=Vec3(), rot=Quat()):
         self.rot = rot.copy()
@@ -93,7 +147,37 @@ class BF2KeyFrame:
 
     def __repr__(self):
         return f"KeyFrame({id(self)}) pos: {self.pos} rot: {self.rot}"
-    
+
+
+class BF2KeyFrames:
+    """
+    Read-only sequence of BF2KeyFrame made on access from a (frames, 7) array
+    of rot xyzw and pos xyz. NOTE: modifying returned keyframes does not change the array
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data : np.ndarray = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, frame):
+        x, y, z, w, px, py, pz = self.data[frame].tolist()
+        return BF2KeyFrame(pos=Vec3(px, py, pz), rot=Quat(x, y, z, w))
+
+    def __iter__(self):
+        for x, y, z, w, px, py, pz in self.data.tolist():
+            yield BF2KeyFrame(pos=Vec3(px, py, pz), rot=Quat(x, y, z, w))
+
+    @staticmethod
+    def to_array(frames):
+        """(frames, 7) array of given keyframes, either BF2KeyFrames or list of BF2KeyFrame"""
+        if isinstance(frames, BF2KeyFrames):
+            return frames.data
+        return np.array([(fr.rot.x, fr.rot.y, fr.rot.z, fr.rot.w, fr.pos.x, fr.pos.y, fr.pos.z)
+                         for fr in frames], dtype=np.float64).reshape(-1, 7)
+
 
 class BF2Animation:
     def __init__(self, baf_file=None):
@@ -119,47 +203,71 @@ class BF2Animation:
             self.frame_num = anim_data.read_dword()
             precision = anim_data.read_byte()
 
+            # rot xyzw and pos xyz
+            channel_precision = [15] * 4 + [precision] * 3
+            channel_sign = [-1.0] * 3 + [1.0] * 4
+
             for bone_id in bone_ids:
-                self.bones[bone_id] = frames = [BF2KeyFrame() for _ in range(self.frame_num)]
+                data = np.zeros((self.frame_num, 7))
+                data[:, 3] = 1.0 # identity rotation for frames missing in the streams
                 data_size = anim_data.read_word()
 
-                for j in range(1,8):
-                    cur_frame = 0
+                for j in range(7):
                     data_left = anim_data.read_word()
-    
-                    while data_left > 0:
-                        head = anim_data.read_byte()
-                        rle_compression = (head & 0x80) >> 7 # 1st bit
-                        num_frames = head & 0x7F # rest (7 bits);
-                        next_header = anim_data.read_byte()
-
-                        bone_frame_num = cur_frame + num_frames - 1
-                        if bone_frame_num >= self.frame_num:
-                            raise BF2AnimationException(f"Corrupted .baf, frame number for bone {bone_id} ({bone_frame_num}) exceeds max: {self.frame_num}")
-    
-                        if rle_compression:
-                            value = anim_data.read_word()
-                        for _ in range(num_frames):
-                            if not rle_compression:
-                                value = anim_data.read_word()
-    
-                            if j == 1: frames[cur_frame].rot.x = -float_16_to_32(value, 15)
-                            if j == 2: frames[cur_frame].rot.y = -float_16_to_32(value, 15)
-                            if j == 3: frames[cur_frame].rot.z = -float_16_to_32(value, 15)
-                            if j == 4: frames[cur_frame].rot.w =  float_16_to_32(value, 15)
-                        
-                            if j == 5: frames[cur_frame].pos.x = float_16_to_32(value, precision)
-                            if j == 6: frames[cur_frame].pos.y = float_16_to_32(value, precision)
-                            if j == 7: frames[cur_frame].pos.z = float_16_to_32(value, precision)
-    
-                            cur_frame += 1
-                        
-                        data_left -= next_header
-            
+                    stream = anim_data.read_array('H', data_left)
+                    words = self._decode_stream(stream, bone_id)
+                    data[:len(words), j] = float_16_to_32_array(words, channel_precision[j]) * channel_sign[j]
+
+                self.bones[bone_id] = BF2KeyFrames(data)
+
             if os.fstat(f.fileno()).st_size != f.tell():
                 raise BF2AnimationException("Corrupted .baf file? Reading finished and file pointer != filesize")
     
-    def export(self, export_path):
+    def _decode_stream(self, stream, bone_id):
+        """returns 16 bit values of consecutive frames from RLE stream"""
+        # each block is a header word (head byte + next_header byte) followed by its values
+        headers = stream.tolist()
+        block_starts = list()
+        block_frames = list()
+        block_rle = list()
+        cur_frame = 0
+        pos = 0
+        while pos < len(headers):
+            head = headers[pos] & 0xFF
+            rle_compression = (head & 0x80) >> 7 # 1st bit
+            num_frames = head & 0x7F # rest (7 bits);
+            next_header = headers[pos] >> 8
+            if next_header == 0:
+                raise BF2AnimationException(f"Corrupted .baf, empty data block for bone {bone_id}")
+
+            bone_frame_num = cur_frame + num_frames - 1
+            if bone_frame_num >= self.frame_num:
+                raise BF2AnimationException(f"Corrupted .baf, frame number for bone {bone_id} ({bone_frame_num}) exceeds max: {self.frame_num}")
+
+            block_end = pos + 1 + (min(num_frames, 1) if rle_compression else num_frames)
+            if block_end > len(headers):
+                raise BF2AnimationException(f"Corrupted .baf, data block for bone {bone_id} is truncated")
+
+            block_starts.append(pos + 1)
+            block_frames.append(num_frames)
+            block_rle.append(rle_compression)
+            cur_frame += num_frames
+            pos += next_header
+
+        # value index of each frame, RLE blocks repeat their only value
+        block_frames = np.array(block_frames, dtype=np.int64)
+        frame_offset = np.arange(cur_frame) - np.repeat(np.cumsum(block_frames) - block_frames, block_frames)
+        frame_offset[np.repeat(np.array(block_rle, dtype=bool), block_frames)] = 0
+        return stream[np.repeat(np.array(block_starts, dtype=np.int64), block_frames) + frame_offset]
+
+    def export(self, export_path, rot_tolerance=None, pos_tolerance=None) -> Dict[int, BF2BoneExportStats]:
+        """
+        rot_tolerance: enables lossy compression of rotations, max angle (radians) between exported and original
+                       rotation of a bone, not guaranteed only when the 16 bit quantization alone exceeds it
+        pos_tolerance: enables lossy compression of positions, max error of each position axis
+        returns size and error of each exported bone
+        """
+        stats = dict()
         with open(export_path, "wb") as f:
             anim_data = FileUtils(f)
             anim_data.write_dword(4) # version
@@ -170,11 +278,12 @@ class BF2Animation:
 
             anim_data.write_dword(self.frame_num)
 
+            bone_data = {bone_id: BF2KeyFrames.to_array(frames) for bone_id, frames in self.bones.items()}
+
             # find pos axis value furthest from 0 (it's usually the camera at Z = ~1.5)
             max_value_for_animation = 0
-            for frames in self.bones.values():
-                max_for_this_bone = functools.reduce(lambda prev, fr: max(prev, abs(fr.pos.x), abs(fr.pos.y), abs(fr.pos.z)), frames, 0)
-                max_value_for_animation = max(max_value_for_animation, max_for_this_bone)
+            for data in bone_data.values():
+                max_value_for_animation = max(max_value_for_animation, float(np.abs(data[:, 4:]).max(initial=0)))
 
             # find max possible float precision
             precision = None
@@ -189,68 +298,56 @@ class BF2Animation:
 
             anim_data.write_byte(precision)
 
-            for bone_id, frames in self.bones.items():
-                if len(frames) > self.frame_num:
+            # rot xyzw and pos xyz
+            channel_precision = [15] * 4 + [precision] * 3
+            channel_sign = np.array([-1.0] * 3 + [1.0] * 4)
+
+            for bone_id, data in bone_data.items():
+                if len(data) > self.frame_num:
                     raise BF2AnimationException(f"cannot export baf, number of frames for bone {bone_id} "
-                                                f" ({len(frames)}) exceeds frameNum: ({self.frame_num}")
-
-                class DataBlocks:
-                    def __init__(self):
-                        self.blocks = list()
-                        self.data_left = 0
-                
-                class DataBlock:
-                    def __init__(self):
-                        self.rle_compression = False
-                        self.head = 0
-                        self.next_header = 0
-                        self.values = []
-    
-                # collect data
-                streams = list()
-                data_size = 0
-                for j in range(1,8):
-                    if j == 1: values = list(map(lambda fr: float_32_to_16(-fr.rot.x, 15), frames))
-                    if j == 2: values = list(map(lambda fr: float_32_to_16(-fr.rot.y, 15), frames))
-                    if j == 3: values = list(map(lambda fr: float_32_to_16(-fr.rot.z, 15), frames))
-                    if j == 4: values = list(map(lambda fr: float_32_to_16( fr.rot.w, 15), frames))
-
-                    if j == 5: values = list(map(lambda fr: float_32_to_16(fr.pos.x, precision), frames))
-                    if j == 6: values = list(map(lambda fr: float_32_to_16(fr.pos.y, precision), frames))
-                    if j == 7: values = list(map(lambda fr: float_32_to_16(fr.pos.z, precision), frames))
-    
-                    data_blocks = DataBlocks()
-    
-                    rle_chunks = rle_compress(values)
+                                                f" ({len(data)}) exceeds frameNum: ({self.frame_num}")
 
-                    for chunk in rle_chunks:
-                        data_block = DataBlock()
-                        data_blocks.blocks.append(data_block)
-    
-                        data_block.rle_compression = chunk.rle
-                        num_frames = len(chunk.values)
-                        data_block.head = (data_block.rle_compression << 7) | num_frames
-                        if data_block.rle_compression:
-                            data_block.next_header = 2
-                        else:
-                            data_block.next_header = num_frames + 1
-                        data_block.values = chunk.values
-                        data_blocks.data_left += data_block.next_header
-    
-                    streams.append(data_blocks)
-                    data_size += data_blocks.data_left
+                data = data * channel_sign
+                quantized = np.column_stack([quantize_array(data[:, j], channel_precision[j]) for j in range(7)])
+                quantized = quantized.reshape(-1, 7)
+
+                streams = [rle_encode(quantized_to_words(quantized[:, j])) for j in range(7)]
+                lossless_size = sum(len(stream) for stream in streams)
 
-                # write data
+                if rot_tolerance is not None:
+                    # each component off by up to budget moves the rotation by about 4x that angle,
+                    # the result is checked and the budget lowered until it fits
+                    budget = int(rot_tolerance / 4 * 32767)
+                    while True:
+                        rot = np.column_stack([snap_runs(quantized[:, j], budget) for j in range(4)]).reshape(-1, 4)
+                        if budget == 0 or rotation_error(data[:, :4], dequantize_array(rot, 15)).max(initial=0) <= rot_tolerance:
+                            break
+                        budget //= 2
+                    quantized[:, :4] = rot
+
+                if pos_tolerance is not None:
+                    # truncation in quantization adds up to one step
+                    budget = int(pos_tolerance * 32767.0 / (1 << 15 - precision)) - 1
+                    for j in range(4, 7):
+                        quantized[:, j] = snap_runs(quantized[:, j], budget)
+
+                if rot_tolerance is not None or pos_tolerance is not None:
+                    streams = [rle_encode(quantized_to_words(quantized[:, j])) for j in range(7)]
+
+                data_size = sum(len(stream) for stream in streams)
+                stats[bone_id] = BF2BoneExportStats(
+                    len(data), lossless_size, data_size,
+                    max_rot_error=float(rotation_error(data[:, :4], dequantize_array(quantized[:, :4], 15)).max(initial=0)),
+                    max_pos_error=float(np.abs(data[:, 4:] - dequantize_array(quantized[:, 4:], precision)).max(initial=0)))
+                if data_size > 0xFFFF:
+                    raise BF2AnimationException(f"cannot export baf, too much data for bone {bone_id}")
+
+                # whole bone at once
                 anim_data.write_word(data_size)
+                words = list()
                 for stream in streams:
-                    anim_data.write_word(stream.data_left)
-    
-                    for data_block in stream.blocks:
-                        anim_data.write_byte(data_block.head)
-                        anim_data.write_byte(data_block.next_header)
-    
-                        if data_block.rle_compression:
-                            anim_data.write_word(data_block.values[0])
-                        else:
-                            for data_block_val in data_block.values:
-                                anim_data.write_word(data_block_val)
+                    words.append(np.array([len(stream)], dtype=np.uint16)) # data_left
+                    words.append(stream)
+                anim_data.write_raw(np.concatenate(words).astype('<u2', copy=False).tobytes())
+
+        return stats
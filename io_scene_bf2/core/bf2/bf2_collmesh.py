@@ -1,10 +1,17 @@
 import os
-from typing import Dict, List, Tuple, Optional
+import sys
+import hashlib
+from typing import List, Tuple, Optional
+import numpy as np
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from .fileutils import FileUtils
-from .bsp_builder import BspBuilder
+from .bsp_builder import BspBuilder, SplitStrategy, GreedySplit, MAX_LEAF_FACES, build_from_points
 from .bf2_common import Vec3, calc_bounds, load_n_elems
 
+_DEBUG = False
+
 class BF2CollMeshException(Exception):
     pass
 
@@ -21,15 +28,51 @@ class Face:
         verts = (v1, v2, v3)
         material = f.read_word()
         return cls(verts, material)
-    
+
+    @classmethod
+    def load_n(cls, f : FileUtils, count):
+        return cls.from_array(f.read_array('H', count * 4).reshape(count, 4))
+
+    @classmethod
+    def from_array(cls, data):
+        """faces from (N, 4) array of vertex indexes and material"""
+        return [cls((v1, v2, v3), material) for v1, v2, v3, material in data.tolist()]
+
+    @staticmethod
+    def to_array(faces):
+        """(N, 4) array of vertex indexes and material of given faces"""
+        return np.array([(*face.verts, face.material) for face in faces], dtype=np.int64).reshape(-1, 4)
+
     def save(self, f : FileUtils):
         f.write_word(self.verts[0])
         f.write_word(self.verts[1])
         f.write_word(self.verts[2])
         f.write_word(self.material)
 
+    @staticmethod
+    def save_n(f : FileUtils, faces):
+        if not isinstance(faces, np.ndarray):
+            faces = [(*face.verts, face.material) for face in faces]
+        f.write_array('H', faces)
+
 # https://en.wikipedia.org/wiki/Binary_space_partitioning
 class BSP:
+    """
+    Nodes are kept as flat arrays in the same layout as on disk, `Node` objects
+    can be made with `to_nodes` for convenience. Each node has a split plane and two sides (front/back),
+    each side is either a subtree (child node index in `refs`) or a leaf with a range of `face_refs`
+    (start in `refs`, count in `flags`) which are indexes of faces
+    """
+
+    # each node is 16 bytes: float split value, dword flags, 2 dword child index or face ref start
+    NODE_DTYPE = np.dtype([('split_val', '<f4'), ('flags', '<u4'), ('refs', '<u4', 2)])
+
+    # flags: bits 0-1 axis, bits 2-3 leaf flags of front/back side,
+    # bits 16-23 and 24-31 face ref count of front/back side
+    AXIS_MASK = 0b11
+    LEAF_FLAG = (4, 8)
+    FACE_REF_COUNT_SHIFT = (16, 24)
+
     class Node():
         def __init__(self, split_plane_val, split_plane_axis):
             self.split_plane_val : float = split_plane_val
@@ -43,62 +86,6 @@ class BSP:
             self.faces : List[List[Face]] = [[], []]  # 2-element front/back set only for leaf Node
             # NOTE: in DICE's implementation if a face straddles the split plane it is added to both 'front' and 'back' sets
 
-            # temporary raw import data
-            self._face_refs_idx : List[List[int]] = [[], []]
-            self._children_idx : List[int] = [None, None]
-
-        @classmethod
-        def load(cls, f : FileUtils):
-            split_plane_val = f.read_float()
-            _0x04 = f.read_dword()
-            split_plane_axis = _0x04 & 0b11
-
-            obj = cls(split_plane_val, split_plane_axis)
-
-            for i in range(2):
-                is_leaf = bool((4 << i) & _0x04)
-
-                # face ref counts
-                if is_leaf:
-                    face_ref_count = _0x04 >> (i * 8 + 16) & 0xFF
-                    face_ref_start = f.read_dword()
-                    obj._face_refs_idx[i] = list(range(face_ref_start, face_ref_start + face_ref_count))
-                    obj._children_idx[i] = None
-                else:
-                    obj._children_idx[i] = f.read_dword()
-            return obj
-
-        def load_children_and_faces(self, nodes, face_ref_to_face):
-            for i in range(2):
-                child_idx = self._children_idx[i]
-                if child_idx is not None:
-                    self.children[i] = nodes[child_idx]
-                    self.children[i].parent = self
-                else:
-                    for j in self._face_refs_idx[i]:
-                        self.faces[i].append(face_ref_to_face[j])
-
-        def save(self, f : FileUtils, nodes, face_refs):
-            f.write_float(self.split_plane_val)
-            _0x04 = self.split_plane_axis & 0b11
-
-            face_ref_start = [0, 0]
-            for i in range(2):
-                if self.children[i] == None:
-                    face_ref_count = len(self.faces[i])
-                    face_ref_start[i] = len(face_refs)
-                    for face in self.faces[i]:
-                        face_refs.append(face)
-
-                    _0x04 |= 4 << i
-                    _0x04 |= face_ref_count << (i * 8 + 16)
-                else:
-                    face_ref_start[i] = nodes.index(self.children[i]) 
-
-            f.write_dword(_0x04)
-            for i in range(2):
-                f.write_dword(face_ref_start[i])
-
         def _to_string(self, level=0):
             prfx = '   ' * level
             ret = prfx + f' |* split_plane: {self.split_plane_val}|{self.split_plane_axis}\n'
@@ -120,96 +107,242 @@ class BSP:
         def __str__(self):
             return self._to_string()
 
-    def __init__(self, min, max, root):
+    def __init__(self, min, max, nodes, face_refs, root=0, chunked=None):
         self.min : Vec3 = min
         self.max : Vec3 = max
-        self.root : BSP.Node = root
+        self.nodes : np.ndarray = nodes # of NODE_DTYPE
+        self.face_refs : np.ndarray = face_refs
+        self.root : int = root
+        # per node mask of nodes whose faces straddling the split plane are only on one side
+        # (see BspBuilder), not stored in the file so None when unknown
+        self.chunked : Optional[np.ndarray] = chunked
+
+    @property
+    def split_vals(self):
+        return self.nodes['split_val']
+
+    @property
+    def split_axes(self):
+        return self.nodes['flags'] & self.AXIS_MASK
+
+    def is_leaf(self, side):
+        """per node mask telling whether given side is a leaf"""
+        return (self.nodes['flags'] & self.LEAF_FLAG[side]) != 0
+
+    def face_ref_counts(self, side):
+        return (self.nodes['flags'] >> self.FACE_REF_COUNT_SHIFT[side]) & 0xFF
 
     @classmethod
-    def load(cls, f : FileUtils, faces : List[Face]):
+    def load(cls, f : FileUtils):
         tree_min = Vec3.load(f)
         tree_max = Vec3.load(f)
 
-        obj = cls(tree_min, tree_max, None)
-
-        nodes = load_n_elems(f, BSP.Node, count=f.read_dword())
-        face_refs = [f.read_word() for _ in range(f.read_dword())]
-
-        face_ref_to_face : Dict[int, Face] = {}
-        for i, face_ref in enumerate(face_refs):
-            face_ref_to_face[i] = faces[face_ref]
+        node_count = f.read_dword()
+        nodes = np.frombuffer(f.read_raw(node_count * cls.NODE_DTYPE.itemsize), dtype=cls.NODE_DTYPE)
+        face_refs = f.read_array('H', f.read_dword())
 
-        for node in nodes:
-            node.load_children_and_faces(nodes, face_ref_to_face)
+        obj = cls(tree_min, tree_max, nodes, face_refs)
 
-        obj.root = None
-        for node in nodes:
-            if node.parent is None:
-                if obj.root is None:
-                    obj.root = node
-                else:
-                    raise BF2CollMeshException("BSP: found multiple root nodes")
-        if obj.root is None:
+        # root is the only node which is not a child of any other
+        child_refs = [nodes['refs'][:, i][~obj.is_leaf(i)] for i in range(2)]
+        is_child = np.zeros(node_count, dtype=bool)
+        is_child[np.concatenate(child_refs)] = True
+        roots = np.flatnonzero(~is_child)
+        if len(roots) > 1:
+            raise BF2CollMeshException("BSP: found multiple root nodes")
+        if len(roots) == 0:
             raise BF2CollMeshException("BSP: root node not found")
+        obj.root = int(roots[0])
         return obj
 
-    def save(self, f : FileUtils, faces):
+    def save(self, f : FileUtils):
         self.min.save(f)
         self.max.save(f)
-
-        def _get_nodes_list(node, node_list):
-            node_list.append(node)
+        f.write_dword(len(self.nodes))
+        f.write_raw(self.nodes.astype(self.NODE_DTYPE, copy=False).tobytes())
+        f.write_dword(len(self.face_refs))
+        f.write_array('H', self.face_refs)
+
+    def remap_faces(self, new_face_idx):
+        """updates face references after faces got reordered, `new_face_idx` maps old face index to new one"""
+        self.face_refs = np.asarray(new_face_idx)[self.face_refs]
+
+    def to_nodes(self, faces : List[Face]) -> Node:
+        """returns root of the tree made of Node objects"""
+        nodes = [BSP.Node(val, axis) for val, axis in zip(self.split_vals.tolist(), self.split_axes.tolist())]
+        face_refs = self.face_refs.tolist()
+        for node, (_, flags, refs) in zip(nodes, self.nodes.tolist()):
             for i in range(2):
-                child = node.children[i]
-                if child is not None:
-                    _get_nodes_list(child, node_list)
-
-        nodes = list()
-        _get_nodes_list(self.root, nodes)
-        face_refs = list()
-
-        f.write_dword(len(nodes))
-
-        for node in nodes:
-            node.save(f, nodes, face_refs)
+                if flags & self.LEAF_FLAG[i]:
+                    face_ref_count = flags >> self.FACE_REF_COUNT_SHIFT[i] & 0xFF
+                    node.faces[i] = [faces[j] for j in face_refs[refs[i]:refs[i] + face_ref_count]]
+                else:
+                    node.children[i] = nodes[refs[i]]
+                    node.children[i].parent = node
+        return nodes[self.root]
 
-        f.write_dword(len(face_refs))
-        for face in face_refs:
-            f.write_word(faces.index(face))
+    @staticmethod
+    def build(verts, face_verts, executor : Optional[Executor] = None, strategy : Optional[SplitStrategy] = None):
+        """builds the tree from (N, 3) vertex positions and (N, 3) face vertex indexes"""
+        builder = BspBuilder(verts, face_verts, strategy, executor=executor)
+        tree = (builder.split_vals, builder.split_axes, builder.children, builder.leaf_faces, builder.chunked)
+        return BSP.from_tree(verts, len(face_verts), tree)
 
     @staticmethod
-    def build(verts, faces):
-        _verts = [(v.x, v.y, v.z) for v in verts]
-        _faces = [f.verts for f in faces]
-        builder = BspBuilder(_verts, _faces)
-
-        def _copy(builder_node, parent=None):
-            split_plane = builder_node.split_plane
-            node = BSP.Node(split_plane.val, split_plane.axis)
-            node.parent = parent
-            children = (builder_node.front_node, builder_node.back_node)
-            face_idxs = (builder_node.front_faces, builder_node.back_faces)
+    def from_tree(verts, face_count, tree):
+        """makes BSP from flat node arrays of BspBuilder"""
+        split_vals, split_axes, children, leaf_faces, chunked = tree
 
+        if not split_vals:
+            # happens when collmesh is very simple (e.g. asingle face) lets build a dummy tree
+            # with just root and all faces on one side (this is also what 3ds max exporter does)
+            split_vals = [float(max(v[0] for v in verts))]
+            split_axes = [0]
+            children = [[-1, -1]]
+            leaf_faces = [[list(range(face_count)), []]]
+            chunked = [False]
+
+        # nodes are stored depth first, front before back, face refs in the order of nodes
+        order = list()
+        stack = [0]
+        while stack:
+            node_idx = stack.pop()
+            order.append(node_idx)
+            for child_idx in reversed(children[node_idx]):
+                if child_idx >= 0:
+                    stack.append(child_idx)
+        new_idx = [0] * len(order)
+        for i, node_idx in enumerate(order):
+            new_idx[node_idx] = i
+
+        nodes = np.zeros(len(order), dtype=BSP.NODE_DTYPE)
+        flags = list()
+        refs = list()
+        face_refs = list()
+        for node_idx in order:
+            node_flags = split_axes[node_idx] & BSP.AXIS_MASK
+            node_refs = [0, 0]
             for i in range(2):
-                if children[i] is not None:
-                    node.children[i] = _copy(children[i], node)
+                child_idx = children[node_idx][i]
+                if child_idx < 0:
+                    faces = leaf_faces[node_idx][i]
+                    if len(faces) > MAX_LEAF_FACES:
+                        raise BF2CollMeshException("BSP: too many faces in a leaf")
+                    node_refs[i] = len(face_refs)
+                    face_refs.extend(faces)
+                    node_flags |= BSP.LEAF_FLAG[i]
+                    node_flags |= len(faces) << BSP.FACE_REF_COUNT_SHIFT[i]
                 else:
-                    node.children[i] = None
-                    node.faces[i] = [faces[face_idx] for face_idx in face_idxs[i]]
-            return node
+                    node_refs[i] = new_idx[child_idx]
+            flags.append(node_flags)
+            refs.append(node_refs)
 
-        if builder.root is None:
-            # happens when collmesh is very simple (e.g. asingle face) lets build a dummy tree
-            # with just root and all faces on one side (this is also what 3ds max exporter does)
-            split_plane_val = max(_verts, key=lambda x: x[0])[0]
-            split_plane_axis = 0
-            root = BSP.Node(split_plane_val, split_plane_axis)
-            root.faces[0] = faces
-        else:
-            root = _copy(builder.root)
+        nodes['split_val'] = [split_vals[node_idx] for node_idx in order]
+        nodes['flags'] = flags
+        nodes['refs'] = np.array(refs, dtype=np.uint32).reshape(-1, 2)
 
         mins, maxs = calc_bounds(verts)
-        return BSP(mins, maxs, root)
+        return BSP(mins, maxs, nodes, np.array(face_refs, dtype=np.uint16),
+                   chunked=np.array([chunked[node_idx] for node_idx in order], dtype=bool))
+
+
+class ColCache:
+    """
+    On-disk cache of built BSPs and face adjacency, one file per col keyed by hash
+    of its (sorted) faces, vertices and BSP strategy. Least recently used entries
+    get removed when there are more than `max_entries`
+    """
+    VERSION = 2 # must be changed if the output of BspBuilder or Col.calc_face_adj changes
+    FILE_EXT = '.npz'
+
+    def __init__(self, cache_dir, max_entries=1024):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, col : 'Col') -> str:
+        strategy = col.bsp_strategy or GreedySplit()
+        h = hashlib.md5()
+        h.update(f'{self.VERSION}|{type(strategy).__qualname__}|{sorted(vars(strategy).items())}'.encode())
+        # as saved to the file
+        for data, dtype in ((col.face_array(), '<u2'), (col.vert_array(), '<f4')):
+            data = np.ascontiguousarray(data, dtype=dtype)
+            h.update(f'|{data.shape}|'.encode())
+            h.update(data.tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.FILE_EXT)
+
+    def load(self, key, face_count) -> Optional[Tuple[BSP, np.ndarray]]:
+        """returns BSP and face adjacency of a col with `face_count` faces, None when not cached"""
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                bounds = data['bounds'].tolist()
+                bsp = BSP(Vec3(*bounds[0]), Vec3(*bounds[1]),
+                          data['nodes'], data['face_refs'], int(data['root']), data['chunked'])
+                face_adj = data['face_adj']
+            self._validate(bsp, face_adj, face_count)
+            os.utime(path)
+        except Exception: # corrupted (e.g. truncated zip), cache is optional so must never fail the export
+            self._remove(path)
+            return None
+        return bsp, face_adj
+
+    @staticmethod
+    def _validate(bsp : BSP, face_adj, face_count):
+        if bsp.nodes.dtype != BSP.NODE_DTYPE or bsp.nodes.ndim != 1:
+            raise ValueError("bad BSP nodes")
+        if bsp.face_refs.dtype.kind not in 'ui' or bsp.face_refs.ndim != 1:
+            raise ValueError("bad BSP face refs")
+        if len(bsp.face_refs) and (bsp.face_refs.min() < 0 or bsp.face_refs.max() >= face_count):
+            raise ValueError("BSP face refs out of range")
+        if len(bsp.nodes) and not 0 <= bsp.root < len(bsp.nodes):
+            raise ValueError("BSP root out of range")
+        if bsp.chunked.dtype != bool or bsp.chunked.shape != bsp.nodes.shape:
+            raise ValueError("bad BSP chunked nodes")
+        refs = bsp.nodes['refs'].astype(np.int64)
+        for side in range(2):
+            is_leaf = bsp.is_leaf(side)
+            if np.any(refs[is_leaf, side] + bsp.face_ref_counts(side)[is_leaf] > len(bsp.face_refs)):
+                raise ValueError("BSP leaf out of range")
+            if np.any(refs[~is_leaf, side] >= len(bsp.nodes)):
+                raise ValueError("BSP child out of range")
+        if face_adj.dtype.kind not in 'ui' or face_adj.shape != (face_count * 3,):
+            raise ValueError("bad face adjacency")
+        if len(face_adj) and (face_adj.min() < -1 or face_adj.max() >= face_count):
+            raise ValueError("face adjacency out of range")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def store(self, key, bsp : BSP, face_adj):
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        bounds = np.array([[bsp.min.x, bsp.min.y, bsp.min.z], [bsp.max.x, bsp.max.y, bsp.max.z]], dtype=np.float32)
+        try:
+            with open(tmp_path, 'wb') as file:
+                np.savez(file, nodes=bsp.nodes, face_refs=bsp.face_refs, bounds=bounds,
+                         root=bsp.root, chunked=bsp.chunked, face_adj=np.asarray(face_adj))
+            os.replace(tmp_path, path)
+        except OSError:
+            return # cache is optional
+        self._prune()
+
+    def _prune(self):
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(self.FILE_EXT)]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            self._remove(entry.path)
 
 
 class Col:
@@ -223,6 +356,12 @@ class Col:
     def __init__(self):
         self.col_type : Col.ColType = None
 
+        # data may be backed by numpy arrays which are only converted
+        # to Face/Vec3 objects when faces/verts are accessed
+        self._face_array : Optional[np.ndarray] = None # (N, 4) vertex indexes and material
+        self._vert_array : Optional[np.ndarray] = None # (N, 3) positions
+        self._vert_material_array : Optional[np.ndarray] = None
+
         self.faces : List[Face] = []
         self.verts : List[Vec3] = []
         self.vert_materials : List[int] = []
@@ -232,18 +371,93 @@ class Col:
         self.max = Vec3()
 
         self.bsp : Optional[BSP] = None
-        self.face_adj : Optional[List[int]] = None
+        self.bsp_strategy : Optional[SplitStrategy] = None # used when BSP gets (re)built, None is the default
+        self.face_adj : Optional[np.ndarray] = None
+
+    @classmethod
+    def from_arrays(cls, col_type, verts, faces, face_materials, vert_materials):
+        obj = cls()
+        obj.col_type = col_type
+        obj._vert_array = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+        obj._face_array = np.column_stack((np.asarray(faces).reshape(-1, 3), face_materials))
+        obj._vert_material_array = np.asarray(vert_materials)
+        return obj
+
+    @property
+    def faces(self) -> List[Face]:
+        if self._face_array is not None:
+            self._faces = Face.from_array(self._face_array)
+            self._face_array = None
+        return self._faces
+
+    @faces.setter
+    def faces(self, faces):
+        self._face_array = None
+        self._faces = faces
+
+    @property
+    def verts(self) -> List[Vec3]:
+        if self._vert_array is not None:
+            self._verts = [Vec3(x, y, z) for x, y, z in self._vert_array.tolist()]
+            self._vert_array = None
+        return self._verts
+
+    @verts.setter
+    def verts(self, verts):
+        self._vert_array = None
+        self._verts = verts
+
+    @property
+    def vert_materials(self) -> List[int]:
+        if self._vert_material_array is not None:
+            self._vert_materials = self._vert_material_array.tolist()
+            self._vert_material_array = None
+        return self._vert_materials
+
+    @vert_materials.setter
+    def vert_materials(self, vert_materials):
+        self._vert_material_array = None
+        self._vert_materials = vert_materials
+
+    def _sort_faces(self):
+        order = np.argsort(self.face_array()[:, 3], kind='stable')
+        if self._face_array is not None:
+            self._face_array = self._face_array[order]
+        else:
+            self._faces = [self._faces[i] for i in order.tolist()]
+        if self.bsp is not None:
+            new_face_idx = np.empty(len(order), dtype=np.int64)
+            new_face_idx[order] = np.arange(len(order))
+            self.bsp.remap_faces(new_face_idx)
+
+    def face_array(self) -> np.ndarray:
+        """(N, 4) array of face vertex indexes and material"""
+        if self._face_array is not None:
+            return self._face_array
+        return Face.to_array(self._faces)
+
+    def vert_array(self) -> np.ndarray:
+        """(N, 3) array of vertex positions"""
+        if self._vert_array is not None:
+            return self._vert_array
+        return Vec3.to_array(self._verts)
+
+    def vert_material_array(self) -> np.ndarray:
+        if self._vert_material_array is not None:
+            return self._vert_material_array
+        return np.array(self._vert_materials, dtype=np.int64)
 
     @classmethod
     def load(cls, f : FileUtils, version):
         obj = cls()
         obj.col_type = f.read_dword()
 
-        obj.faces = load_n_elems(f, Face, count=f.read_dword())
+        facenum = f.read_dword()
+        obj._face_array = f.read_array('H', facenum * 4).reshape(facenum, 4)
 
         vertnum = f.read_dword()
-        obj.verts = load_n_elems(f, Vec3, count=vertnum)
-        obj.vert_materials = [f.read_word() for _ in range(vertnum)]
+        obj._vert_array = f.read_array('f', vertnum * 3).reshape(vertnum, 3)
+        obj._vert_material_array = f.read_array('H', vertnum)
 
         obj.min = Vec3.load(f)
         obj.max = Vec3.load(f)
@@ -251,75 +465,104 @@ class Col:
         bsp_present = int(chr(f.read_byte())) # 0x30 or 0x31 (which is ASCII '0' or '1'... why DICE)
 
         if bsp_present:
-            obj.bsp = BSP.load(f, obj.faces)
+            obj.bsp = BSP.load(f)
 
         # only used in game for drawing visual representation of colmeshes for debugging
         # may be skipped by saving as version == 9
         if version[0] == 0 and version[1] >= 10:
-            obj.face_adj = [f.read_dword(signed=True) for _ in range(f.read_dword())]
+            obj.face_adj = f.read_array('I', f.read_dword(), signed=True)
 
         return obj
 
-    def save(self, f : FileUtils, update_bounds=True, update_bsp=True, update_face_adj=True):
+    def save(self, f : FileUtils, update_bounds=True, update_bsp=True, update_face_adj=True,
+             cache : Optional[ColCache] = None):
+        """with `cache` given, BSP and face adjacency to be rebuilt are taken from it when col data matches"""
         f.write_dword(self.col_type)
 
-        self.faces.sort(key=lambda x: x.material)
-        f.write_dword(len(self.faces))
-        for face in self.faces:
-            face.save(f)
-        f.write_dword(len(self.verts))
-        for vert in self.verts:
-            vert.save(f)
+        self._sort_faces()
+        face_array = self.face_array()
+
+        f.write_dword(len(face_array))
+        Face.save_n(f, face_array)
 
-        if len(self.vert_materials) != len(self.verts):
+        verts = self.vert_array()
+        f.write_dword(len(verts))
+        Vec3.save_n(f, verts)
+
+        vert_materials = self.vert_material_array()
+        if len(vert_materials) != len(verts):
             raise BF2CollMeshException("vertex materials don't match vertex count")
 
-        for vert_mat in self.vert_materials:
-            f.write_word(vert_mat)
+        f.write_array('H', vert_materials)
 
         if update_bounds:
-            _min, _max = calc_bounds(self.verts)
+            _min, _max = calc_bounds(verts)
             _min.save(f)
             _max.save(f)
         else:
             self.min.save(f)
             self.max.save(f)
 
-        if update_bsp or self.bsp is None:
-            self.bsp = BSP.build(self.verts, self.faces)
+        update_bsp = update_bsp or self.bsp is None
+        update_face_adj = update_face_adj or self.face_adj is None or not len(self.face_adj)
+
+        cache_key = None
+        if cache is not None and update_bsp:
+            cache_key = cache.key(self)
+            cached = cache.load(cache_key, len(face_array))
+            if cached is not None:
+                self.bsp, self.face_adj = cached
+                update_bsp = update_face_adj = False
+                cache_key = None
+            else:
+                update_face_adj = True # stored along with the new BSP
+
+        if update_bsp:
+            self.bsp = BSP.build(verts, face_array[:, :3], strategy=self.bsp_strategy)
 
         if self.bsp is None:
             f.write_byte(0x30)
         else:
             f.write_byte(0x31)
-            self.bsp.save(f, self.faces)
-
-        if update_face_adj or not self.face_adj:
-            edge_to_face_idx : Dict[Tuple[int, int], List[Face]] = dict()
-
-            def _edges(face):
-                for (v1, v2) in ((0, 1), (1, 2), (0, 2)):
-                    v1 = face.verts[v1]
-                    v2 = face.verts[v2]
-                    yield (v1, v2) if v1 < v2 else (v2, v1)
-
-            for idx, face in enumerate(self.faces):
-                for edge in _edges(face):
-                    edge_to_face_idx.setdefault(edge, list()).append(idx)
-
-            self.face_adj = list()
-            for idx, face in enumerate(self.faces):
-                for edge in _edges(face):
-                    neigh_faces = edge_to_face_idx[edge]
-                    if len(neigh_faces) == 1:
-                        neigh_face = -1
-                    else:
-                        neigh_face = neigh_faces[1] if neigh_faces[0] == idx else neigh_faces[0]
-                    self.face_adj.append(neigh_face)
-
-            f.write_dword(len(self.face_adj))
-            for face_idx in self.face_adj:
-                f.write_dword(face_idx, signed=True)
+            self.bsp.save(f)
+
+        if update_face_adj:
+            self.face_adj = self.calc_face_adj(face_array[:, :3])
+
+        if cache_key is not None:
+            cache.store(cache_key, self.bsp, self.face_adj)
+
+        f.write_dword(len(self.face_adj))
+        f.write_array('I', self.face_adj, signed=True)
+
+    @staticmethod
+    def calc_face_adj(face_verts) -> np.ndarray:
+        """
+        for each edge (v1-v2, v2-v3, v1-v3) of each face returns index of the other face
+        sharing that edge, the first one when there are more, -1 for boundary edges
+        """
+        face_verts = np.asarray(face_verts, dtype=np.int64).reshape(-1, 3)
+        edges = face_verts[:, [0, 1, 1, 2, 0, 2]].reshape(-1, 2)
+        edges.sort(axis=1)
+        edge_face = np.arange(len(edges)) // 3
+
+        # runs of the same edge keep faces in index order
+        order = np.lexsort((edges[:, 1], edges[:, 0]))
+        sorted_edges = edges[order]
+        is_run_start = np.ones(len(order), dtype=bool)
+        is_run_start[1:] = np.any(sorted_edges[1:] != sorted_edges[:-1], axis=1)
+        run_start = np.flatnonzero(is_run_start)
+        run_len = np.diff(np.append(run_start, len(order)))
+
+        sorted_face = edge_face[order]
+        first = np.repeat(sorted_face[run_start], run_len)
+        second = np.repeat(sorted_face[np.minimum(run_start + 1, len(order) - 1)], run_len)
+        neigh_face = np.where(first == sorted_face, second, first)
+        neigh_face[np.repeat(run_len == 1, run_len)] = -1
+
+        face_adj = np.empty(len(order), dtype=np.int64)
+        face_adj[order] = neigh_face
+        return face_adj
 
 class Geom:
     def __init__(self):
@@ -354,6 +597,8 @@ class GeomPart:
 
 
 class BF2CollMesh:
+    PARALLEL_SUBTREES_MIN_FACES = 20000
+
     def __init__(self, file='', name=''):
         self.geom_parts : List[GeomPart] = [] # each one corresponds to the index of geometry part from the .tweak file
 
@@ -381,11 +626,94 @@ class BF2CollMesh:
             if os.fstat(file.fileno()).st_size != file.tell():
                 raise BF2CollMeshException("Corrupted .collisionmesh file? Reading finished and file pointer != filesize")
 
-    def export(self, export_path, **kwargs):
+    # run by each worker process before its first job. Jobs reference functions and classes of this package
+    # by module name, but importing the package the usual way runs the add-on's __init__, which needs bpy
+    # that's not available in a spawned process, so parent packages are registered as empty ones instead
+    _WORKER_INIT = (
+        "import sys, types\n"
+        "for name, path in packages:\n"
+        "    if name not in sys.modules:\n"
+        "        package = types.ModuleType(name)\n"
+        "        package.__path__ = path\n"
+        "        sys.modules[name] = package\n"
+    )
+
+    @classmethod
+    def _process_pool(cls, max_workers):
+        names = __package__.split('.')
+        packages = list()
+        for i in range(1, len(names) + 1):
+            name = '.'.join(names[:i])
+            packages.append((name, list(sys.modules[name].__path__)))
+        return ProcessPoolExecutor(max_workers, initializer=exec, initargs=(cls._WORKER_INIT, {'packages': packages}))
+
+    def build_bsps(self, max_workers=None, cache : Optional[ColCache] = None):
+        """(re)builds BSPs of all cols using a pool of worker processes, cols found in `cache` are not built"""
+        cols = [col for geom_part in self.geom_parts for geom in geom_part.geoms for col in geom.cols]
+        cache_keys = dict()
+        if cache is not None:
+            uncached_cols = list()
+            for col in cols:
+                col._sort_faces()
+                key = cache.key(col)
+                cached = cache.load(key, len(col.face_array()))
+                if cached is None:
+                    cache_keys[col] = key
+                    uncached_cols.append(col)
+                else:
+                    col.bsp, col.face_adj = cached
+            cols = uncached_cols
+
+        with self._process_pool(max_workers) as executor:
+            # small cols are built by a single worker each, big ones get their subtrees distributed
+            jobs = list()
+            big_cols = list()
+            for col in cols:
+                col._sort_faces() # as in save, BSP references faces by index
+                face_verts = col.face_array()[:, :3]
+                if len(face_verts) < self.PARALLEL_SUBTREES_MIN_FACES:
+                    points = col.vert_array().astype(np.float64)[face_verts]
+                    jobs.append((col, executor.submit(build_from_points, points, col.bsp_strategy)))
+                else:
+                    big_cols.append(col)
+            for col in big_cols:
+                col.bsp = BSP.build(col.vert_array(), col.face_array()[:, :3], executor=executor,
+                                    strategy=col.bsp_strategy)
+            for col, job in jobs:
+                col.bsp = BSP.from_tree(col.vert_array(), len(col.face_array()), job.result())
+
+        if _DEBUG:
+            # must be the same as the serial build done in save
+            for col in cols:
+                bsp = BSP.build(col.vert_array(), col.face_array()[:, :3], strategy=col.bsp_strategy)
+                if (bsp.nodes.astype(BSP.NODE_DTYPE).tobytes() != col.bsp.nodes.astype(BSP.NODE_DTYPE).tobytes() or
+                    bsp.face_refs.astype('<u2').tobytes() != col.bsp.face_refs.astype('<u2').tobytes() or
+                    not np.array_equal(bsp.chunked, col.bsp.chunked)):
+                    raise BF2CollMeshException("BSP: parallel build differs from the serial one")
+
+        for col, key in cache_keys.items():
+            col.face_adj = col.calc_face_adj(col.face_array()[:, :3])
+            cache.store(key, col.bsp, col.face_adj)
+
+    def export(self, export_path, max_workers=1, cache : Optional[ColCache] = None, warn=print, **kwargs):
+        """
+        `max_workers` other than 1 builds BSPs in parallel, None means all CPUs,
+        if worker processes fail BSPs are built serially and `warn` is called with the reason.
+        With `cache` given, BSPs and face adjacency of unchanged cols are reused from previous exports
+        """
+        if max_workers != 1 and kwargs.get('update_bsp', True):
+            try:
+                self.build_bsps(max_workers, cache=cache)
+                kwargs['update_bsp'] = False
+                if cache is not None:
+                    kwargs['update_face_adj'] = False # already taken from the cache or built along with BSP
+            except BrokenProcessPool as e:
+                warn(f"Parallel BSP build failed ({e}), BSPs are built in a single process instead")
+
         with open(export_path, "wb") as file:
             f = FileUtils(file)
             f.write_dword(0)
             f.write_dword(10)
             f.write_dword(len(self.geom_parts))
             for geom_part in self.geom_parts:
-                geom_part.save(f, **kwargs)
+                geom_part.save(f, cache=cache, **kwargs)
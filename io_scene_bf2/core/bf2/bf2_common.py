@@ -1,7 +1,12 @@
 import math
+import numpy as np
 from .fileutils import FileUtils
 
 def load_n_elems(f : FileUtils, struct_type, count, **kwargs):
+    # fixed size types may provide a bulk loader that reads all elements at once
+    load_n = getattr(struct_type, 'load_n', None)
+    if load_n is not None and not kwargs:
+        return load_n(f, count)
     return [struct_type.load(f, **kwargs) for _ in range(count)]
 
 def _calc_bounds(verts, func):
@@ -9,6 +14,8 @@ def _calc_bounds(verts, func):
     return Vec3(*[func(axis) for axis in axes])
 
 def calc_bounds(verts):
+    if isinstance(verts, np.ndarray):
+        return (Vec3(*verts.min(axis=0).tolist()), Vec3(*verts.max(axis=0).tolist()))
     _min = _calc_bounds(verts, min)
     _max = _calc_bounds(verts, max)
     return (_min, _max)
@@ -221,10 +228,26 @@ class Vec3:
         obj.z = f.read_float()
         return obj
 
+    @classmethod
+    def load_n(cls, f : FileUtils, count):
+        data = f.read_array('f', count * 3).reshape(count, 3).tolist()
+        return [cls(x, y, z) for x, y, z in data]
+
     def save(self, f : FileUtils):
         f.write_float(self.x)
         f.write_float(self.y)
         f.write_float(self.z)
+
+    @staticmethod
+    def save_n(f : FileUtils, vecs):
+        if not isinstance(vecs, np.ndarray):
+            vecs = [(v.x, v.y, v.z) for v in vecs]
+        f.write_array('f', vecs)
+
+    @staticmethod
+    def to_array(vecs):
+        """(N, 3) float32 array of given vectors"""
+        return np.array([(v.x, v.y, v.z) for v in vecs], dtype=np.float32).reshape(-1, 3)
     
     def __repr__(self):
         return f"{self.x:.3f}/{self.y:.3f}/{self.z:.3f}"
@@ -8,13 +8,13 @@ import os
 class BF2Mesh:
 
     @staticmethod
-    def load(file : str):
+    def load(file : str, **kwargs):
         ext = os.path.splitext(file)[1].lower()
         if ext == BF2SkinnedMesh._FILE_EXT:
-            return BF2SkinnedMesh(file)
+            return BF2SkinnedMesh(file, **kwargs)
         elif ext == BF2StaticMesh._FILE_EXT:
-            return BF2StaticMesh(file)
+            return BF2StaticMesh(file, **kwargs)
         elif ext == BF2BundledMesh._FILE_EXT:
-            return BF2BundledMesh(file)
+            return BF2BundledMesh(file, **kwargs)
         else:
             raise ValueError(f"unknown mesh type {ext}")
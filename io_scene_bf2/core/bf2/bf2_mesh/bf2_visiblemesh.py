@@ -2,15 +2,20 @@ import os
 import enum
 import struct
 import math
+import mmap
+import numpy as np
 from typing import List, Optional, Tuple
 
 
 from ..fileutils import FileUtils
 from ..bf2_common import Vec3, Mat4, load_n_elems, calc_bounds
+from ..vertex_cache import DEFAULT_CACHE_SIZE, calc_acmr, optimize_faces, first_use_order, remap_faces
 
 class BF2MeshException(Exception):
     pass
 
+_RELEASED = object() # marks buffer views dropped by Material.release_buffers
+
 # copy-pastes from D3DX9 SDK
 class D3DDECLTYPE(enum.IntEnum):
     FLOAT1 = 0  # 1D float expanded to (value, 0., 0., 1.)
@@ -44,6 +49,17 @@ class D3DDECLTYPE(enum.IntEnum):
 
         return _TYPE_TO_FORMAT[self]
 
+    def get_numpy_fmt(self):
+        _TYPE_TO_FORMAT = {
+            D3DDECLTYPE.FLOAT1: ('<f4', (1,)),
+            D3DDECLTYPE.FLOAT2: ('<f4', (2,)),
+            D3DDECLTYPE.FLOAT3: ('<f4', (3,)),
+            D3DDECLTYPE.FLOAT4: ('<f4', (4,)),
+            D3DDECLTYPE.D3DCOLOR: ('u1', (4,)),
+        }
+
+        return _TYPE_TO_FORMAT[self]
+
 
 class D3DDECLUSAGE(enum.IntEnum):
     POSITION = 0
@@ -98,6 +114,77 @@ class Vertex:
         self.sample = None
 
 
+class VertexView:
+    """Vertex-like accessor for a single row of a VertexArray"""
+    __slots__ = ('_array', '_index')
+
+    def __init__(self, array, index):
+        object.__setattr__(self, '_array', array)
+        object.__setattr__(self, '_index', index)
+
+    def __getattr__(self, name):
+        return self._array.get_value(self._index, name)
+
+    def __setattr__(self, name, value):
+        self._array.set_value(self._index, name, value)
+
+
+class VertexArray:
+    """Vertices stored as a numpy structured array, one field per vertex attribute"""
+    _VERTEX_ATTRS = frozenset(vars(Vertex()).keys())
+
+    def __init__(self, data : np.ndarray):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.data)
+        if index < 0 or index >= len(self.data):
+            raise IndexError("vertex index out of range")
+        return VertexView(self, index)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield VertexView(self, i)
+
+    def attribute(self, name) -> Optional[np.ndarray]:
+        """column of all values of the given attribute (e.g. 'position'), None if not present"""
+        if name in self.data.dtype.names:
+            return self.data[name]
+        return None
+
+    def get_value(self, index, name):
+        if name in self.data.dtype.names:
+            return tuple(self.data[name][index].tolist())
+        if name in self._VERTEX_ATTRS:
+            return None
+        raise AttributeError(f"'Vertex' object has no attribute '{name}'")
+
+    def set_value(self, index, name, value):
+        if name not in self.data.dtype.names:
+            raise AttributeError(f"vertex declaration has no '{name}' attribute")
+        if not self.data.flags.writeable: # backed by the file buffer
+            self.data = self.data.copy()
+        self.data[name][index] = value
+
+    @staticmethod
+    def make_dtype(vertex_decl_size, vertex_attributes):
+        names = list()
+        formats = list()
+        offsets = list()
+        for vertex_attr in vertex_attributes:
+            if vertex_attr._flag == VertexAttribute.UNUSED:
+                continue
+            names.append(vertex_attr.decl_usage.name.lower())
+            formats.append(vertex_attr.decl_type.get_numpy_fmt())
+            offsets.append(vertex_attr._offset)
+        return np.dtype({'names': names, 'formats': formats,
+                         'offsets': offsets, 'itemsize': vertex_decl_size})
+
+
 class Material:
 
     def __init__(self):
@@ -105,9 +192,13 @@ class Material:
         self.technique : str = None
 
         self.maps : List[str] = [] # textures
-        self.vertices : List[Vertex] = []
+        self.vertices : List[Vertex] | VertexArray = []
         self.faces : List[Tuple[int]] = []
 
+        # undecoded vertex/index buffer views, see load_vertices and load_faces
+        self._vertex_source = None
+        self._index_source = None
+
         # temp import/export data
         self._vstart : int = None # vertex_buffer offset
         self._istart : int = None # index_buffer offset
@@ -155,59 +246,144 @@ class Material:
         f.write_dword(0) # wite zeros and hope it doesn't break anything
         f.write_dword(0)
 
-    def load_vertices(self, vertex_decl_size, vertex_attributes, vertex_buffer):
-        self.vertices = list()
-        for i in range(self._vstart, self._vstart + self._vnum):
-            vertex = Vertex()
-            self.vertices.append(vertex)
-            for vertex_attr in vertex_attributes:
-                if vertex_attr._flag == VertexAttribute.UNUSED:
-                    continue
-                fmt = vertex_attr.decl_type.get_struct_fmt()
-                size = struct.calcsize(fmt)
-                vstart = i * vertex_decl_size + vertex_attr._offset
-                data_packed = vertex_buffer[vstart:vstart+size]
-                vertex_attr_value = struct.unpack(fmt, data_packed)
-                setattr(vertex, vertex_attr.decl_usage.name.lower(), vertex_attr_value)
-
-    def save_vertices(self, vertex_attributes, vertex_buffer, vstart):
+    @property
+    def vertices(self) -> List[Vertex] | VertexArray:
+        if self._vertex_source is _RELEASED:
+            raise BF2MeshException("Material vertices were not decoded before the mesh was closed")
+        if self._vertex_source is not None:
+            self._vertices = self._decode_vertices(*self._vertex_source)
+            self._vertex_source = None
+        return self._vertices
+
+    @vertices.setter
+    def vertices(self, value):
+        self._vertex_source = None
+        self._vertices = value
+
+    @property
+    def faces(self) -> List[Tuple[int]]:
+        if self._index_source is _RELEASED:
+            raise BF2MeshException("Material faces were not decoded before the mesh was closed")
+        if self._index_source is not None:
+            self._decode_faces(self._index_source)
+            self._index_source = None
+        return self._faces
+
+    @faces.setter
+    def faces(self, value):
+        self._index_source = None
+        self._faces = value
+
+    def load_vertices(self, vertex_dtype, vertex_buffer, lazy=False):
+        # keep only the view of this material's vertex range, decode it on first access when lazy
+        start = self._vstart * vertex_dtype.itemsize
+        end = start + self._vnum * vertex_dtype.itemsize
+        self._vertex_source = (vertex_dtype, vertex_buffer[start:end])
+        if not lazy:
+            self.vertices
+            self.release_buffers() # copy out of the file buffer so it can be freed
+
+    def release_buffers(self):
+        """
+        detach from the file buffers: decoded vertices are copied out of them, undecoded
+        vertex and index views are dropped and accessing them afterwards raises
+        """
+        if isinstance(self._vertices, VertexArray) and not self._vertices.data.flags.owndata:
+            self._vertices.data = self._vertices.data.copy()
+        if self._vertex_source is not None and self._vertex_source is not _RELEASED:
+            self._vertex_source[1].release()
+            self._vertex_source = _RELEASED
+        if self._index_source is not None:
+            self._index_source = _RELEASED
+
+    def _decode_vertices(self, vertex_dtype, vertex_buffer):
+        if len(vertex_buffer) != self._vnum * vertex_dtype.itemsize:
+            raise BF2MeshException("Vertex range of a material exceeds the vertex buffer")
+        return VertexArray(np.frombuffer(vertex_buffer, dtype=vertex_dtype, count=self._vnum))
+
+    def save_vertices(self, vertex_dtype, vstart) -> np.ndarray:
+        """returns this material's interleaved vertex block"""
         self._vstart = vstart
         self._vnum = len(self.vertices)
-        for vertex in self.vertices:
-            for vertex_attr in vertex_attributes:
-                if vertex_attr._flag == VertexAttribute.UNUSED:
-                    continue
-                fmt = vertex_attr.decl_type.get_struct_fmt()
-                vertex_attr_value = getattr(vertex, vertex_attr.decl_usage.name.lower())
-                if vertex_attr_value is None:
-                    raise BF2MeshException(f"Vertex missing '{vertex_attr.decl_usage.name}' attribute value")
-                vertex_buffer += struct.pack(fmt, *vertex_attr_value)
+        vertex_block = np.zeros(self._vnum, dtype=vertex_dtype)
+        for attr_name in vertex_dtype.names:
+            if isinstance(self.vertices, VertexArray):
+                values = self.vertices.attribute(attr_name)
+            else:
+                values = [getattr(vertex, attr_name) for vertex in self.vertices]
+                if any(value is None for value in values):
+                    values = None
+            if values is None:
+                raise BF2MeshException(f"Vertex missing '{attr_name.upper()}' attribute value")
+            if self._vnum:
+                vertex_block[attr_name] = values
+        return vertex_block
+
+    @property
+    def vertex_count(self) -> int:
+        """number of vertices as stored in the file, known also for probed meshes"""
         return self._vnum
 
-    def load_faces(self, index_buffer):
-        self.faces = list()
-        for i in range(self._istart, self._istart + self._inum, 3):
-            v1 = index_buffer[i + 0]
-            v2 = index_buffer[i + 1]
-            v3 = index_buffer[i + 2]
-            self.faces.append((v1, v2, v3))
+    @property
+    def index_count(self) -> int:
+        """number of indices as stored in the file (of a single face set for alpha blend), known also for probed meshes"""
+        return self._inum
+
+    def load_faces(self, index_buffer, lazy=False):
+        self._index_source = index_buffer
+        if not lazy:
+            self.faces
 
-    def save_faces(self, index_buffer, istart):
+    def _decode_faces(self, index_buffer):
+        indices = index_buffer[self._istart:self._istart + self._inum].tolist()
+        self._faces = list(zip(indices[0::3], indices[1::3], indices[2::3]))
+
+    def save_faces(self, istart) -> np.ndarray:
+        """returns this material's index block"""
         self._inum = len(self.faces) * 3
         self._istart = istart
-        for face in self.faces:
-            index_buffer.append(face[0])
-            index_buffer.append(face[1])
-            index_buffer.append(face[2])
-        return self._inum
+        return _make_index_block(self.faces)
+
+    def optimize_vertex_cache(self, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        reorders faces for the post-transform vertex cache and vertices into first-use order,
+        returns ACMR before and after
+        """
+        acmr_before = calc_acmr(self.faces, cache_size)
+        faces = optimize_faces(self.faces, len(self.vertices), cache_size)
+        acmr_after = calc_acmr(faces, cache_size)
+        if acmr_after < acmr_before: # already well ordered faces might not get any better
+            self.faces = faces
+        else:
+            acmr_after = acmr_before
+        self._reorder_vertices(first_use_order(self.faces, len(self.vertices)))
+        return acmr_before, acmr_after
+
+    def _reorder_vertices(self, vertex_order):
+        if isinstance(self.vertices, VertexArray):
+            self.vertices = VertexArray(self.vertices.data[vertex_order])
+        else:
+            self.vertices = [self.vertices[i] for i in vertex_order.tolist()]
+        self.faces = remap_faces(self.faces, vertex_order)
 
     def calc_bounds(self):
         if not self.vertices:
             raise ValueError("Cannot calculate bounds vertices is empty")
+        if isinstance(self.vertices, VertexArray):
+            positions = self.vertices.attribute('position')
+            self._min = Vec3(*positions.min(axis=0).tolist())
+            self._max = Vec3(*positions.max(axis=0).tolist())
+            return (self._min, self._max)
         verts = [vertex.position for vertex in self.vertices]
         self._min, self._max = calc_bounds(verts)
         return (self._min, self._max)
 
+def _make_index_block(faces):
+    index_block = np.array(faces, dtype=np.int64).reshape(-1)
+    if index_block.size and (index_block.min() < 0 or index_block.max() > 0xFFFF):
+        raise BF2MeshException("Vertex index out of 16-bit range, material has too many vertices")
+    return index_block.astype('<u2')
+
 class Plane:
     def __init__(self, point, normal) -> None:
         self.point = point
@@ -225,7 +401,7 @@ class MaterialWithTransparency(Material):
     def __init__(self) -> None:
         self.alpha_mode : Material.AlphaMode = None
         # extra sets of pre-sorted faces, only used for materials with alpha blend
-        self.face_sets : Optional[List[List[int]]] = None
+        self._face_sets : Optional[List[List[int]]] = None
 
         # temp import/export data
         self._alpha_blend_indexnum = None
@@ -239,32 +415,51 @@ class MaterialWithTransparency(Material):
         obj._alpha_blend_indexnum = alpha_blend_indexnum                
         return obj
 
-    def load_faces(self, index_buffer):
+    @property
+    def face_sets(self) -> Optional[List[List[int]]]:
+        if self._index_source is not None:
+            self.faces # decode
+        return self._face_sets
+
+    @face_sets.setter
+    def face_sets(self, value):
+        self._face_sets = value
+
+    def _decode_faces(self, index_buffer):
         if self.alpha_mode == self.AlphaMode.ALPHA_BLEND:
-            self.face_sets = list()
+            self._face_sets = list()
             for i in range(self._alpha_blend_indexnum):
-                face_set = list()
-                self.face_sets.append(face_set)
                 istart = self._istart + i * self._inum
-                for i in range(istart, istart + self._inum, 3):
-                    v1 = index_buffer[i + 0]
-                    v2 = index_buffer[i + 1]
-                    v3 = index_buffer[i + 2]
-                    face_set.append((v1, v2, v3))
-            self.faces = self.face_sets[0]
+                indices = index_buffer[istart:istart + self._inum].tolist()
+                self._face_sets.append(list(zip(indices[0::3], indices[1::3], indices[2::3])))
+            self._faces = self._face_sets[0]
         else:
-            super().load_faces(index_buffer)
+            super()._decode_faces(index_buffer)
 
-    def save_faces(self, index_buffer, istart):         
+    def save_faces(self, istart) -> np.ndarray:
         if self.alpha_mode == self.AlphaMode.ALPHA_BLEND:
-            return self._save_faces_alpha_blend(index_buffer, istart)
+            return self._save_faces_alpha_blend(istart)
         else:
-            return super().save_faces(index_buffer, istart)
+            return super().save_faces(istart)
 
     def save(self, f : FileUtils):
         f.write_dword(self.alpha_mode)
         super().save(f)
 
+    def optimize_vertex_cache(self, cache_size=DEFAULT_CACHE_SIZE):
+        if self.alpha_mode != self.AlphaMode.ALPHA_BLEND:
+            return super().optimize_vertex_cache(cache_size)
+        # face order is dictated by the depth sorted face_sets, only vertices can be reordered
+        acmr = calc_acmr(self.faces, cache_size)
+        self._reorder_vertices(first_use_order(self.faces, len(self.vertices)))
+        return acmr, acmr
+
+    def _reorder_vertices(self, vertex_order):
+        face_sets = self.face_sets
+        super()._reorder_vertices(vertex_order)
+        if face_sets:
+            self.face_sets = [remap_faces(face_set, vertex_order) for face_set in face_sets]
+
     def _get_sorting_planes(self):
         planes_count = self.ALPHA_BLEND_FACE_SET_COUNT
         self.calc_bounds()
@@ -282,31 +477,34 @@ class MaterialWithTransparency(Material):
             sorting_planes.append(Plane(plane_point, plane_normal))
         return sorting_planes
 
-    def _save_faces_alpha_blend(self, index_buffer, istart):
+    def _save_faces_alpha_blend(self, istart):
         sorting_planes = self._get_sorting_planes()
         self._inum = len(self.faces) * 3
         self._istart = istart
 
-        face_mid_points = list()
-        for face in self.faces:
-            face_center = Vec3()
-            for v in face:
-                face_center.add(Vec3(*self.vertices[v].position))
-            face_center.scale(1.0 / 3)
-            face_mid_points.append(face_center)
-
-        for plane in sorting_planes:
-            face_dist_to_plane = list()
-            for face, face_center in zip(self.faces, face_mid_points):
-                delta = face_center.copy().sub(plane.point)
-                dist = abs(delta.dot_product(plane.normal))
-                face_dist_to_plane.append(dist)
-
-            for _, face in sorted(zip(face_dist_to_plane, self.faces)):
-                index_buffer.append(face[0])
-                index_buffer.append(face[1])
-                index_buffer.append(face[2])
-        return self._inum * len(sorting_planes)
+        faces = np.array(self.faces, dtype=np.int64).reshape(-1, 3)
+        if isinstance(self.vertices, VertexArray):
+            positions = self.vertices.attribute('position').astype(np.float64)
+        else:
+            positions = np.array([vertex.position for vertex in self.vertices], dtype=np.float64).reshape(-1, 3)
+
+        face_mid_points = (positions[faces[:, 0]] + positions[faces[:, 1]] + positions[faces[:, 2]]) * (1.0 / 3)
+
+        # distance of every face center to every plane as one (faces x planes) product,
+        # evaluated per axis rather than with matmul so that the rounding matches Vec3.dot_product
+        plane_points = np.array([tuple(plane.point) for plane in sorting_planes], dtype=np.float64)
+        plane_normals = np.array([tuple(plane.normal) for plane in sorting_planes], dtype=np.float64)
+        delta = face_mid_points[:, np.newaxis, :] - plane_points[np.newaxis, :, :]
+        face_dist_to_plane = np.abs(delta[:, :, 0] * plane_normals[:, 0] +
+                                    delta[:, :, 1] * plane_normals[:, 1] +
+                                    delta[:, :, 2] * plane_normals[:, 2])
+
+        # faces at equal distance are ordered by their vertex indices (lexicographically)
+        face_sets = list()
+        for plane_idx in range(len(sorting_planes)):
+            order = np.lexsort((faces[:, 2], faces[:, 1], faces[:, 0], face_dist_to_plane[:, plane_idx]))
+            face_sets.append(_make_index_block(faces[order]))
+        return np.concatenate(face_sets)
 
 class Lod:
     _MATERIAL_TYPE = Material
@@ -434,14 +632,31 @@ class MeshHeader:
         f.write_byte(0)
 
 
+def _map_file(file):
+    with open(file, mode='rb') as fo:
+        try:
+            return mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e: # empty file
+            raise BF2MeshException(f"Cannot map '{file}': {e}") from e
+
+
 class BF2VisibleMesh():
     _VERSION = None
     _GEOM_TYPE = Geom
     _FILE_EXT = ''
 
-    def __init__(self, file='', name=''):
+    def __init__(self, file='', name='', mmap=False, geoms=None, lods=None):
+        """
+        mmap: memory-map the file, vertex and index buffers are kept as views over the mapping
+              and decoded only when a material's `vertices` or `faces` are first accessed.
+              NOTE: the file stays mapped (and locked on Windows) until `close()` is called,
+              use the mesh as a context manager to have it closed automatically
+        geoms: indexes of geoms to load, others are skipped and not present in `self.geoms`
+        lods: indexes of lods to load (in every loaded geom), others are skipped
+        """
         self.geoms : List[Geom] = []
         self.vertex_attributes : List[VertexAttribute] = []
+        self._mmap = None
 
         if name:
             self.name = name
@@ -453,21 +668,78 @@ class BF2VisibleMesh():
         if not file:
             return
 
+        if mmap:
+            self._mmap = _map_file(file)
+            try:
+                self.load(FileUtils(self._mmap), lazy=True, geoms=geoms, lods=lods)
+                if len(self._mmap) != self._mmap.tell():
+                    raise BF2MeshException(f"Corrupted {self._FILE_EXT} file? Reading finished and file pointer != filesize")
+            except Exception:
+                # views in the traceback frames may still export the mapping, it gets
+                # unmapped once they are gone
+                self._mmap = None
+                raise
+            return
+
         with open(file, mode='rb') as fo:
             f = FileUtils(fo)
-            self.load(f)
+            self.load(f, geoms=geoms, lods=lods)
 
             if os.fstat(fo.fileno()).st_size != fo.tell():
                 raise BF2MeshException(f"Corrupted {self._FILE_EXT} file? Reading finished and file pointer != filesize")
 
+    def close(self):
+        """
+        release the file buffers of a lazily loaded mesh (unmaps the file when loaded with mmap),
+        already decoded material data is copied and stays valid, undecoded data is lost
+        """
+        for geom in self.geoms:
+            for lod in geom.lods:
+                for mat in lod.materials:
+                    mat.release_buffers()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError as e:
+                raise BF2MeshException(f"Cannot unmap '{self.name}', its vertex or index data is still referenced: {e}") from e
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.close()
+
     @classmethod
-    def load_from(cls, name, data):
+    def load_from(cls, name, data, lazy=False, geoms=None, lods=None):
         f = FileUtils(data)
         mesh = cls(name=name)
-        mesh.load(f)
+        mesh.load(f, lazy=lazy, geoms=geoms, lods=lods)
         return mesh
 
-    def load(self, f : FileUtils):
+    @classmethod
+    def probe(cls, path_or_stream, name=''):
+        """
+        load only the mesh structure: geoms, lods, vertex declaration, bounds and material
+        headers (fx, technique, maps, vertex/index counts), vertex and index buffers are skipped.
+        Materials of the returned mesh have no `vertices` or `faces`
+        """
+        if isinstance(path_or_stream, str):
+            mesh = cls(name=name or os.path.splitext(os.path.basename(path_or_stream))[0])
+            with open(path_or_stream, 'rb') as fo:
+                mesh._probe(FileUtils(fo))
+        else:
+            mesh = cls(name=name or os.path.splitext(os.path.basename(getattr(path_or_stream, 'name', '')))[0])
+            mesh._probe(FileUtils(path_or_stream))
+        return mesh
+
+    def _probe(self, f : FileUtils):
+        version, vertex_dtype = self._load_header(f)
+        f.skip(vertex_dtype.itemsize * f.read_dword()) # vertex buffer
+        f.skip(2 * f.read_dword()) # index buffer
+        self._load_lods(f, version)
+
+    def _load_header(self, f : FileUtils):
         version = MeshHeader.load(f)
 
         self.geoms = load_n_elems(f, self._GEOM_TYPE, count=f.read_dword())
@@ -484,10 +756,10 @@ class BF2VisibleMesh():
             raise BF2MeshException(f"Unsupported primitive type: {D3DPRIMITIVETYPE(primitive_type).name}")
 
         vertex_decl_size = f.read_dword() # byte size of Vertex declaration
+        vertex_dtype = VertexArray.make_dtype(vertex_decl_size, self.vertex_attributes)
+        return version, vertex_dtype
 
-        vertex_buffer : bytes = f.read_raw(vertex_decl_size * f.read_dword())
-        index_buffer : List[int] = f.read_word(count=f.read_dword())
-
+    def _load_lods(self, f : FileUtils, version):
         alpha_blend_indexnum = None
         if issubclass(self._GEOM_TYPE._LOD_TYPE._MATERIAL_TYPE, MaterialWithTransparency):
             alpha_blend_indexnum = f.read_dword()
@@ -502,9 +774,41 @@ class BF2VisibleMesh():
         for geom in self.geoms:
             for lod in geom.lods:
                 lod.load_materials(f, version=version, alpha_blend_indexnum=alpha_blend_indexnum)
+
+    def load(self, f : FileUtils, lazy=False, geoms=None, lods=None):
+        version, vertex_dtype = self._load_header(f)
+
+        vertex_buffer : memoryview = f.read_view(vertex_dtype.itemsize * f.read_dword())
+        index_view : memoryview = f.read_view(2 * f.read_dword())
+        index_buffer : np.ndarray = np.frombuffer(index_view, dtype='<u2')
+
+        self._load_lods(f, version)
+
+        geoms = None if geoms is None else set(geoms)
+        lods = None if lods is None else set(lods)
+
+        for geom_idx, geom in enumerate(self.geoms):
+            for lod_idx, lod in enumerate(geom.lods):
+                if geoms is not None and geom_idx not in geoms:
+                    continue
+                if lods is not None and lod_idx not in lods:
+                    continue
                 for mat in lod.materials:
-                    mat.load_vertices(vertex_decl_size, self.vertex_attributes, vertex_buffer)
-                    mat.load_faces(index_buffer)
+                    mat.load_vertices(vertex_dtype, vertex_buffer, lazy=lazy)
+                    mat.load_faces(index_buffer, lazy=lazy)
+
+        if not lazy:
+            # everything got copied, don't keep exports of the underlying buffer alive
+            del index_buffer
+            index_view.release()
+            vertex_buffer.release()
+
+        # drop everything that wasn't selected
+        if geoms is not None:
+            self.geoms = [geom for geom_idx, geom in enumerate(self.geoms) if geom_idx in geoms]
+        if lods is not None:
+            for geom in self.geoms:
+                geom.lods = [lod for lod_idx, lod in enumerate(geom.lods) if lod_idx in lods]
 
     def export(self, export_path):
         with open(export_path, "wb") as file:
@@ -535,8 +839,9 @@ class BF2VisibleMesh():
             f.write_dword(D3DPRIMITIVETYPE.TRIANGLELIST)
             f.write_dword(vertex_decl_size)
 
-            vertex_buffer : bytearray = bytearray()
-            index_buffer : List[int] = list()
+            vertex_dtype = VertexArray.make_dtype(vertex_decl_size, self.vertex_attributes)
+            vertex_blocks : List[np.ndarray] = list()
+            index_blocks : List[np.ndarray] = list()
 
             has_alpha_blend_material = False
 
@@ -548,13 +853,17 @@ class BF2VisibleMesh():
                         if isinstance(mat, MaterialWithTransparency):
                             is_alpha_blend = mat.alpha_mode == MaterialWithTransparency.AlphaMode.ALPHA_BLEND
                             has_alpha_blend_material |= is_alpha_blend
-                        vstart += mat.save_vertices(self.vertex_attributes, vertex_buffer, vstart)
-                        istart += mat.save_faces(index_buffer, istart)
-
-            f.write_dword(int(len(vertex_buffer) / vertex_decl_size))
-            f.write_raw(bytes(vertex_buffer))
-            f.write_dword(len(index_buffer))
-            f.write_word(index_buffer)
+                        vertex_blocks.append(mat.save_vertices(vertex_dtype, vstart))
+                        vstart += len(vertex_blocks[-1])
+                        index_blocks.append(mat.save_faces(istart))
+                        istart += len(index_blocks[-1])
+
+            f.write_dword(vstart)
+            for vertex_block in vertex_blocks:
+                f.write_raw(vertex_block.tobytes())
+            f.write_dword(istart)
+            for index_block in index_blocks:
+                f.write_raw(index_block.tobytes())
 
             if issubclass(self._GEOM_TYPE._LOD_TYPE._MATERIAL_TYPE, MaterialWithTransparency):
                 if has_alpha_blend_material:
@@ -1,216 +1,428 @@
 from typing import List, Tuple, Optional
-from bisect import bisect_left, bisect_right
-from .bf2_common import Vec3
-
-class PolyType:
-    FRONT = 0,
-    BACK = 1,
-    COPLANAR = 2,
-    STRADDLE = 3
-
-class Poly:
-    __slots__ = ('face_idx', 'indexes', 'points',
-                 'center', 'normal', 'd',
-                 'min_coord', 'max_coord')
-
-    def __init__(self, face, verts, face_idx):
-        self.face_idx = face_idx
-        self.indexes = face
-        self.points : Tuple[Vec3] = (
-            verts[face[0]].copy(),
-            verts[face[1]].copy(),
-            verts[face[2]].copy()
-        )
-
-        self.center = Vec3()
-        for point in self.points:
-            self.center.add(point)
-        self.center.scale(1.0 / len(self.points))
-
-        a = self.points[0].copy().sub(self.points[1])
-        b = self.points[2].copy().sub(self.points[1])
-        self.normal = a.cross_product(b)
-        self.normal.normalize()
-
-        self.d = -self.normal.dot_product(self.center)
-
-        self.min_coord = Vec3(
-            min(self.points[0].x, self.points[1].x, self.points[2].x),
-            min(self.points[0].y, self.points[1].y, self.points[2].y),
-            min(self.points[0].z, self.points[1].z, self.points[2].z),
-        )
-        self.max_coord = Vec3(
-            max(self.points[0].x, self.points[1].x, self.points[2].x),
-            max(self.points[0].y, self.points[1].y, self.points[2].y),
-            max(self.points[0].z, self.points[1].z, self.points[2].z),
-        )
-
-
-class Plane:
-    __slots__ = ('val', 'axis', 'normal', 'point', 'd')
-
-    def __init__(self, val, axis):
-        self.val = val
-        self.axis = axis
-
-        self.normal = Vec3()
-        self.normal[axis] = 1
-        self.point = Vec3()
-        self.point[axis] = val
-        self.d = -self.normal.dot_product(self.point)
-
-    def classify(self, poly):
-        d = self.axis
-        s = self.val
-        l = poly.min_coord[d]
-        r = poly.max_coord[d]
-        if l < s < r:
-            return PolyType.STRADDLE
-        if l == r == s:
-            return PolyType.COPLANAR
-        if poly.center[d] < s:
-            return PolyType.FRONT
-        if poly.center[d] > s:
-            return PolyType.BACK
-        return PolyType.COPLANAR
-
-
-class Node:
-    __slots__ = ('front_faces', 'back_faces', 'front_node',
-                 'back_node', 'split_plane')
-
-    def __init__(self, split_plane):
-        self.front_faces : List[Poly] = None
-        self.back_faces : List[Poly] = None
-        self.front_node : Optional[Node] = None
-        self.back_node : Optional[Node] = None
-        self.split_plane : Plane = split_plane
-
-class BspBuilder:
-    __slots__ = ('verts', 'faces', 'complanar_weigth',
-                 'intersect_weight', 'split_weight',
-                 'min_split_metric', 'root')
-
-    def __init__(self, verts : Tuple[float], faces : Tuple[int],
-                 complanar_weigth = 0.5, intersect_weight = 1.0,
+from concurrent.futures import Executor
+import numpy as np
+
+MAX_LEAF_FACES = 0xFF # face ref count of a leaf is stored in 8 bits
+MAX_FORCED_SPLIT_DEPTH = 16 # forced splits along a path from root, each may copy some polys to both sides
+MAX_DEPTH = 64 # nodes this deep are not split by the strategy anymore, only chunked when too big for a leaf
+
+class SplitCandidates:
+    """
+    Candidate split planes of all nodes of a tree level, one for each unique coordinate of polys
+    on each axis of each node, sorted by node. Poly counts are per candidate plane, `front` polys lie
+    entirely on the lower coordinate side of the plane, `back` polys on the higher one, `intersect` polys
+    straddle it and `coplanar` polys lie in it (straddling and coplanar polys end up on both sides)
+    """
+    __slots__ = ('positions', 'axes', 'nodes', 'front', 'back', 'intersect', 'coplanar', 'total',
+                 'node_min', 'node_max')
+
+    def __init__(self, positions, axes, nodes, front, back, intersect, coplanar, total, node_min, node_max):
+        self.positions = positions
+        self.axes = axes
+        self.nodes = nodes
+        self.front = front
+        self.back = back
+        self.intersect = intersect
+        self.coplanar = coplanar
+        self.total = total # polys of the candidate's node
+        self.node_min = node_min # (node, axis) bounds of each node's polys
+        self.node_max = node_max
+
+
+class SplitStrategy:
+    """
+    Decides where nodes get split, lowest cost candidate plane of each node is picked,
+    nodes with no finite cost candidate become leaves (unless they have too many polys for one,
+    see BspBuilder._find_best_split_planes).
+    Strategies get pickled to worker processes for parallel builds so should only hold plain data
+    """
+    def split_costs(self, candidates : SplitCandidates) -> np.ndarray:
+        raise NotImplementedError()
+
+
+class GreedySplit(SplitStrategy):
+    """weighted sum of front/back imbalance and ratios of intersected and coplanar polys"""
+    def __init__(self, complanar_weigth = 0.5, intersect_weight = 1.0,
                  split_weight = 1.0, min_split_metric = 0.5):
-        self.verts = [Vec3(*v) for v in verts]
-        self.faces = faces
-
         self.complanar_weigth = complanar_weigth
         self.intersect_weight = intersect_weight
         self.split_weight = split_weight
         self.min_split_metric = min_split_metric
 
-        polys = list()
-        for face_idx, face in enumerate(faces):
-            polys.append(Poly(face, self.verts, face_idx))
+    def split_costs(self, c : SplitCandidates):
+        split_ratio = c.front / np.maximum(c.front + c.back, 1)
+        intersect_ratio = c.intersect / c.total
+        coplanar_ratio = c.coplanar / c.total
+
+        metric = (np.abs(0.5 - split_ratio) * self.split_weight +
+                  intersect_ratio * self.intersect_weight +
+                  coplanar_ratio * self.complanar_weigth)
+        metric[metric > self.min_split_metric] = np.inf
+        return metric
+
+
+class MedianSplit(SplitStrategy):
+    """splits nodes with more than `max_leaf_faces` polys in half, along the longest axis if possible"""
+    def __init__(self, max_leaf_faces = 8):
+        self.max_leaf_faces = max_leaf_faces
+
+    def split_costs(self, c : SplitCandidates):
+        extent = c.node_max - c.node_min
+        longest_axis = extent.argmax(axis=1)[c.nodes]
+        cost = np.abs(c.front - c.back) / c.total + (c.axes != longest_axis)
+        cost[c.total <= self.max_leaf_faces] = np.inf
+        # a side getting all polys makes no progress, straddling ones would be copied over and over
+        shared = c.intersect + c.coplanar
+        cost[np.maximum(c.front, c.back) + shared >= c.total] = np.inf
+        cost[shared >= np.minimum(c.front, c.back)] = np.inf
+        return cost
+
+
+class SahSplit(SplitStrategy):
+    """
+    surface area heuristic, expected cost of a random ray through the node is estimated from the
+    areas of child bounds relative to the node's, nodes cheaper to test as a whole are not split
+    """
+    def __init__(self, traversal_cost = 1.0, intersect_cost = 1.0):
+        self.traversal_cost = traversal_cost
+        self.intersect_cost = intersect_cost
+
+    def split_costs(self, c : SplitCandidates):
+        node_min = c.node_min[c.nodes]
+        node_max = c.node_max[c.nodes]
+        rows = np.arange(len(c.positions))
+        front_max = node_max.copy()
+        front_max[rows, c.axes] = c.positions
+        back_min = node_min.copy()
+        back_min[rows, c.axes] = c.positions
+
+        node_area = np.maximum(surface_area(node_min, node_max), 1e-12)
+        shared = c.intersect + c.coplanar
+        cost = self.traversal_cost + self.intersect_cost * (
+            surface_area(node_min, front_max) * (c.front + shared) +
+            surface_area(back_min, node_max) * (c.back + shared)) / node_area
+        cost[cost >= self.intersect_cost * c.total] = np.inf
+        return cost
+
+
+def surface_area(mins, maxs):
+    """surface area of (N, 3) boxes"""
+    extent = np.maximum(maxs - mins, 0)
+    return 2 * (extent[:, 0] * extent[:, 1] + extent[:, 1] * extent[:, 2] + extent[:, 2] * extent[:, 0])
 
-        self.root = self._build_bsp_tree(polys)
 
-    def _find_best_split_plane(self, polys : List[Poly]) -> Plane:
-        best_metric = float("inf")
-        best_split_plane = None
-        total_polys = len(polys)
+class BspBuilder:
+    """
+    Builds the tree as flat node arrays, node 0 is the root (no nodes means no split was found).
+    For each side (front/back) of a node `children` holds index of the child node or -1,
+    in which case the side is a leaf and `leaf_faces` holds its face indexes.
+    `chunked` nodes had their polys divided in halves, polys straddling their plane are only on one side
+    """
+    __slots__ = ('verts', 'faces', 'strategy', 'max_depth',
+                 'split_vals', 'split_axes', 'children', 'leaf_faces', 'chunked',
+                 '_poly_min', '_poly_max', '_poly_center')
+
+    # point event kinds
+    _MIN = 1
+    _MAX = 2
 
+    def __init__(self, verts : Tuple[float], faces : Tuple[int],
+                 strategy : Optional[SplitStrategy] = None,
+                 executor : Optional[Executor] = None, parallel_depth = 3, max_depth = MAX_DEPTH):
+        """
+        `strategy` defaults to GreedySplit. With `executor` given, subtrees below `parallel_depth`
+        are built by it, it should be a ProcessPoolExecutor as the build is CPU bound
+        """
+        self.verts = verts
+        self.faces = faces
+        self.strategy = strategy or GreedySplit()
+        self.max_depth = max_depth
+
+        # (poly, point, axis)
+        points = np.array(verts, dtype=np.float64).reshape(-1, 3)[np.array(faces, dtype=np.int64).reshape(-1, 3)]
+        self._poly_min = points.min(axis=1)
+        self._poly_max = points.max(axis=1)
+        self._poly_center = (points[:, 0] + points[:, 1] + points[:, 2]) * (1.0 / 3)
+
+        self.split_vals : List[float] = list()
+        self.split_axes : List[int] = list()
+        self.children : List[List[int]] = list()
+        self.leaf_faces : List[List[Optional[List[int]]]] = list()
+        self.chunked : List[bool] = list()
+
+        self._build_bsp_tree(points, executor, parallel_depth)
+
+    def _add_node(self, val, axis, parent, chunked=False):
+        node_idx = len(self.split_vals)
+        self.split_vals.append(val)
+        self.split_axes.append(axis)
+        self.children.append([-1, -1])
+        self.leaf_faces.append([None, None])
+        self.chunked.append(chunked)
+        if parent is not None:
+            parent_idx, side = parent
+            self.children[parent_idx][side] = node_idx
+        return node_idx
+
+    def _add_leaf(self, faces, parent):
+        if parent is not None:
+            parent_idx, side = parent
+            self.leaf_faces[parent_idx][side] = faces
+
+    def _add_subtree(self, polys, subtree, parent):
+        """attaches tree built from a subset of polys (see build_from_points) to parent"""
+        split_vals, split_axes, children, leaf_faces, chunked = subtree
+        if not split_vals:
+            self._add_leaf(polys, parent)
+            return
+        offset = len(self.split_vals)
+        self.split_vals.extend(split_vals)
+        self.split_axes.extend(split_axes)
+        self.chunked.extend(chunked)
+        for node_children, node_leaf_faces in zip(children, leaf_faces):
+            self.children.append([-1 if c < 0 else c + offset for c in node_children])
+            self.leaf_faces.append([None if faces is None else [polys[i] for i in faces] for faces in node_leaf_faces])
+        if parent is not None:
+            parent_idx, side = parent
+            self.children[parent_idx][side] = offset
+
+    def _build_bsp_tree(self, points, executor, parallel_depth):
+        """
+        builds the tree level by level, all nodes of a level are processed at once.
+        Every node of a level owns a run of 'instances' (polys, a straddling poly has one on each side)
+        and a run of point events sorted by axis and coordinate, which are only filtered going down
+        """
+        poly_count = len(points)
+        inst_poly = np.arange(poly_count)
+        inst_node = np.zeros(poly_count, dtype=np.int64)
+
+        # all points of all polys sorted once per axis, events keep track which
+        # point is the min and max coordinate of its poly on that axis
+        poly_of_point = np.repeat(inst_poly, 3)
+        point_of_poly = np.tile(np.arange(3), poly_count)
+        events = list()
         for axis in range(3):
-            positions = sorted(set(
-                point[axis] for poly in polys for point in poly.points
-            ))
-            M = len(positions)
-            if M == 0:
-                continue
-
-            back_diff = [0] * (M + 1)
-            intersect_diff = [0] * (M + 1)
-            front_diff = [0] * (M + 1)
-            coplanar_at = [0] * M
-
-            for poly in polys:
-                l = poly.min_coord[axis]
-                r = poly.max_coord[axis]
-
-                if l == r:
-                    idx = bisect_left(positions, l)
-                    if idx < M and positions[idx] == l:
-                        back_diff[0] += 1
-                        back_diff[idx] -= 1
-                        coplanar_at[idx] += 1
-                        front_diff[idx + 1] += 1
-                    else:
-                        back_diff[0] += 1
-                        back_diff[idx] -= 1
-                        front_diff[idx] += 1
-                else:
-                    back_end = bisect_right(positions, l)
-                    front_start = bisect_left(positions, r)
-
-                    if back_end > 0:
-                        back_diff[0] += 1
-                        back_diff[back_end] -= 1
-
-                    if back_end < front_start:
-                        intersect_diff[back_end] += 1
-                        intersect_diff[front_start] -= 1
-
-                    if front_start < M:
-                        front_diff[front_start] += 1
-
-            back = intersect = front = 0
-            for i in range(M):
-                back += back_diff[i]
-                intersect += intersect_diff[i]
-                front += front_diff[i]
-                coplanar = coplanar_at[i]
-
-                if front == 0 or back == 0:
-                    continue
-
-                split_ratio = front / (front + back)
-                intersect_ratio = intersect / total_polys
-                coplanar_ratio = coplanar / total_polys
-
-                metric = (abs(0.5 - split_ratio) * self.split_weight +
-                          intersect_ratio * self.intersect_weight +
-                          coplanar_ratio * self.complanar_weigth)
-
-                if metric > self.min_split_metric:
+            coords = points[:, :, axis]
+            flat_coords = coords.ravel()
+            order = np.argsort(flat_coords, kind='stable')
+            kind = ((point_of_poly == coords.argmin(axis=1)[poly_of_point]) * self._MIN |
+                    (point_of_poly == coords.argmax(axis=1)[poly_of_point]) * self._MAX)
+            events.append((flat_coords[order], np.full(len(order), axis), poly_of_point[order], kind[order]))
+        events = tuple(np.concatenate(e) for e in zip(*events))
+
+        parents = [None] # (node index, side) each node of the current level is attached to
+        forced_depth = np.zeros(1, dtype=np.int64) # forced splits above each node of the current level
+        depth = 0
+        while parents:
+            node_count = len(parents)
+            node_inst_end = np.cumsum(np.bincount(inst_node, minlength=node_count)).tolist()
+            node_inst_start = [0] + node_inst_end[:-1]
+            inst_poly_list = inst_poly.tolist()
+
+            if executor is not None and depth == parallel_depth:
+                # the rest of each subtree depends only on its polys
+                jobs = list()
+                for parent, start, end in zip(parents, node_inst_start, node_inst_end):
+                    polys = inst_poly_list[start:end]
+                    jobs.append((parent, polys, executor.submit(build_from_points, points[polys], self.strategy,
+                                                                self.max_depth - depth)))
+                for parent, polys, job in jobs:
+                    self._add_subtree(polys, job.result(), parent)
+                break
+
+            split_axis, split_val, forced, chunked = self._find_best_split_planes(
+                node_count, inst_poly, inst_node, events, forced_depth, depth >= self.max_depth)
+
+            # create nodes, polys of the ones that won't get split end up in their parent's leaf
+            next_parents = list()
+            for parent, axis, val, is_chunked, start, end in zip(parents, split_axis.tolist(), split_val.tolist(),
+                                                                 chunked.tolist(), node_inst_start, node_inst_end):
+                if axis < 0:
+                    self._add_leaf(inst_poly_list[start:end], parent)
                     continue
-
-                if metric < best_metric:
-                    best_metric = metric
-                    best_split_plane = Plane(positions[i], axis)
-
-        return best_split_plane
-
-    def _build_bsp_tree(self, polys : List[Poly]):
-
-        split_plane = self._find_best_split_plane(polys)
-        if split_plane is None:
-            return None
-
-        front : List[Poly] = list()
-        back : List[Poly] = list()
-
-        for poly in polys:
-            c = split_plane.classify(poly)
-            if c == PolyType.STRADDLE or c == PolyType.COPLANAR:
-                front.append(poly)
-                back.append(poly)
-            elif c == PolyType.FRONT:
-                front.append(poly)
-            elif c == PolyType.BACK:
-                back.append(poly)
-            else:
-                raise RuntimeError()
-
-        node = Node(split_plane)
-        node.front_node = self._build_bsp_tree(front)
-        if node.front_node is None:
-             node.front_faces = [f.face_idx for f in front]
-
-        node.back_node = self._build_bsp_tree(back)
-        if node.back_node is None:
-             node.back_faces =  [f.face_idx for f in back]
-
-        return node
+                node_idx = self._add_node(val, axis, parent, is_chunked)
+                next_parents.append((node_idx, 0))
+                next_parents.append((node_idx, 1))
+
+            if next_parents:
+                inst_poly, inst_node, events = self._partition(inst_poly, inst_node, events,
+                                                               split_axis, split_val, chunked)
+                is_split = split_axis >= 0
+                forced_depth = np.repeat((forced_depth + forced)[is_split], 2)
+            parents = next_parents
+            depth += 1
+
+    def _find_best_split_planes(self, node_count, inst_poly, inst_node, events, forced_depth, too_deep):
+        """
+        returns split axis (-1 when node should not be split) and value for each node
+        and masks of nodes which were forced to split and which need to be chunked,
+        nodes of a level that is `too_deep` are only chunked
+        """
+        split_axis = np.full(node_count, -1)
+        split_val = np.zeros(node_count)
+        forced_nodes = np.zeros(node_count, dtype=bool)
+        chunked = np.zeros(node_count, dtype=bool)
+
+        coords, axes, insts, kinds = events
+        if not len(coords):
+            return split_axis, split_val, forced_nodes, chunked
+
+        # unique positions of each axis of each node, all in one array
+        segs = inst_node[insts] * 3 + axes
+        is_new_pos = np.ones(len(coords), dtype=bool)
+        is_new_pos[1:] = (segs[1:] != segs[:-1]) | (coords[1:] != coords[:-1])
+        pos_idx = np.cumsum(is_new_pos) - 1
+        positions = coords[is_new_pos]
+        pos_segs = segs[is_new_pos]
+        pos_nodes = pos_segs // 3
+        M = len(positions)
+
+        seg_count = np.bincount(pos_segs, minlength=node_count * 3)
+        seg_end = np.cumsum(seg_count)
+        seg_start = seg_end - seg_count
+
+        # position index of min and max coordinate of each instance, per axis
+        inst_count = len(inst_node)
+        l = np.empty((3, inst_count), dtype=np.int64)
+        r = np.empty((3, inst_count), dtype=np.int64)
+        is_min = (kinds & self._MIN) != 0
+        is_max = (kinds & self._MAX) != 0
+        l[axes[is_min], insts[is_min]] = pos_idx[is_min]
+        r[axes[is_max], insts[is_max]] = pos_idx[is_max]
+        inst_segs = inst_node * 3 + np.arange(3)[:, None]
+        flat = l == r
+
+        # polys lying in the plane are coplanar at their position, others are behind
+        # planes up to their min, intersected up to their max and in front of the rest
+        def _count(starts, ends):
+            return np.cumsum(np.bincount(starts.ravel(), minlength=M + 1) -
+                             np.bincount(ends.ravel(), minlength=M + 1))[:M]
+
+        back_end = l + ~flat
+        front_start = np.where(flat, l + 1, r)
+        intersects = ~flat & (back_end < front_start)
+        back = _count(seg_start[inst_segs], back_end)
+        intersect = _count(back_end[intersects], front_start[intersects])
+        front = _count(front_start, seg_end[inst_segs])
+        coplanar = np.bincount(l[flat], minlength=M)
+
+        node_polys = np.bincount(inst_node, minlength=node_count)
+        total_polys = node_polys[pos_nodes]
+
+        # instances are sorted by node
+        node_min = np.zeros((node_count, 3))
+        node_max = np.zeros((node_count, 3))
+        has_polys = node_polys > 0
+        node_start = (np.cumsum(node_polys) - node_polys)[has_polys]
+        node_min[has_polys] = np.minimum.reduceat(self._poly_min[inst_poly], node_start)
+        node_max[has_polys] = np.maximum.reduceat(self._poly_max[inst_poly], node_start)
+
+        candidates = SplitCandidates(positions, pos_segs % 3, pos_nodes, front, back, intersect, coplanar,
+                                     total_polys, node_min, node_max)
+        if too_deep:
+            metric = np.full(M, np.inf)
+        else:
+            metric = np.array(self.strategy.split_costs(candidates), dtype=np.float64)
+
+        # plane must separate something for the tree to make progress
+        no_split = (front == 0) | (back == 0)
+        metric[no_split] = np.inf
+
+        # leaves can't hold that many faces so such nodes get split anyway, as evenly as possible.
+        # The split must make progress, both sides have to lose more polys than get copied to both of them,
+        # otherwise clusters of polys straddling each other would get copied over and over
+        best_metric = self._node_minimum(metric, pos_nodes, node_count)
+        must_split = ~np.isfinite(best_metric) & (node_polys > MAX_LEAF_FACES)
+        shared = intersect + coplanar
+        progress = (np.maximum(front, back) + shared < total_polys) & (shared < np.minimum(front, back))
+        can_force = must_split & (forced_depth < MAX_FORCED_SPLIT_DEPTH) & (not too_deep)
+        forced = can_force[pos_nodes] & ~no_split & progress
+        if np.any(forced):
+            metric[forced] = (np.abs(front[forced] - back[forced]) + intersect[forced]) / total_polys[forced]
+            best_metric = self._node_minimum(metric, pos_nodes, node_count)
+            forced_nodes = must_split & np.isfinite(best_metric)
+
+        # first position with the lowest metric of each node wins
+        is_best = np.isfinite(metric) & (metric == best_metric[pos_nodes])
+        split_nodes, first_best = np.unique(pos_nodes[is_best], return_index=True)
+        best_pos = np.flatnonzero(is_best)[first_best]
+
+        split_axis[split_nodes] = pos_segs[best_pos] % 3
+        split_val[split_nodes] = positions[best_pos]
+
+        # no split makes progress, polys are divided in halves by their centers along the longest axis
+        # without copying the straddling ones to both sides (so these may be missed by queries on the other side)
+        chunked = must_split & ~np.isfinite(best_metric)
+        node_inst_start = np.cumsum(node_polys) - node_polys
+        for node in np.flatnonzero(chunked).tolist():
+            axis = int(np.argmax(node_max[node] - node_min[node]))
+            start = node_inst_start[node]
+            centers = np.sort(self._poly_center[inst_poly[start:start + node_polys[node]], axis])
+            split_axis[node] = axis
+            split_val[node] = centers[len(centers) // 2]
+        return split_axis, split_val, forced_nodes, chunked
+
+    @staticmethod
+    def _node_minimum(metric, pos_nodes, node_count):
+        node_pos_count = np.bincount(pos_nodes, minlength=node_count)
+        node_pos_start = (np.cumsum(node_pos_count) - node_pos_count)[node_pos_count > 0]
+        best_metric = np.full(node_count, np.inf)
+        best_metric[node_pos_count > 0] = np.minimum.reduceat(metric, node_pos_start)
+        return best_metric
+
+    def _partition(self, inst_poly, inst_node, events, split_axis, split_val, chunked):
+        """
+        splits instances and events of each node between its front and back child,
+        straddling and coplanar polys go to both, except for chunked nodes which are split in halves
+        """
+        d = split_axis[inst_node]
+        s = split_val[inst_node]
+        is_split = d >= 0
+        d = np.maximum(d, 0)
+        l = self._poly_min[inst_poly, d]
+        r = self._poly_max[inst_poly, d]
+        c = self._poly_center[inst_poly, d]
+
+        both = ((l < s) & (s < r)) | ((l == s) & (r == s))
+        in_front = is_split & (both | (c <= s))
+        in_back = is_split & (both | (c >= s))
+
+        if np.any(chunked):
+            # rank of each instance of chunked nodes by its center, lower half goes to front
+            chunk_inst = np.flatnonzero(chunked[inst_node])
+            chunk_inst = chunk_inst[np.lexsort((c[chunk_inst], inst_node[chunk_inst]))]
+            chunk_node = inst_node[chunk_inst]
+            node_count = np.bincount(chunk_node, minlength=len(split_axis))
+            node_start = np.cumsum(node_count) - node_count
+            rank = np.arange(len(chunk_inst)) - node_start[chunk_node]
+            in_front[chunk_inst] = rank < node_count[chunk_node] // 2
+            in_back[chunk_inst] = ~in_front[chunk_inst]
+
+        # children of k-th split node are 2k (front) and 2k+1 (back)
+        child_base = 2 * (np.cumsum(split_axis >= 0) - 1)
+        child_node = np.concatenate((child_base[inst_node[in_front]], child_base[inst_node[in_back]] + 1))
+        order = np.argsort(child_node, kind='stable')
+        new_inst = np.empty(len(order), dtype=np.int64)
+        new_inst[order] = np.arange(len(order))
+        front_count = np.count_nonzero(in_front)
+        inst_map = (np.full(len(inst_poly), -1), np.full(len(inst_poly), -1))
+        inst_map[0][in_front] = new_inst[:front_count]
+        inst_map[1][in_back] = new_inst[front_count:]
+
+        coords, axes, insts, kinds = events
+        side_events = list()
+        for side, side_insts in enumerate((in_front, in_back)):
+            keep = side_insts[insts]
+            side_events.append((coords[keep], axes[keep], inst_map[side][insts[keep]], kinds[keep]))
+        events = tuple(np.concatenate(e) for e in zip(*side_events))
+        event_order = np.argsort(child_node[order][events[2]], kind='stable')
+        events = tuple(e[event_order] for e in events)
+
+        inst_poly = np.concatenate((inst_poly[in_front], inst_poly[in_back]))[order]
+        return inst_poly, child_node[order], events
+
+def build_from_points(points, strategy : Optional[SplitStrategy] = None, max_depth = MAX_DEPTH):
+    """builds tree of polys given as (N, 3, 3) points array, returns its flat node arrays"""
+    faces = np.arange(len(points) * 3).reshape(-1, 3)
+    builder = BspBuilder(points.reshape(-1, 3), faces, strategy, max_depth=max_depth)
+    return builder.split_vals, builder.split_axes, builder.children, builder.leaf_faces, builder.chunked
@@ -0,0 +1,96 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+from .bf2_common import Vec3
+from .bf2_collmesh import BSP, Col
+from .bsp_builder import SplitStrategy, surface_area
+
+class BspMetrics:
+    def __init__(self):
+        self.node_count = 0
+        self.depth = 0 # nodes on the longest path from root to a leaf
+        self.leaf_count = 0 # leaf sides of nodes
+        self.empty_leaf_count = 0
+        self.face_count = 0
+        self.face_ref_count = 0
+        self.max_leaf_faces = 0
+        self.expected_cost = 0.0 # for a random ray hitting the bounds, see calc_bsp_metrics
+
+    @property
+    def face_ref_duplication(self):
+        """face refs per face, faces straddling split planes are referenced by more leaves"""
+        return self.face_ref_count / self.face_count if self.face_count else 0.0
+
+    @property
+    def avg_leaf_faces(self):
+        return self.face_ref_count / self.leaf_count if self.leaf_count else 0.0
+
+    def __str__(self):
+        return (f'nodes: {self.node_count}, depth: {self.depth}, leaves: {self.leaf_count} '
+                f'({self.empty_leaf_count} empty), faces per leaf: {self.avg_leaf_faces:.2f} '
+                f'(max {self.max_leaf_faces}), face ref duplication: {self.face_ref_duplication:.2f}, '
+                f'expected cost: {self.expected_cost:.2f}')
+
+
+def calc_bsp_metrics(bsp : BSP, face_count, traversal_cost=1.0, intersect_cost=1.0) -> BspMetrics:
+    """
+    Expected cost is the sum of costs of visiting each node (`traversal_cost`) and testing each face
+    of a leaf (`intersect_cost`), weighted by probability of a random ray hitting their bounds
+    (surface area of the bounds relative to the one of the whole tree)
+    """
+    metrics = BspMetrics()
+    metrics.node_count = len(bsp.nodes)
+    metrics.face_count = face_count
+    metrics.face_ref_count = len(bsp.face_refs)
+    if not metrics.node_count:
+        return metrics
+
+    split_vals = bsp.split_vals.tolist()
+    split_axes = bsp.split_axes.tolist()
+    refs = bsp.nodes['refs'].tolist()
+    is_leaf = [bsp.is_leaf(side).tolist() for side in range(2)]
+    face_ref_counts = [bsp.face_ref_counts(side).tolist() for side in range(2)]
+
+    # bounds of each side are the parent bounds clipped by its split plane
+    root_min, root_max = Vec3.to_array([bsp.min, bsp.max]).astype(np.float64)
+    root_area = surface_area(root_min[None], root_max[None])[0] or 1.0
+
+    visits = list() # (bounds min, bounds max, cost)
+    leaf_faces = list()
+    stack = [(bsp.root, root_min, root_max, 1)]
+    while stack:
+        node_idx, node_min, node_max, depth = stack.pop()
+        metrics.depth = max(metrics.depth, depth)
+        visits.append((node_min, node_max, traversal_cost))
+        axis = split_axes[node_idx]
+        val = split_vals[node_idx]
+        front_max = node_max.copy()
+        front_max[axis] = min(front_max[axis], val)
+        back_min = node_min.copy()
+        back_min[axis] = max(back_min[axis], val)
+        for side, (side_min, side_max) in enumerate(((node_min, front_max), (back_min, node_max))):
+            if is_leaf[side][node_idx]:
+                count = face_ref_counts[side][node_idx]
+                leaf_faces.append(count)
+                visits.append((side_min, side_max, intersect_cost * count))
+            else:
+                stack.append((refs[node_idx][side], side_min, side_max, depth + 1))
+
+    metrics.leaf_count = len(leaf_faces)
+    metrics.empty_leaf_count = leaf_faces.count(0)
+    metrics.max_leaf_faces = max(leaf_faces, default=0)
+
+    mins, maxs, costs = zip(*visits)
+    hit_probability = surface_area(np.array(mins), np.array(maxs)) / root_area
+    metrics.expected_cost = float(np.dot(hit_probability, costs))
+    return metrics
+
+def compare_strategies(col : Col, strategies : List[Optional[SplitStrategy]], **kwargs) -> List[Tuple[Optional[SplitStrategy], BspMetrics]]:
+    """builds BSP of the col with each strategy (None is the default one) and returns their metrics"""
+    verts = col.vert_array()
+    face_verts = col.face_array()[:, :3]
+    results = list()
+    for strategy in strategies:
+        bsp = BSP.build(verts, face_verts, strategy=strategy)
+        results.append((strategy, calc_bsp_metrics(bsp, len(face_verts), **kwargs)))
+    return results
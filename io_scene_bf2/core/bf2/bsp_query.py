@@ -0,0 +1,296 @@
+from typing import Tuple
+import numpy as np
+
+from .bf2_collmesh import BSP, Col, BF2CollMeshException
+
+# batched queries against collision geometry using its BSP tree, all positions are in .collisionmesh space.
+# Queries are pushed through the tree all at once level by level as (query, node) pairs,
+# front side of a node contains all faces with coordinates <= split value and back side all >= split value,
+# except for chunked nodes (see BspBuilder) where faces straddling the plane are only on one side so queries
+# reaching them have to continue to both sides
+
+class BspQuery:
+    def __init__(self, col : Col, chunk_size=1 << 16):
+        if col.bsp is None:
+            raise BF2CollMeshException("BSP query: col has no BSP")
+        self.bsp : BSP = col.bsp
+        self.chunk_size = chunk_size # max queries traversed at once, bounds memory usage
+
+        verts = col.vert_array().astype(np.float64)
+        faces = col.face_array()[:, :3].astype(np.int64)
+        self._tri = verts[faces] # (face, point, axis)
+        self._tri_edges = (self._tri[:, 1] - self._tri[:, 0], self._tri[:, 2] - self._tri[:, 0])
+
+        # faces and their backfaces have the same key
+        sorted_faces = np.sort(faces, axis=1)
+        self._face_key = (sorted_faces[:, 0] * len(verts) + sorted_faces[:, 1]) * len(verts) + sorted_faces[:, 2]
+
+        if len(verts):
+            self._min = verts.min(axis=0)
+            self._max = verts.max(axis=0)
+        else:
+            self._min = self._max = np.zeros(3)
+        self._eps = 1e-6 * max(1.0, float(np.max(self._max - self._min)))
+
+        nodes = self.bsp.nodes
+        self._split_vals = nodes['split_val'].astype(np.float64)
+        self._split_axes = self.bsp.split_axes.astype(np.int64)
+        self._refs = nodes['refs'].astype(np.int64)
+        self._is_leaf = np.stack([self.bsp.is_leaf(i) for i in range(2)], axis=1)
+        self._face_ref_counts = np.stack([self.bsp.face_ref_counts(i) for i in range(2)], axis=1).astype(np.int64)
+        self._face_refs = self.bsp.face_refs.astype(np.int64)
+        if self.bsp.chunked is not None:
+            self._chunked = self.bsp.chunked
+        else: # loaded from file
+            self._chunked = self._find_chunked_nodes()
+
+    def _find_chunked_nodes(self) -> np.ndarray:
+        """nodes having faces that cross their split plane on one side only"""
+        node_count = len(self.bsp.nodes)
+        face_count = len(self._tri)
+        parent = np.full(node_count, -1)
+        parent_side = np.zeros(node_count, dtype=np.int64)
+        for side in range(2):
+            inner = np.flatnonzero(~self._is_leaf[:, side])
+            parent[self._refs[inner, side]] = inner
+            parent_side[self._refs[inner, side]] = side
+
+        # (node, side, face) of each face for every side of a node it lies under
+        leaf_node, leaf_side = np.nonzero(self._is_leaf)
+        node, side, face = self._expand_leaves(leaf_node, leaf_side, leaf_node, leaf_side)
+        members = list()
+        while len(node):
+            members.append((node * 2 + side) * face_count + face)
+            up = parent[node] >= 0
+            node, side, face = parent[node[up]], parent_side[node[up]], face[up]
+        members = np.unique(np.concatenate(members)) if members else np.zeros(0, dtype=np.int64)
+
+        node_side, face = np.divmod(members, face_count)
+        node, side = np.divmod(node_side, 2)
+        axis = self._split_axes[node]
+        val = self._split_vals[node]
+        crossing = np.where(side == 0, self._tri[face, :, axis].max(axis=1) > val,
+                                       self._tri[face, :, axis].min(axis=1) < val)
+        other_side = ((node * 2 + 1 - side) * face_count + face)[crossing]
+        missing = ~np.isin(other_side, members)
+        chunked = np.zeros(node_count, dtype=bool)
+        chunked[node[crossing][missing]] = True
+        return chunked
+
+    def ray_cast(self, origins, directions, max_dist=np.inf) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        returns distance to the nearest hit (in lengths of direction vector) and index
+        of the hit face for each ray, inf and -1 for rays that hit nothing
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        dist = np.full(len(origins), np.inf)
+        face = np.full(len(origins), -1, dtype=np.int64)
+        for chunk in self._chunks(len(origins)):
+            dist[chunk], face[chunk] = self._ray_cast(origins[chunk], directions[chunk], 0.0, max_dist)
+        return dist, face
+
+    def segment_intersect(self, starts, ends) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """returns hit mask, position of the nearest hit along the segment (0-1) and index of the hit face"""
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 3)
+        t, face = self.ray_cast(starts, ends - starts, max_dist=1.0)
+        return face >= 0, t, face
+
+    def contains_points(self, points) -> np.ndarray:
+        """
+        tells which points are inside the collision mesh by counting crossings of a ray cast along +X,
+        only meaningful for closed meshes, points lying exactly on an edge may be misclassified
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        inside = np.zeros(len(points), dtype=bool)
+        direction = np.array([1.0, 0.0, 0.0])
+        for chunk in self._chunks(len(points)):
+            origins = points[chunk]
+            directions = np.broadcast_to(direction, origins.shape)
+            max_dist = self._max[0] - origins[:, 0] + 1.0
+            query, face, _ = self._ray_hits(origins, directions, np.zeros(len(origins)), max_dist)
+            # face and its backface are the same surface, straddling faces may be found in more leaves
+            crossings = np.unique(np.stack((query, self._face_key[face]), axis=1), axis=0)
+            inside[chunk] = np.bincount(crossings[:, 0], minlength=len(origins)) % 2 == 1
+        return inside
+
+    def aabb_overlap(self, mins, maxs) -> np.ndarray:
+        """tells which axis aligned boxes overlap any face"""
+        mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        overlaps = np.zeros(len(mins), dtype=bool)
+        for chunk in self._chunks(len(mins)):
+            query, face = self._traverse(len(mins[chunk]), self._aabb_split, mins[chunk], maxs[chunk])
+            center = (mins[chunk] + maxs[chunk]) * 0.5
+            half_size = (maxs[chunk] - mins[chunk]) * 0.5
+            hit = _tri_box_overlap(self._tri[face] - center[query][:, None, :], half_size[query])
+            overlaps[chunk] = np.bincount(query[hit], minlength=len(mins[chunk])) > 0
+        return overlaps
+
+    def _chunks(self, count):
+        for start in range(0, count, self.chunk_size):
+            yield slice(start, min(start + self.chunk_size, count))
+
+    def _ray_cast(self, origins, directions, min_dist, max_dist):
+        dist = np.full(len(origins), np.inf)
+        face = np.full(len(origins), -1, dtype=np.int64)
+        query, hit_face, t = self._ray_hits(origins, directions, np.full(len(origins), min_dist),
+                                            np.full(len(origins), max_dist, dtype=np.float64))
+        if len(query):
+            # nearest hit of each query
+            order = np.lexsort((t, query))
+            hit_query, first = np.unique(query[order], return_index=True)
+            dist[hit_query] = t[order][first]
+            face[hit_query] = hit_face[order][first]
+        return dist, face
+
+    def _ray_hits(self, origins, directions, t0, t1):
+        """returns (query, face, distance) of all hits"""
+        # clip to the bounds of the geometry
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slab0 = (self._min - self._eps - origins) / directions
+            slab1 = (self._max + self._eps - origins) / directions
+        parallel = directions == 0
+        outside = parallel & ((origins < self._min - self._eps) | (origins > self._max + self._eps))
+        slab0[parallel] = -np.inf
+        slab1[parallel] = np.inf
+        t0 = np.maximum(t0, np.minimum(slab0, slab1).max(axis=1))
+        t1 = np.minimum(t1, np.maximum(slab0, slab1).min(axis=1))
+        t1[outside.any(axis=1)] = -np.inf
+
+        query, face = self._traverse(len(origins), self._ray_split, origins, directions, t0, t1)
+        e1, e2 = self._tri_edges
+        t = _ray_triangle(origins[query], directions[query], self._tri[face, 0], e1[face], e2[face])
+        hit = (t >= t0[query]) & (t <= t1[query])
+        return query[hit], face[hit], t[hit]
+
+    def _ray_split(self, query, axis, val, origins, directions, t0, t1):
+        o = origins[query, axis]
+        d = directions[query, axis]
+        c0 = o + t0 * d
+        c1 = o + t1 * d
+        sides = (np.minimum(c0, c1) <= val + self._eps, np.maximum(c0, c1) >= val - self._eps)
+        # clip intervals to the part on each side of the plane
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_front = (val + self._eps - o) / d
+            t_back = (val - self._eps - o) / d
+        forward = d > 0
+        backward = d < 0
+        front_t0 = np.where(backward, np.maximum(t0, t_front), t0)
+        front_t1 = np.where(forward, np.minimum(t1, t_front), t1)
+        back_t0 = np.where(forward, np.maximum(t0, t_back), t0)
+        back_t1 = np.where(backward, np.minimum(t1, t_back), t1)
+        return sides, ((front_t0, front_t1), (back_t0, back_t1))
+
+    def _aabb_split(self, query, axis, val, mins, maxs):
+        sides = (mins[query, axis] <= val, maxs[query, axis] >= val)
+        return sides, ((), ())
+
+    def _traverse(self, count, split, *query_data):
+        """
+        pushes all queries through the tree, `split` tells which sides of a node given (query, node) pairs
+        continue to and may clip their per pair state, returns (query, face) pairs of faces in reached leaves
+        """
+        if len(self.bsp.nodes) == 0 or count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        static_data = query_data[:2]
+        state = query_data[2:]
+        query = np.arange(count)
+        state = tuple(s[query] for s in state)
+        node = np.full(count, self.bsp.root)
+        if state:
+            # pairs with empty interval are done
+            alive = state[0] <= state[1]
+            query, node, state = query[alive], node[alive], tuple(s[alive] for s in state)
+
+        leaf_query = list()
+        leaf_node = list()
+        leaf_side = list()
+        while len(query):
+            axis = self._split_axes[node]
+            val = self._split_vals[node]
+            sides, side_states = split(query, axis, val, *static_data, *state)
+            chunked = self._chunked[node]
+            if np.any(chunked):
+                # no pruning, faces of the subtree may lie on the other side of the plane
+                sides = tuple(go | chunked for go in sides)
+                side_states = tuple(tuple(np.where(chunked, s, clipped) for s, clipped in zip(state, side_state))
+                                    for side_state in side_states)
+
+            next_query = list()
+            next_node = list()
+            next_state = list()
+            for side in range(2):
+                go = sides[side]
+                side_state = side_states[side]
+                if side_state:
+                    go &= side_state[0] <= side_state[1]
+                is_leaf = self._is_leaf[node, side]
+                leaf = go & is_leaf
+                leaf_query.append(query[leaf])
+                leaf_node.append(node[leaf])
+                leaf_side.append(np.full(np.count_nonzero(leaf), side))
+                child = go & ~is_leaf
+                next_query.append(query[child])
+                next_node.append(self._refs[node[child], side])
+                next_state.append(tuple(s[child] for s in side_state))
+
+            query = np.concatenate(next_query)
+            node = np.concatenate(next_node)
+            state = tuple(np.concatenate(s) for s in zip(*next_state))
+
+        # expand reached leaves to their faces
+        return self._expand_leaves(np.concatenate(leaf_node), np.concatenate(leaf_side), np.concatenate(leaf_query))
+
+    def _expand_leaves(self, leaf_node, leaf_side, *per_leaf):
+        """repeats `per_leaf` arrays for each face of given leaves, returns them followed by the faces"""
+        counts = self._face_ref_counts[leaf_node, leaf_side]
+        starts = self._refs[leaf_node, leaf_side]
+        total = int(counts.sum())
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        face = self._face_refs[np.repeat(starts, counts) + offsets]
+        return *(np.repeat(data, counts) for data in per_leaf), face
+
+
+def _dot(a, b):
+    return np.einsum('ij,ij->i', a, b)
+
+def _ray_triangle(origins, directions, v0, e1, e2):
+    """Moller-Trumbore, returns distance along each ray to its triangle given by a vertex and two edges, nan on miss"""
+    p = np.cross(directions, e2)
+    det = _dot(e1, p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1.0 / det
+        s = origins - v0
+        u = _dot(s, p) * inv_det
+        q = np.cross(s, e1)
+        v = _dot(directions, q) * inv_det
+        t = _dot(e2, q) * inv_det
+        hit = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1)
+    return np.where(hit, t, np.nan)
+
+def _tri_box_overlap(tris, half_size):
+    """separating axis test of triangles relative to the center of boxes with given half size"""
+    overlap = np.ones(len(tris), dtype=bool)
+
+    # box face normals
+    overlap &= np.all(tris.min(axis=1) <= half_size, axis=1)
+    overlap &= np.all(tris.max(axis=1) >= -half_size, axis=1)
+
+    # triangle normal
+    edges = np.roll(tris, -1, axis=1) - tris
+    normal = np.cross(edges[:, 0], edges[:, 1])
+    overlap &= np.abs(_dot(normal, tris[:, 0])) <= _dot(np.abs(normal), half_size)
+
+    # cross products of box axes and triangle edges
+    for axis in range(3):
+        unit = np.zeros(3)
+        unit[axis] = 1.0
+        for edge in range(3):
+            sep_axis = np.cross(unit, edges[:, edge])
+            proj = np.einsum('ikj,ij->ik', tris, sep_axis)
+            radius = _dot(np.abs(sep_axis), half_size)
+            overlap &= (proj.min(axis=1) <= radius) & (proj.max(axis=1) >= -radius)
+    return overlap
@@ -1,4 +1,18 @@
+import io
+import mmap
 import struct
+import functools
+import numpy as np
+
+# bounded, counted formats are keyed by count and there can be many distinct ones
+@functools.lru_cache(maxsize=256)
+def _get_struct(fmt):
+    return struct.Struct(fmt)
+
+@functools.lru_cache(maxsize=None)
+def _get_dtype(data_type, signed=False):
+    dt = data_type.lower() if signed else data_type
+    return np.dtype('<' + dt)
 
 class FileUtils:
     def __init__(self, file):
@@ -6,9 +20,8 @@ class FileUtils:
 
     def _read(self, data_type, count=1, signed=False):
         dt = data_type.lower() if signed else data_type
-        fmt =  f'{count}{dt}'
-        size = struct.calcsize(fmt)
-        unpacked = struct.Struct(fmt).unpack(self.file.read(size))          
+        s = _get_struct(f'<{count}{dt}')
+        unpacked = s.unpack(self.file.read(s.size))
         if count == 1:
             return unpacked[0]
         else:
@@ -17,13 +30,27 @@ class FileUtils:
     def _write(self, data_type, content, signed=False):
         count = len(content) if isinstance(content, list) else 1
         dt = data_type.lower() if signed else data_type
-        fmt =  f'{count}{dt}'
+        s = _get_struct(f'<{count}{dt}')
         if count == 1:
-            packed = struct.Struct(fmt).pack(content)
+            packed = s.pack(content)
         else:
-            packed = struct.Struct(fmt).pack(*content)
+            packed = s.pack(*content)
         self.file.write(packed)
 
+    def read_array(self, data_type, count, signed=False):
+        """read `count` elements with a single read, returns read-only numpy array"""
+        dtype = _get_dtype(data_type, signed)
+        size = dtype.itemsize * count
+        data = self.file.read(size)
+        if len(data) != size:
+            raise EOFError(f"expected {size} bytes, got {len(data)}")
+        return np.frombuffer(data, dtype=dtype, count=count)
+
+    def write_array(self, data_type, content, signed=False):
+        """write any sequence or numpy array of elements with a single write"""
+        dtype = _get_dtype(data_type, signed)
+        self.file.write(np.asarray(content, dtype=dtype).tobytes())
+
     def read_byte(self, count=1, signed=False):
         return self._read('B', count=count, signed=signed)
 
@@ -38,12 +65,32 @@ class FileUtils:
 
     def read_string(self):
         lenght = self.read_dword()
-        unpacked = struct.Struct(f'{lenght}s').unpack(self.file.read(lenght))
-        return unpacked[0].decode('ascii')
+        return self.file.read(lenght).decode('ascii')
 
     def read_raw(self, lenght):
         return self.file.read(lenght)
 
+    def read_view(self, lenght):
+        """
+        like read_raw but returns a memoryview, zero-copy for memory-mapped and in-memory files,
+        the view keeps the mapping/BytesIO buffer exported until it's released
+        """
+        if isinstance(self.file, mmap.mmap):
+            buffer = memoryview(self.file)
+        elif isinstance(self.file, io.BytesIO):
+            buffer = self.file.getbuffer()
+        else:
+            return memoryview(self.read_raw(lenght))
+        start = self.file.tell()
+        view = buffer[start:start + lenght]
+        if len(view) != lenght:
+            raise EOFError(f"expected {lenght} bytes, got {len(view)}")
+        self.file.seek(start + lenght)
+        return view
+
+    def skip(self, lenght):
+        self.file.seek(lenght, io.SEEK_CUR)
+
     def write_byte(self, content, signed=False):
         self._write('B', content, signed=signed)
 
@@ -52,14 +99,13 @@ class FileUtils:
 
     def write_dword(self, content, signed=False):
         self._write('I', content, signed=signed)
-    
+
     def write_float(self, content, signed=False):
         self._write('f', content, signed=signed)
 
     def write_string(self, content):
-        lenght = len(content)
-        self.write_dword(lenght)
-        self.file.write(struct.Struct(f'{lenght}s').pack(content.encode('ascii')))
+        self.write_dword(len(content))
+        self.file.write(content.encode('ascii'))
 
     def write_raw(self, content):
-        self.file.write(content)
\ No newline at end of file
+        self.file.write(content)
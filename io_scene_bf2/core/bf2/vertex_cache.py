@@ -0,0 +1,112 @@
+from typing import List, Tuple
+import numpy as np
+
+# post-transform vertex cache optimization (Tipsify)
+# Sander, Nehab, Barczak "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw" (2007)
+
+DEFAULT_CACHE_SIZE = 16 # roughly the FIFO size of DX9 era hardware
+
+def _in_cache(time, cache_time, cache_size):
+    """whether a vertex pushed at `cache_time` is still among the last `cache_size` FIFO entries"""
+    return time - cache_time < cache_size
+
+def calc_acmr(faces, cache_size=DEFAULT_CACHE_SIZE):
+    """average cache miss ratio (transformed vertices per triangle) of a FIFO cache"""
+    if not len(faces):
+        return 0.0
+    cache_time = dict()
+    time = 0
+    for face in faces:
+        for v in face:
+            if not _in_cache(time, cache_time.get(v, -cache_size), cache_size):
+                cache_time[v] = time
+                time += 1
+    return time / len(faces)
+
+def optimize_faces(faces, vertex_count, cache_size=DEFAULT_CACHE_SIZE) -> List[Tuple[int]]:
+    """returns faces reordered for the post-transform vertex cache of given size"""
+    faces = [tuple(face) for face in faces]
+    if not faces:
+        return faces
+
+    # vertex -> triangles adjacency
+    adjacency = [[] for _ in range(vertex_count)]
+    for face_idx, face in enumerate(faces):
+        for v in face:
+            adjacency[v].append(face_idx)
+
+    live_count = [len(adj) for adj in adjacency]
+    cache_time = [0] * vertex_count
+    emitted = [False] * len(faces)
+    dead_end = list()
+    out_faces = list()
+
+    time = cache_size + 1
+    cursor = 0
+    fanning_vert = 0 if live_count[0] else _next_live_vert(live_count, 0)
+    while fanning_vert >= 0:
+        candidates = list()
+        for face_idx in adjacency[fanning_vert]:
+            if emitted[face_idx]:
+                continue
+            emitted[face_idx] = True
+            face = faces[face_idx]
+            out_faces.append(face)
+            for v in face:
+                dead_end.append(v)
+                candidates.append(v)
+                live_count[v] -= 1
+                if not _in_cache(time, cache_time[v], cache_size):
+                    cache_time[v] = time
+                    time += 1
+
+        # pick the candidate that will still be in cache after its remaining triangles are emitted
+        fanning_vert = -1
+        best_priority = -1
+        for v in candidates:
+            if not live_count[v]:
+                continue
+            priority = 0
+            if _in_cache(time + 2 * live_count[v], cache_time[v], cache_size):
+                priority = time - cache_time[v]
+            if priority > best_priority:
+                best_priority = priority
+                fanning_vert = v
+
+        if fanning_vert < 0:
+            # dead end, try recently referenced vertices first, then any other
+            while dead_end:
+                v = dead_end.pop()
+                if live_count[v]:
+                    fanning_vert = v
+                    break
+            else:
+                cursor = _next_live_vert(live_count, cursor)
+                fanning_vert = cursor
+
+    return out_faces
+
+def _next_live_vert(live_count, cursor):
+    while cursor < len(live_count):
+        if live_count[cursor]:
+            return cursor
+        cursor += 1
+    return -1
+
+def first_use_order(faces, vertex_count) -> np.ndarray:
+    """
+    returns vertex order in which vertices are first referenced by faces,
+    vertices not referenced by any face are moved to the end
+    """
+    indices = np.asarray(faces, dtype=np.int64).reshape(-1)
+    first_use = np.full(vertex_count, len(indices), dtype=np.int64)
+    used_verts, first_occurrence = np.unique(indices, return_index=True)
+    first_use[used_verts] = first_occurrence
+    return np.argsort(first_use, kind='stable')
+
+def remap_faces(faces, vertex_order) -> List[Tuple[int]]:
+    """rewrites face indices after vertices got reordered to `vertex_order`"""
+    remap = np.empty(len(vertex_order), dtype=np.int64)
+    remap[vertex_order] = np.arange(len(vertex_order), dtype=np.int64)
+    indices = remap[np.asarray(faces, dtype=np.int64).reshape(-1)].tolist()
+    return list(zip(indices[0::3], indices[1::3], indices[2::3]))
@@ -1,16 +1,17 @@
 import bpy # type: ignore
 import bmesh # type: ignore
+import numpy as np
 
 from os import path
 from itertools import cycle
-from .bf2.bf2_collmesh import BF2CollMesh, BF2CollMeshException, GeomPart, Geom, Col, Face, Vec3
+from .bf2.bf2_collmesh import BF2CollMesh, BF2CollMeshException, GeomPart, Geom, Col, ColCache
 from .utils import (check_transform, check_scale, delete_object,
                     delete_object_if_exists,
                     delete_material_if_exists,
                     delete_mesh_if_exists,
                     check_prefix,
-                    invert_face,
-                    are_backfaces,
+                    foreach_get_array,
+                    classify_faces,
                     apply_modifiers as _apply_modifiers,
                     triangulate as _triangulate,
                     DEFAULT_REPORTER)
@@ -119,7 +120,7 @@ class CollMeshImporter:
         for geompart in self.bf2_mesh.geom_parts:
             for geom in geompart.geoms:
                 for col in geom.cols:
-                    material_indexes.update(set([f.material for f in col.faces]))
+                    material_indexes.update(np.unique(col.face_array()[:, 3]).tolist())
 
         cycol = cycle(MATERIAL_COLORS)
 
@@ -143,73 +144,52 @@ class CollMeshImporter:
         return materials
 
     def _import_col(self, name, bf2_col):
-        # swap order
-        verts = [(v.x, v.z, v.y) for v in bf2_col.verts]
-        faces = [face.verts for face in bf2_col.faces]
-        face_materials = [face.material for face in bf2_col.faces]
+        face_array = bf2_col.face_array().astype(np.int64)
+        faces = face_array[:, :3]
+        face_materials = face_array[:, 3]
+        verts = bf2_col.vert_array()[:, (0, 2, 1)] # swap order
 
         # map bf2 material index to blender material index
-        material_indexes = list(set(face_materials))
-        bf2_mat_idx_to_blend_mat_idx = dict()
-        for blender_idx, bf2_index in enumerate(list(material_indexes)):
-            bf2_mat_idx_to_blend_mat_idx[bf2_index] = blender_idx
+        material_indexes = list(set(face_materials.tolist()))
+        bf2_mat_idx_to_blend_mat_idx = np.zeros(max(material_indexes, default=0) + 1, dtype=np.int32)
+        bf2_mat_idx_to_blend_mat_idx[material_indexes] = np.arange(len(material_indexes))
+        face_materials = bf2_mat_idx_to_blend_mat_idx[face_materials]
 
-        bm = bmesh.new()
-        for vert in verts:
-            bm.verts.new(vert)
-
-        bm.verts.ensure_lookup_table()
-        bm.verts.index_update()
-
-        fucked_up_faces = 0
-        double_sided_faces = set()
-        for face, bf2_mat_idx in zip(faces, face_materials):
-            face_verts = [bm.verts[i] for i in face]
-            material_index = bf2_mat_idx_to_blend_mat_idx[bf2_mat_idx]
-
-            try:
-                bm_face = bm.faces.new(face_verts)
-                bm_face.material_index = material_index
-            except ValueError:
-                # duplicate face.. or vert, lets find out
-                if not self.load_backfaces:
-                    fucked_up_faces += 1
-                    continue
-                if len(set(face_verts)) != 3: # duplicate verts
-                    fucked_up_faces += 1
-                    continue
-
-                bm.faces.index_update()
-                bm_face_verts = [vert.index for vert in face_verts]
-                for other_bm_face in bm.faces:
-                    if are_backfaces(bm_face_verts, [vert.index for vert in other_bm_face.verts]):
-                        if material_index != other_bm_face.material_index: # XXX: could they differ ??
-                            raise ImportException("Attempted to create a backface with different material index, aborting")
-                        double_sided_faces.add(other_bm_face.index)
-                        break
-                else:
-                    # must be a duplicate face
-                    fucked_up_faces += 1
+        created, double_sided_faces, fucked_up_faces = classify_faces(faces, face_materials, self.load_backfaces)
 
         if fucked_up_faces:
             self.reporter.warning(f"'{name}': Skipped {fucked_up_faces} invalid faces")
 
+        faces = faces[created]
+        face_materials = face_materials[created]
+        double_sided_faces = double_sided_faces[created]
+
         if self.remove_loose_verts:
-            loose_verts = [v for v in bm.verts if not v.link_faces]
-            if loose_verts:
-                bmesh.ops.delete(bm, geom=loose_verts, context='VERTS')
+            used_verts = np.zeros(len(verts), dtype=bool)
+            used_verts[faces.ravel()] = True
+            verts = verts[used_verts]
+            faces = (np.cumsum(used_verts) - 1)[faces]
 
         mesh = bpy.data.meshes.new(name)
-        bm.to_mesh(mesh)
+        mesh.vertices.add(len(verts))
+        mesh.vertices.foreach_set('co', verts.astype(np.float32).ravel())
+        mesh.loops.add(3 * len(faces))
+        mesh.loops.foreach_set('vertex_index', faces.astype(np.int32).ravel())
+        mesh.polygons.add(len(faces))
+        mesh.polygons.foreach_set('loop_start', np.arange(0, 3 * len(faces), 3, dtype=np.int32))
+        mesh.polygons.foreach_set('material_index', face_materials)
+        # flat shaded, same as faces created with bmesh
+        sharp_face = mesh.attributes.new('sharp_face', 'BOOLEAN', 'FACE')
+        sharp_face.data.foreach_set('value', np.ones(len(faces), dtype=bool))
+        mesh.update(calc_edges=True)
 
         # mark faces with backfaces
-        if double_sided_faces:
+        if double_sided_faces.any():
             backface = mesh.attributes.new('backface', 'BOOLEAN', 'FACE')
-            backface.data.foreach_set('value', [poly.index in double_sided_faces for poly in mesh.polygons])
+            backface.data.foreach_set('value', double_sided_faces)
 
         # add materials to mesh
         for bf2_index in material_indexes:
-            bf2_mat_idx_to_blend_mat_idx[bf2_index] = len(mesh.materials)
             mesh.materials.append(self.materials[bf2_index])
 
         return mesh
@@ -227,6 +207,8 @@ class CollMeshExporter:
                  save_backfaces=True,
                  apply_modifiers=False,
                  triangulate=False,
+                 max_workers=1,
+                 cache_dir=None,
                  reporter=DEFAULT_REPORTER):
         self.root_obj = root_obj
         self.mesh_file = mesh_file
@@ -235,6 +217,8 @@ class CollMeshExporter:
         self.save_backfaces = save_backfaces
         self.apply_modifiers = apply_modifiers
         self.triangulate = triangulate
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
         self.reporter = reporter
 
     @staticmethod
@@ -351,8 +335,10 @@ class CollMeshExporter:
             for geom in geompart:
                 for _, col_obj in sorted(geom.items()):
                     mesh = col_obj.data
-                    for p in mesh.polygons:
-                        mat_name = mesh.materials[p.material_index].name
+                    poly_material = foreach_get_array(mesh.polygons, 'material_index', np.int32)
+                    blend_mat_idxs, first_poly = np.unique(poly_material, return_index=True)
+                    for blend_mat_idx in blend_mat_idxs[np.argsort(first_poly)].tolist():
+                        mat_name = mesh.materials[blend_mat_idx].name
                         if mat_name in material_to_index:
                             continue
                         material_to_index[mat_name] = len(material_to_index)
@@ -374,14 +360,15 @@ class CollMeshExporter:
                     geom.cols.append(col)
 
         try:
-            bf2_collmesh.export(self.mesh_file)
+            cache = ColCache(self.cache_dir) if self.cache_dir else None
+            bf2_collmesh.export(self.mesh_file, max_workers=self.max_workers, cache=cache,
+                                warn=self.reporter.warning)
         except BF2CollMeshException as e:
             raise ExportException(str(e)) from e
 
         return bf2_collmesh
 
     def _export_col(self, col_idx, mesh_obj):
-        col = Col()
         mesh = mesh_obj.data
 
         if self.apply_modifiers:
@@ -394,25 +381,41 @@ class CollMeshExporter:
         if col_idx < 0 or col_idx > 3:
             raise ExportException(f"'{mesh_obj.name}' Invalid col index '{col_idx}, must be in 0-3")
 
-        col.col_type = col_idx
-        for v in mesh.vertices:
-            vert = Vec3(v.co[0], v.co[2], v.co[1])
-            col.verts.append(vert)
-            col.vert_materials.append(0)
-        for p in mesh.polygons:
-            if p.loop_total > 3:
-                raise ExportException(f"{mesh_obj.name}: Exporter does not support polygons with more than 3 vertices! It must be triangulated")
-            vert_indexes = tuple(p.vertices)
-            mat_name = mesh.materials[p.material_index].name
-            material_index = self.material_to_index[mat_name]
-            face = Face(vert_indexes, material_index)
-            col.faces.append(face)
-            if backface_attr and backface_attr.data[p.index].value:
-                backface = Face(invert_face(vert_indexes), material_index)
-                col.faces.append(backface)
-            for v in vert_indexes:
-                col.vert_materials[v] = material_index
-        return col
+        verts = foreach_get_array(mesh.vertices, 'co', np.float32, 3)[:, (0, 2, 1)]
+        loop_vert = foreach_get_array(mesh.loops, 'vertex_index', np.int32)
+        poly_loop_start = foreach_get_array(mesh.polygons, 'loop_start', np.int32)
+        poly_loop_total = foreach_get_array(mesh.polygons, 'loop_total', np.int32)
+        poly_material = foreach_get_array(mesh.polygons, 'material_index', np.int32)
+
+        if np.any(poly_loop_total > 3):
+            raise ExportException(f"{mesh_obj.name}: Exporter does not support polygons with more than 3 vertices! It must be triangulated")
+
+        faces = loop_vert[poly_loop_start[:, None] + np.arange(3)]
+
+        # map blender material index to bf2 material index
+        blend_mat_idx_to_bf2_mat_idx = np.zeros(len(mesh.materials), dtype=np.int32)
+        for blend_mat_idx in np.unique(poly_material).tolist():
+            mat_name = mesh.materials[blend_mat_idx].name
+            blend_mat_idx_to_bf2_mat_idx[blend_mat_idx] = self.material_to_index[mat_name]
+        face_materials = blend_mat_idx_to_bf2_mat_idx[poly_material]
+
+        # vertex gets material of the last face using it
+        vert_materials = np.zeros(len(verts), dtype=np.int32)
+        used_verts, last_use = np.unique(faces[::-1].ravel(), return_index=True)
+        vert_materials[used_verts] = np.repeat(face_materials[::-1], 3)[last_use]
+
+        # each backface goes right after its face
+        if backface_attr:
+            poly_backface = foreach_get_array(backface_attr.data, 'value', bool)
+        else:
+            poly_backface = np.zeros(len(faces), dtype=bool)
+        face_idx = np.repeat(np.arange(len(faces)), 1 + poly_backface)
+        is_backface = np.zeros(len(face_idx), dtype=bool)
+        is_backface[1:] = face_idx[1:] == face_idx[:-1]
+        col_faces = faces[face_idx]
+        col_faces[is_backface] = col_faces[is_backface][:, ::-1] # invert
+
+        return Col.from_arrays(col_idx, verts, col_faces, face_materials[face_idx], vert_materials)
 
 # debug stuff
 
@@ -457,7 +460,7 @@ def _import_bsp(context, bf2_col, bsp_name, reload=False):
     if reload: delete_object_if_exists(bsp_name)
 
     root_obj = bpy.data.objects.new(bsp_name, None)
-    _import_bsp_node(bsp.root, root_obj)
+    _import_bsp_node(bsp.to_nodes(bf2_col.faces), root_obj)
 
     # link
     def _link_recursive(obj):
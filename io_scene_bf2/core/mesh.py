@@ -2,13 +2,14 @@ import bpy # type: ignore
 import bmesh # type: ignore
 import os
 import enum
+import math
+import numpy as np
 
-from itertools import chain
-from mathutils import Vector # type: ignore
+from itertools import product
 
 from .bf2.bf2_mesh import BF2MeshException, BF2Mesh, BF2BundledMesh, BF2SkinnedMesh, BF2StaticMesh
 from .bf2.bf2_common import Mat4
-from .bf2.bf2_mesh.bf2_visiblemesh import Material, MaterialWithTransparency, Vertex
+from .bf2.bf2_mesh.bf2_visiblemesh import Material, MaterialWithTransparency, Vertex, VertexArray
 from .bf2.fileutils import FileUtils
 
 from .exceptions import ImportException, ExportException
@@ -17,10 +18,9 @@ from .utils import (check_transform, conv_bf2_to_blender,
                     delete_object,
                     delete_object_if_exists,
                     check_prefix,
-                    swap_zy,
-                    flip_uv,
                     invert_face,
-                    are_backfaces,
+                    classify_faces,
+                    foreach_get_array,
                     apply_modifiers,
                     triangulate,
                     check_scale,
@@ -180,55 +180,52 @@ class MeshImporter:
 
         mesh_materials = list()
 
-        bm = bmesh.new()
+        vertex_positions = list()
+        faces = list()
+        face_materials = list()
         vertex_offset = 0
 
-        fucked_up_faces = 0
-        double_sided_faces = set()
-
         for bf2_mat in bf2_lod.materials:
-            uv_ratio = None
-
-            # create vertices
-            for vert in bf2_mat.vertices:
-                bm.verts.new(swap_zy(vert.position))
+            # create vertices, whole attribute columns at once
+            vertices = bf2_mat.vertices
+            if len(vertices):
+                vertex_positions.append(_vertex_attribute(vertices, 'position')[:, (0, 2, 1)]) # swap_zy
 
                 # Normals
                 if has_normals:
-                    vertex_normals.append(swap_zy(vert.normal))
+                    vertex_normals.append(_vertex_attribute(vertices, 'normal')[:, (0, 2, 1)]) # swap_zy
                     # XXX: Blender does NOT support custom tangents import
 
+                uv_ratio = None
+                if has_anim_uv:
+                    uv_matrix_idx = _vertex_attribute(vertices, 'blendindices')[:, 3].astype(np.int32)
+                    is_animuv = np.isin(uv_matrix_idx, ANIM_UV_ROTATION_MATRICES)
+                    if np.any(is_animuv):
+                        # once per material, reads the texture header
+                        try:
+                            uv_ratio = _get_anim_uv_ratio(bf2_mat.maps[0], self.texture_paths)
+                        except Exception as e:
+                            uv_ratio = (1.0, 1.0)
+                            self.reporter.warning(f"{e}\n UVs of rotating parts may be incorrect!")
+
                 # UVs
-                uv_matrix_idx = vert.blendindices[3]
                 for uv_chan, vertex_uvs in uvs.items():
-                    uv = getattr(vert, f'texcoord{uv_chan}')
-                    if has_anim_uv and uv_matrix_idx in ANIM_UV_ROTATION_MATRICES:
-                        if uv_ratio is None:
-                            try:
-                                uv_ratio = _get_anim_uv_ratio(bf2_mat.maps[0], self.texture_paths)
-                            except Exception as e:
-                                uv_ratio = (1.0, 1.0)
-                                self.reporter.warning(f"{e}\n UVs of rotating parts may be incorrect!")
+                    uv = _vertex_attribute(vertices, f'texcoord{uv_chan}').astype(np.float64)
+                    if uv_ratio is not None:
                         # FIX UVs for animated parts
                         # UV1 is actual UV, UV0 is just center of UV rotation / shift
                         # and needs to be corected by texture size ratio as well
-                        vert_animuv_center = vert.texcoord1
-                        uv = (uv[0] + vert_animuv_center[0] * uv_ratio[0],
-                            uv[1] + vert_animuv_center[1] * uv_ratio[1])
-                    uv = flip_uv(uv)
+                        vert_animuv_center = _vertex_attribute(vertices, 'texcoord1')[is_animuv]
+                        uv[is_animuv] += vert_animuv_center * uv_ratio
+                    uv[:, 1] = 1 - uv[:, 1] # flip_uv
                     vertex_uvs.append(uv)
 
                 # Animated UVs data
                 if has_anim_uv:
-                    if uv_matrix_idx in ANIM_UV_ROTATION_MATRICES:
-                        vertex_animuv_rot_center.append(Vector(vert.texcoord0))
-                    else:
-                        vertex_animuv_rot_center.append(Vector((0, 0)))
+                    rot_center = _vertex_attribute(vertices, 'texcoord0')
+                    vertex_animuv_rot_center.append(np.where(is_animuv[:, None], rot_center, 0))
                     vertex_animuv_matrix_index.append(uv_matrix_idx)
 
-            bm.verts.ensure_lookup_table()
-            bm.verts.index_update()
-
             # create materials
             mat_idx = self._get_unique_material_index(bf2_mat)
             mat_name = f'{self.mesh_name}_material_{mat_idx}'
@@ -295,46 +292,34 @@ class MeshImporter:
                 material_index = len(mesh_materials)
                 mesh_materials.append(material)
 
-            # create faces
+            # collect faces
             for face in bf2_mat.faces:
-                face_verts = [bm.verts[v + vertex_offset] for v in invert_face(face)]
-                try:
-                    bm_face = bm.faces.new(face_verts)
-                    bm_face.material_index = material_index
-                except ValueError:
-                    # duplicate face.. or vert, lets find out
-                    if not self.load_backfaces:
-                        fucked_up_faces += 1
-                        continue
-                    if len(set(face_verts)) != 3: # duplicate vert
-                        fucked_up_faces += 1
-                        continue
-
-                    bm.faces.index_update()
-                    bm_face_verts = [vert.index for vert in face_verts]
-                    for other_bm_face in bm.faces:
-                        if are_backfaces(bm_face_verts, [vert.index for vert in other_bm_face.verts]):
-                            if material_index != other_bm_face.material_index: # XXX: could they differ ??
-                                raise ImportException("Attempted to create a backface with different material index, aborting")
-                            double_sided_faces.add(other_bm_face.index)
-                            break
-                    else:
-                        # must be a duplicate face
-                        fucked_up_faces += 1
+                faces.append(tuple(v + vertex_offset for v in invert_face(face)))
+                face_materials.append(material_index)
 
             vertex_offset += len(bf2_mat.vertices)
 
-        mesh = bpy.data.meshes.new(name)
-        bm.to_mesh(mesh)
-        bm.free()
+        vertex_positions = _concat_columns(vertex_positions, 3)
+        vertex_normals = _concat_columns(vertex_normals, 3)
+        vertex_animuv_rot_center = _concat_columns(vertex_animuv_rot_center, 2)
+        vertex_animuv_matrix_index = _concat_columns(vertex_animuv_matrix_index)
+        uvs = {uv_chan: _concat_columns(vertex_uvs, 2) for uv_chan, vertex_uvs in uvs.items()}
+
+        faces = np.array(faces, dtype=np.int64).reshape(-1, 3)
+        face_materials = np.array(face_materials, dtype=np.int32)
+        created, double_sided_faces, fucked_up_faces = classify_faces(faces, face_materials, self.load_backfaces)
 
         if fucked_up_faces and not self.silent:
             self.reporter.warning(f"'{name}': Skipped {fucked_up_faces} invalid faces")
 
+        mesh = bpy.data.meshes.new(name)
+        self._build_mesh(mesh, vertex_positions, faces[created], face_materials[created])
+
         # mark faces with backfaces
-        if double_sided_faces:
+        double_sided_faces = double_sided_faces[created]
+        if double_sided_faces.any():
             backface = mesh.attributes.new('backface', 'BOOLEAN', 'FACE')
-            backface.data.foreach_set('value', [poly.index in double_sided_faces for poly in mesh.polygons])
+            backface.data.foreach_set('value', double_sided_faces)
 
         # apply materials
         for material in mesh_materials:
@@ -348,27 +333,25 @@ class MeshImporter:
             if self.free_normals:
                 # https://docs.blender.org/manual/en/dev/modeling/meshes/structure.html#free-normals
                 custom_normal = mesh.attributes.new('custom_normal', 'FLOAT_VECTOR', 'POINT')
-                custom_normal.data.foreach_set('vector', [n for vn in vertex_normals for n in vn])
+                custom_normal.data.foreach_set('vector', vertex_normals.astype(np.float32).ravel())
             else:
-                mesh.normals_split_custom_set_from_vertices(vertex_normals)
+                mesh.normals_split_custom_set_from_vertices(vertex_normals.tolist())
 
         # apply Animated UVs data
         if has_anim_uv:
             animuv_matrix_index = mesh.attributes.new('animuv_matrix_index', 'INT', 'POINT')
-            animuv_matrix_index.data.foreach_set('value', vertex_animuv_matrix_index)
+            animuv_matrix_index.data.foreach_set('value', vertex_animuv_matrix_index.astype(np.int32))
 
             animuv_rot_center = mesh.color_attributes.new('animuv_rot_center', type='FLOAT2', domain='POINT')
-            animuv_rot_center.data.foreach_set('vector', list(chain(*vertex_animuv_rot_center)))
+            animuv_rot_center.data.foreach_set('vector', vertex_animuv_rot_center.astype(np.float32).ravel())
 
         # apply UVs
+        loop_vertex_indexes = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', loop_vertex_indexes)
         for uv_chan, vertex_uvs in uvs.items():
-            loop_uvs = list()
-            for l in mesh.loops:
-                uv = vertex_uvs[l.vertex_index]
-                loop_uvs.extend(uv)
-
+            loop_uvs = vertex_uvs.astype(np.float32)[loop_vertex_indexes]
             uvlayer = mesh.uv_layers.new(name=f'UV{uv_chan}')
-            uvlayer.data.foreach_set('uv', loop_uvs)
+            uvlayer.data.foreach_set('uv', loop_uvs.ravel())
 
         mesh_obj = bpy.data.objects.new(name, mesh)
         self.context.scene.collection.objects.link(mesh_obj)
@@ -395,25 +378,36 @@ class MeshImporter:
 
         return mesh_obj
 
+    def _build_mesh(self, mesh, vertex_positions, faces, face_materials):
+        """fills the mesh directly from vertex and face arrays, faces must be valid (see classify_faces)"""
+        mesh.vertices.add(len(vertex_positions))
+        mesh.vertices.foreach_set('co', np.asarray(vertex_positions, dtype=np.float32).ravel())
+        mesh.loops.add(3 * len(faces))
+        mesh.loops.foreach_set('vertex_index', faces.astype(np.int32).ravel())
+        mesh.polygons.add(len(faces))
+        mesh.polygons.foreach_set('loop_start', np.arange(0, 3 * len(faces), 3, dtype=np.int32))
+        mesh.polygons.foreach_set('material_index', face_materials.astype(np.int32))
+        # flat shaded, same as faces created with bmesh
+        sharp_face = mesh.attributes.new('sharp_face', 'BOOLEAN', 'FACE')
+        sharp_face.data.foreach_set('value', np.ones(len(faces), dtype=bool))
+        mesh.update(calc_edges=True)
+
     def _import_parts_bundled_mesh(self, mesh_obj, bf2_lod):
         if not self.bf2_mesh.has_blend_indices():
             return
 
         # find which part vertex belongs to
-        vert_part_id = list()
-        for mat in bf2_lod.materials:
-            for vert in mat.vertices:
-                part_id = vert.blendindices[0]
-                vert_part_id.append(part_id)
+        vert_part_id = _concat_columns([_vertex_attribute(mat.vertices, 'blendindices')[:, 0]
+                                        for mat in bf2_lod.materials if len(mat.vertices)])
 
-        # create vertex groups and assing verticies to them
-        for vertex in mesh_obj.data.vertices:
-            part_id = vert_part_id[vertex.index]
+        # create vertex groups and assing verticies to them, in order of first vertex of each part
+        part_ids, first_vertex = np.unique(vert_part_id, return_index=True)
+        for part_id in part_ids[np.argsort(first_vertex)].tolist():
             # have to be called same as bones
             group_name = f'mesh{part_id + 1}'
             if group_name not in mesh_obj.vertex_groups.keys():
                 mesh_obj.vertex_groups.new(name=group_name)
-            mesh_obj.vertex_groups[group_name].add([vertex.index], 1.0, "REPLACE")
+            mesh_obj.vertex_groups[group_name].add(np.flatnonzero(vert_part_id == part_id).tolist(), 1.0, "REPLACE")
 
         rig = self._find_skeleton(bf2_lod)
         if not rig:
@@ -467,20 +461,18 @@ class MeshImporter:
         # get weigths from bf2 mesh
         vert_weigths = list()
         for rig_bones, mat in zip(material_bones, bf2_lod.materials):
-            for vert in mat.vertices:
-                weights = []
+            if not len(mat.vertices):
+                continue
+            if not rig_bones:
+                # XXX: not sure if this is valid or not, didn't find any mesh like that
+                raise ImportException(f"{mesh_obj.name}: Got SkinnedMesh material without any bones assigned")
+            blendindices = _vertex_attribute(mat.vertices, 'blendindices')[:, :2].tolist()
+            blendweights = _vertex_attribute(mat.vertices, 'blendweight')[:, 0].tolist()
+            for bone_ids, bone_weight in zip(blendindices, blendweights):
+                weights = [(rig_bones[bone_ids[0]], bone_weight)]
+                if bone_weight < 1.0: # max two bones per vert
+                    weights.append((rig_bones[bone_ids[1]], 1.0 - bone_weight))
                 vert_weigths.append(weights)
-                if not rig_bones:
-                    # XXX: not sure if this is valid or not, didn't find any mesh like that
-                    raise ImportException(f"{mesh_obj.name}: Got SkinnedMesh material without any bones assigned")
-                else:
-                    bone_ids = vert.blendindices
-                    bone_weight = vert.blendweight[0]
-                    _bone = rig_bones[bone_ids[0]]
-                    weights.append((_bone, bone_weight))
-                    if bone_weight < 1.0: # max two bones per vert
-                        _bone = rig_bones[bone_ids[1]]
-                        weights.append((_bone, 1.0 - bone_weight))
 
         # create vertex group for each bone
         mesh_bones = ske_weapon_part_ids(rig)
@@ -585,6 +577,7 @@ class MeshExporter:
                  save_backfaces=True,
                  apply_modifiers=False,
                  triangulate=False,
+                 optimize_vertex_cache=False,
                  reporter=DEFAULT_REPORTER):
         self.mesh_obj = mesh_obj
         self.mesh_file = mesh_file
@@ -599,6 +592,7 @@ class MeshExporter:
         self.save_backfaces = save_backfaces
         self.apply_modifiers = apply_modifiers
         self.triangulate = triangulate
+        self.optimize_vertex_cache = optimize_vertex_cache
 
     def export_mesh(self):
         if self.mesh_geoms:
@@ -616,17 +610,24 @@ class MeshExporter:
     def _export_mesh(self):
         self.has_animated_uvs = self._has_anim_uv()
         self._setup_vertex_attributes()
-        for geom_obj in self.mesh_geoms:
+        for geom_idx, geom_obj in enumerate(self.mesh_geoms):
             bf2_geom = self.bf2_mesh.new_geom()
-            for lod_obj in geom_obj:
+            for lod_idx, lod_obj in enumerate(geom_obj):
                 bf2_lod = bf2_geom.new_lod()
                 self._export_mesh_lod(bf2_lod, lod_obj)
+                if self.optimize_vertex_cache:
+                    self._optimize_vertex_cache(bf2_lod, geom_idx, lod_idx)
         try:
             self.bf2_mesh.export(self.mesh_file)
         except BF2MeshException as e:
             raise ExportException(str(e)) from e
         return self.bf2_mesh
 
+    def _optimize_vertex_cache(self, bf2_lod, geom_idx, lod_idx):
+        for mat_idx, bf2_mat in enumerate(bf2_lod.materials):
+            acmr_before, acmr_after = bf2_mat.optimize_vertex_cache()
+            self.reporter.info(f"Geom{geom_idx} Lod{lod_idx}: material {mat_idx} ACMR {acmr_before:.3f} -> {acmr_after:.3f}")
+
     def _setup_vertex_attributes(self):
         self.bf2_mesh.add_vert_attr('FLOAT3', 'POSITION')
         self.bf2_mesh.add_vert_attr('FLOAT3', 'NORMAL')
@@ -835,32 +836,71 @@ class MeshExporter:
                     bone_to_matrix[bone_obj.name] = conv_blender_to_bf2(m)
                     bone_to_id[bone_obj.name] = bone_id
 
-        # map materials to verts and faces
-        mat_idx_to_verts_faces = dict()
-        for poly in mesh.polygons:
-            if poly.loop_total > 3:
-                raise ExportException("Exporter does not support polygons with more than 3 vertices! It must be triangulated")
-            if poly.material_index not in mat_idx_to_verts_faces:
-                mat_idx_to_verts_faces[poly.material_index] = (set(), list())
-            vert_set, face_list = mat_idx_to_verts_faces[poly.material_index]
-            for v in poly.vertices:
-                vert_set.add(v)
-            face_list.append(poly)
-        
-        # map each vert to a list of loops that use this vert
-        vert_loops = dict()
-        for loop in mesh.loops:
-            vert_idx = loop.vertex_index
-            if vert_idx not in vert_loops:
-                loops = list()
-                vert_loops[vert_idx] = loops
+        # pull mesh data into arrays up front, per element RNA access is slow
+        vert_co = foreach_get_array(mesh.vertices, 'co', np.float32, 3)
+        loop_vert = foreach_get_array(mesh.loops, 'vertex_index', np.int32)
+        loop_normal = foreach_get_array(mesh.loops, 'normal', np.float32, 3)
+        loop_tangent = foreach_get_array(mesh.loops, 'tangent', np.float32, 3)
+        loop_bitangent_sign = foreach_get_array(mesh.loops, 'bitangent_sign', np.float32)
+        poly_loop_start = foreach_get_array(mesh.polygons, 'loop_start', np.int32)
+        poly_loop_total = foreach_get_array(mesh.polygons, 'loop_total', np.int32)
+        poly_material = foreach_get_array(mesh.polygons, 'material_index', np.int32)
+
+        if np.any(poly_loop_total > 3):
+            raise ExportException("Exporter does not support polygons with more than 3 vertices! It must be triangulated")
+
+        if backface_attr:
+            poly_backface = foreach_get_array(backface_attr.data, 'value', bool)
+        else:
+            poly_backface = np.zeros(len(poly_material), dtype=bool)
+
+        positions = list(map(tuple, vert_co[:, (0, 2, 1)].tolist())) # swap_zy
+        loop_normals = list(map(tuple, loop_normal[:, (0, 2, 1)].tolist()))
+        loop_tangents = list(map(tuple, loop_tangent[:, (0, 2, 1)].tolist()))
+
+        # third element of blendindices is bitangent sign 0 or 1
+        # bitangent was caluculated based on UV and because we flip it vertically
+        # (see below) the sign of the bitangent gotta be inverted as well
+        loop_bitangent_idx = np.where(loop_bitangent_sign > 0, 0, 1).tolist()
+
+        loop_uvs = dict()
+        for uv_chan in range(uv_count):
+            uvlayer = uv_layers.get(uv_chan)
+            if uvlayer:
+                uv = foreach_get_array(uvlayer.data, 'uv', np.float32, 2).astype(np.float64)
+                uv[:, 1] = 1 - uv[:, 1] # flip_uv
+                loop_uvs[uv_chan] = list(map(tuple, uv.tolist()))
             else:
-                loops = vert_loops[vert_idx]
-            loops.append(loop)
+                loop_uvs[uv_chan] = [(0, 0)] * len(loop_vert)
+
+        if animuv_matrix_index:
+            vert_animuv_matrix_index = foreach_get_array(animuv_matrix_index.data, 'value', np.int32).tolist()
+        if animuv_rot_center:
+            vert_animuv_rot_center = list(map(tuple, foreach_get_array(animuv_rot_center.data, 'vector', np.float32, 2).tolist()))
+
+        # (group index, weight) pairs for each vertex, there's no bulk access for vertex groups
+        if mesh_type != BF2StaticMesh:
+            vert_groups = [[(g.group, g.weight) for g in v.groups] for v in mesh.vertices]
+
+        # map each vert to a list of loops that use this vert (in order of the first loop referencing it)
+        loop_order = np.argsort(loop_vert, kind='stable').tolist()
+        used_verts, vert_first_loop, vert_loop_count = np.unique(loop_vert, return_index=True, return_counts=True)
+        vert_loop_end = np.cumsum(vert_loop_count)
+        vert_loop_start = (vert_loop_end - vert_loop_count).tolist()
+        vert_loop_end = vert_loop_end.tolist()
+        used_verts = used_verts.tolist()
+        vert_loops = dict()
+        for i in np.argsort(vert_first_loop, kind='stable').tolist():
+            vert_loops[used_verts[i]] = loop_order[vert_loop_start[i]:vert_loop_end[i]]
 
         # create bf2 materials
-        for blend_mat_idx, (blend_vert_set, blend_faces) in sorted(mat_idx_to_verts_faces.items()):
+        for blend_mat_idx in np.unique(poly_material).tolist():
             blend_material = mesh.materials[blend_mat_idx]
+            blend_faces = np.flatnonzero(poly_material == blend_mat_idx)
+            blend_face_loops = poly_loop_start[blend_faces, np.newaxis] + np.arange(3)
+            blend_vert_set = np.zeros(len(positions), dtype=bool)
+            blend_vert_set[loop_vert[blend_face_loops.ravel()]] = True
+            blend_vert_set = blend_vert_set.tolist()
 
             # validate material has correct settings
             if not blend_material.is_bf2_material:
@@ -943,88 +983,85 @@ class MeshExporter:
                 bf2_rig = bf2_lod.new_rig()
 
             # map each loop to vert index in vertex array
-            loop_to_vert_idx = [-1] * len(mesh.loops)
+            loop_to_vert_idx = [-1] * len(loop_vert)
 
             # merge stats
             merged_loops_count = 0
             total_loops_count = 0
 
+            welder = _VertexWelder(self.normal_weld_thres, self.tangent_weld_thres, uv_count)
+
             # create material's vertices
-            this_material_vert_loops = filter(lambda x: x[0] in blend_vert_set, vert_loops.items())
-            for vert_idx, loops in this_material_vert_loops: 
-    
+            this_material_vert_loops = [(vert_idx, loops) for vert_idx, loops in vert_loops.items() if blend_vert_set[vert_idx]]
+            for vert_idx, loops in this_material_vert_loops:
+
                 unique_loops = dict() # loop_idx -> vertex
                 merged_loops = dict() # loop_idx -> unique loop idx
 
-                blend_vertex = mesh.vertices[vert_idx]
-                for loop in loops:
+                # blendindices
+                blendindices = [0, 0, 0, 0]
+                blendweight = None
+                # - (BundledMesh) first one is geom part index, second one unused
+                # - (SkinnedMesh) first and second one are bone indices
+                # - (StaticMesh)  both first and second one are unused
+                if mesh_type == BF2BundledMesh:
+                    groups = vert_groups[vert_idx]
+                    if len(groups) > 1:
+                        raise ExportException(f"{lod_obj.name}: Found vertex assigned to more than one vertex group! BF2 BundledMesh only supports one bone per vertex")
+                    elif len(groups) > 0:
+                        vert_group = groups[0][0]
+                        blendindices[0] = vertex_group_to_part_id[vert_group]
+                elif mesh_type == BF2SkinnedMesh:
+                    groups = vert_groups[vert_idx]
+                    if len(groups) > 2:
+                        raise ExportException(f"{lod_obj.name}: Found vertex assigned to more than two vertex groups (bones)!, BF2 SkinnedMesh only supports two bones per vertex")
+                    elif len(groups) == 0:
+                        if bone_list:
+                            # it's not possible for a material to have some verts weighted and some not
+                            raise ExportException(f"{lod_obj.name}: Not all vertices have been assigned to a vertex group (bone)!")
+                        else:
+                            # but it's possible for it to have no weights (e.g. dropkit)
+                            blendweight = (0,)
+                    else:
+                        _bone_weights = list()
+                        for _bone_idx, (_bone_group, _bone_weight) in enumerate(groups):
+                            _bone_name = lod_obj.vertex_groups[_bone_group].name
+                            _bone_weights.append(_bone_weight)
+                            try:
+                                blendindices[_bone_idx] = bone_list.index(_bone_name)
+                            except ValueError:
+                                blendindices[_bone_idx] = len(bone_list)
+                                bone_list.append(_bone_name)
+                                bf2_bone = bf2_rig.new_bone()
+                                if _bone_name not in bone_to_id:
+                                    raise ExportException(f"{lod_obj.name}: vertex group '{_bone_name}' does not reference a valid bone in the BF2 skeleton")
+                                bf2_bone.id = bone_to_id[_bone_name]
+                                bf2_bone.matrix = bone_to_matrix[_bone_name]
+
+                        if abs(sum(_bone_weights) - 1.0) > 0.0001:
+                            raise ExportException(f"{lod_obj.name}: Found vertex with weights that are not normalized, all weights must add up to 1!")
+                        blendweight = (_bone_weights[0],)
+
+                # (BundledMesh) fourth elem of blendindices is matrix index of the animated UV
+                # (SkinnedMesh/StaticMesh) unused
+                if animuv_matrix_index:
+                    blendindices[3] = AnimUv(vert_animuv_matrix_index[vert_idx])
+
+                for loop_idx in loops:
                     vert = Vertex()
 
-                    vert.position = swap_zy(blend_vertex.co)
-                    vert.normal = swap_zy(loop.normal)
-                    vert.tangent = swap_zy(loop.tangent)
-
-                    # blendindices
-                    blendindices = [0, 0, 0, 0]
-                    # - (BundledMesh) first one is geom part index, second one unused
-                    # - (SkinnedMesh) first and second one are bone indices
-                    # - (StaticMesh)  both first and second one are unused
-                    if mesh_type == BF2BundledMesh:
-                        if len(blend_vertex.groups) > 1:
-                            raise ExportException(f"{lod_obj.name}: Found vertex assigned to more than one vertex group! BF2 BundledMesh only supports one bone per vertex")
-                        elif len(blend_vertex.groups) > 0:
-                            vert_group = blend_vertex.groups[0].group
-                            blendindices[0] = vertex_group_to_part_id[vert_group]
-                    elif mesh_type == BF2SkinnedMesh:
-                        if len(blend_vertex.groups) > 2:
-                            raise ExportException(f"{lod_obj.name}: Found vertex assigned to more than two vertex groups (bones)!, BF2 SkinnedMesh only supports two bones per vertex")
-                        elif len(blend_vertex.groups) == 0:
-                            if bone_list:
-                                # it's not possible for a material to have some verts weighted and some not
-                                raise ExportException(f"{lod_obj.name}: Not all vertices have been assigned to a vertex group (bone)!")
-                            else:
-                                # but it's possible for it to have no weights (e.g. dropkit)
-                                vert.blendweight = (0,)
-                        else:
-                            _bone_weights = list()
-                            for _bone_idx, _bone in enumerate(blend_vertex.groups):
-                                _bone_name = lod_obj.vertex_groups[_bone.group].name
-                                _bone_weights.append(_bone.weight)
-                                try:
-                                    blendindices[_bone_idx] = bone_list.index(_bone_name)
-                                except ValueError:
-                                    blendindices[_bone_idx] = len(bone_list)
-                                    bone_list.append(_bone_name)
-                                    bf2_bone = bf2_rig.new_bone()
-                                    if _bone_name not in bone_to_id:
-                                        raise ExportException(f"{lod_obj.name}: vertex group '{_bone_name}' does not reference a valid bone in the BF2 skeleton")
-                                    bf2_bone.id = bone_to_id[_bone_name]
-                                    bf2_bone.matrix = bone_to_matrix[_bone_name]
-
-                            if abs(sum(_bone_weights) - 1.0) > 0.0001:
-                                raise ExportException(f"{lod_obj.name}: Found vertex with weights that are not normalized, all weights must add up to 1!")
-                            vert.blendweight = (_bone_weights[0],)
-
-                    # third element of blendindices is bitangent sign 0 or 1
-                    # bitangent was caluculated based on UV and because we flip it vertically
-                    # (see below) the sign of the bitangent gotta be inverted as well
-                    blendindices[2] = 0 if loop.bitangent_sign > 0 else 1
-
-                    # (BundledMesh) fourth elem of blendindices is matrix index of the animated UV
-                    # (SkinnedMesh/StaticMesh) unused
-                    if animuv_matrix_index:
-                        blendindices[3] = AnimUv(animuv_matrix_index.data[vert_idx].value)
+                    vert.position = positions[vert_idx]
+                    vert.normal = loop_normals[loop_idx]
+                    vert.tangent = loop_tangents[loop_idx]
+                    if blendweight is not None:
+                        vert.blendweight = blendweight
 
+                    blendindices[2] = loop_bitangent_idx[loop_idx]
                     vert.blendindices = tuple(blendindices)
 
                     # UVs
                     for uv_chan in range(uv_count):
-                        uvlayer = uv_layers.get(uv_chan)
-                        if uvlayer:
-                            uv = flip_uv(uvlayer.data[loop.index].uv)
-                        else:
-                            uv = (0, 0)
-                        setattr(vert, f'texcoord{uv_chan}', uv)
+                        setattr(vert, f'texcoord{uv_chan}', loop_uvs[uv_chan][loop_idx])
 
                     # animated UVs
                     if self.has_animated_uvs:
@@ -1040,20 +1077,20 @@ class MeshExporter:
                             # scale by texture size ratio, move to TEXCOORD1
                             # keeping only the center of rotation in TEXCOORD0
                             uv = vert.texcoord0
-                            vert_animuv_center = animuv_rot_center.data[vert_idx].vector
+                            vert_animuv_center = vert_animuv_rot_center[vert_idx]
                             vert.texcoord1 = ((uv[0] - vert_animuv_center[0]) / uv_ratio[0],
                                             (uv[1] - vert_animuv_center[1]) / uv_ratio[1])
                             vert.texcoord0 = vert_animuv_center
 
                     # check if loop can be merged, if so, add reference to the same loop
                     total_loops_count += 1
-                    for other_loop_idx, other_vert in unique_loops.items():
-                        if self._can_merge_vert(other_vert, vert, uv_count):
-                            merged_loops_count += 1
-                            merged_loops[loop.index] = other_loop_idx
-                            break
+                    other_loop_idx = welder.find(vert_idx, vert)
+                    if other_loop_idx is not None:
+                        merged_loops_count += 1
+                        merged_loops[loop_idx] = other_loop_idx
                     else:
-                        unique_loops[loop.index] = vert
+                        unique_loops[loop_idx] = vert
+                        welder.add(vert_idx, loop_idx, vert)
 
                 # add unique verts to vertex buffer
                 for loop_idx, vert in unique_loops.items():
@@ -1064,10 +1101,11 @@ class MeshExporter:
                     loop_to_vert_idx[loop_idx] = loop_to_vert_idx[unique_loop_idx]
 
             # create material's faces
-            for face in blend_faces:
-                face_verts = invert_face(loop_to_vert_idx[face.loop_start:face.loop_start + face.loop_total])
+            blend_face_verts = np.array(loop_to_vert_idx)[blend_face_loops[:, ::-1]].tolist() # invert_face
+            for face_verts, is_double_sided in zip(blend_face_verts, poly_backface[blend_faces].tolist()):
+                face_verts = tuple(face_verts)
                 bf2_mat.faces.append(face_verts)
-                if backface_attr and backface_attr.data[face.index].value:
+                if is_double_sided:
                     bf2_mat.faces.append(invert_face(face_verts))
 
             # print stats
@@ -1075,7 +1113,7 @@ class MeshExporter:
                 stats = f'{lod_obj.name}_material{bf2_lod.materials.index(bf2_mat)}:'
                 stats += f'\n\tmerged loops: {merged_loops_count}/{total_loops_count}'
                 stats += f'\n\tvertices: {len(bf2_mat.vertices)}'
-                stats += f'\n\tduplicated vertices: {len(bf2_mat.vertices) - len(blend_vert_set)}'
+                stats += f'\n\tduplicated vertices: {len(bf2_mat.vertices) - len(this_material_vert_loops)}'
                 stats += f'\n\tfaces: {len(bf2_mat.faces)}'
                 print(stats)
 
@@ -1085,22 +1123,90 @@ class MeshExporter:
                                           f" but material '{blend_material.name}' has got {len(bone_list)} bones (vertex groups) assigned!")
         mesh.free_tangents()
 
-    def _can_merge_vert(self, this, other, uv_count):
+
+class _VertexWelder:
+    """
+    Finds a previously added loop (of the same vertex) that a new one can be merged with,
+    without comparing it to all of them. Normal and the first UV channel are quantized into
+    grid cells a few times bigger than the weld distance, so apart from the loop's
+    own cell only neighbouring cells within the weld distance of it need to be searched.
+    Cells are centered on multiples of their size so that common values like 0 don't lie on
+    a cell boundary. Tangent and other UV channels are only compared in _can_merge_vert,
+    bucketing on them as well would double the searched cells with every extra dimension
+    """
+    UV_WELD_THRES = 0.0001
+    CELL_SCALE = 8
+
+    def __init__(self, normal_weld_thres, tangent_weld_thres, uv_count):
+        self.normal_weld_thres = normal_weld_thres
+        self.tangent_weld_thres = tangent_weld_thres
+        self.uv_count = uv_count
+
+        # max per-component difference of two (unit) vectors which dot product is above the threshold
+        normal_dist = math.sqrt(max(2.0 * (1.0 - normal_weld_thres), 0.0)) + 1e-6
+        tangent_dist = math.sqrt(max(2.0 * (1.0 - tangent_weld_thres), 0.0)) + 1e-6
+        uv_dist = self.UV_WELD_THRES + 1e-6
+        self.margins = (normal_dist,) * 3 + (uv_dist,) * 2 * min(uv_count, 1)
+        self.cell_sizes = tuple(margin * self.CELL_SCALE for margin in self.margins)
+
+        self.cells = dict() # cell key -> list of (order, loop_idx, vertex)
+        self.count = 0
+
+    def _coords(self, vert):
+        coords = list(vert.normal)
+        if self.uv_count:
+            coords.extend(vert.texcoord0)
+        return coords
+
+    def add(self, group, loop_idx, vert):
+        coords = self._coords(vert)
+        cell = tuple(math.floor(c / size + 0.5) for c, size in zip(coords, self.cell_sizes))
+        key = (group, vert.blendindices[2], cell) # 3rd blendindex is bitangent sign
+        self.cells.setdefault(key, []).append((self.count, loop_idx, vert))
+        self.count += 1
+
+    def find(self, group, vert):
+        """returns loop index of the first added vertex that can be merged with `vert` or None"""
+        coords = self._coords(vert)
+        cell_options = list()
+        for c, size, margin in zip(coords, self.cell_sizes, self.margins):
+            cell = math.floor(c / size + 0.5)
+            options = [cell]
+            if c - margin < (cell - 0.5) * size:
+                options.append(cell - 1)
+            if c + margin >= (cell + 0.5) * size:
+                options.append(cell + 1)
+            cell_options.append(options)
+
+        best = None
+        for cell in product(*cell_options):
+            for order, loop_idx, other in self.cells.get((group, vert.blendindices[2], cell), ()):
+                if best is not None and order > best[0]:
+                    break
+                if self._can_merge_vert(other, vert):
+                    best = (order, loop_idx)
+                    break
+        return None if best is None else best[1]
+
+    def _can_merge_vert(self, this, other):
         """compare vertex data from two loops"""
-        if Vector(this.tangent).dot(Vector(other.tangent)) < self.tangent_weld_thres:
+        if _dot(this.tangent, other.tangent) < self.tangent_weld_thres:
             return False
-        if Vector(this.normal).dot(Vector(other.normal)) < self.normal_weld_thres:
+        if _dot(this.normal, other.normal) < self.normal_weld_thres:
             return False
         if this.blendindices[2] != other.blendindices[2]: # bitangent sign
             return False
-        for uv_chan in range(uv_count):
+        for uv_chan in range(self.uv_count):
             uv_attr = f'texcoord{uv_chan}'
             this_uv = getattr(this, uv_attr)
             other_uv = getattr(other, uv_attr)
-            if any([abs(this_uv[i] - other_uv[i]) > 0.0001 for i in (0, 1)]):
+            if abs(this_uv[0] - other_uv[0]) > self.UV_WELD_THRES or abs(this_uv[1] - other_uv[1]) > self.UV_WELD_THRES:
                 return False
         return True
 
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
 # utils
 
 def _get_texture_size(texture_file):
@@ -1115,6 +1221,20 @@ def _get_texture_size(texture_file):
         width = f.read_dword()
         return height, width
 
+def _vertex_attribute(vertices, name):
+    """(N, size) column of all values of a vertex attribute, vertices are either VertexArray or list of Vertex"""
+    if isinstance(vertices, VertexArray):
+        values = vertices.attribute(name)
+    else:
+        values = np.array([getattr(vertex, name) for vertex in vertices])
+    return values.reshape(len(vertices), -1)
+
+def _concat_columns(columns, size=None):
+    """concatenates per material columns, also when there are none"""
+    if columns:
+        return np.concatenate(columns)
+    return np.zeros((0, size) if size else 0)
+
 def _get_anim_uv_ratio(texture_map_file, texture_paths):
     for texture_path in texture_paths:
         full_path = os.path.join(texture_path, texture_map_file)
@@ -551,7 +551,8 @@ class CollMeshPartsCopy:
 
 def export_object_template(mesh_obj, con_file, geom_export=True, colmesh_export=True,
                            apply_modifiers=False, samples_size=None, sample_padding=6,
-                           use_edge_margin=True, save_backfaces=True, reporter=DEFAULT_REPORTER, **kwargs):
+                           use_edge_margin=True, save_backfaces=True, collmesh_max_workers=1,
+                           collmesh_cache_dir=None, reporter=DEFAULT_REPORTER, **kwargs):
     geometry_type, obj_name = parse_geom_type(mesh_obj)
 
     with OrphanedAnchorObject(mesh_obj) as anchor_obj:
@@ -674,7 +675,10 @@ def export_object_template(mesh_obj, con_file, geom_export=True, colmesh_export=
             print(f"Exporting collision to '{collmesh_filepath}'")
             collmesh_exporter = CollMeshExporter(mesh_obj, collmesh_filepath,
                                                  geom_parts=temp_collmesh_parts,
-                                                 material_to_index=col_mat_to_index)
+                                                 material_to_index=col_mat_to_index,
+                                                 max_workers=collmesh_max_workers,
+                                                 cache_dir=collmesh_cache_dir,
+                                                 reporter=reporter)
             collmesh_exporter.export_collmesh()
 
     print(f"Writing con file to '{con_file}'")
@@ -733,16 +733,14 @@ def load_level(context, level_dir, use_cache=True,
             if not mesh_type:
                 reporter.warning(f"skipping '{template_name}' as it is not supported mesh type {geom_temp.geometry_type}")
                 continue
+            lods = None if max_lod_to_load is None else range(max_lod_to_load + 1)
             try:
-                bf2_mesh = mesh_type.load_from(geom_temp.name.lower(), data)
+                bf2_mesh = mesh_type.load_from(geom_temp.name.lower(), data,
+                                               geoms=[0], lods=lods) # TODO: Geom1 support
             except Exception as e:
                 reporter.error(f"Failed to load mesh '{geom_temp.location}', the file might be corrupted: {e}")
                 continue
 
-            del bf2_mesh.geoms[1:] # TODO: Geom1 support
-            if max_lod_to_load is not None:
-                bf2_mesh.geoms[0].lods = bf2_mesh.geoms[0].lods[0:max_lod_to_load+1]
-
             if not load_unpacked:
                 raise NotImplementedError() # TODO: texture load from FileManager
 
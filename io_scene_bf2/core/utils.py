@@ -1,11 +1,12 @@
 import bpy # type: ignore
 from bpy.types import Mesh, Armature, Camera # type: ignore
 from mathutils import Quaternion, Matrix, Vector # type: ignore
-from .exceptions import ExportException
+from .exceptions import ImportException, ExportException
 from .bf2.bf2_common import Mat4, Quat, Vec3
 import tempfile
 import os
 import math
+import numpy as np
 
 from ..directx.texconv import Texconv
 
@@ -201,6 +202,84 @@ def conv_blender_to_bf2(*args):
     else:
         return tuple(ret)
 
+def conv_bf2_to_blender_array(rot, pos):
+    """conv_bf2_to_blender for arrays of (N, 4) BF2 quaternions (xyzw) and (N, 3) positions, returns wxyz quaternions"""
+    rot = np.asarray(rot, dtype=np.float64)
+    pos = np.asarray(pos, dtype=np.float64)
+    # swap Y/Z and invert (Blender's invert also divides by the squared length)
+    bl_rot = np.column_stack((rot[:, 3], -rot[:, 0], -rot[:, 2], -rot[:, 1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bl_rot /= np.einsum('ij,ij->i', rot, rot)[:, None]
+    return bl_rot, pos[:, (0, 2, 1)]
+
+def conv_blender_to_bf2_array(rot, pos):
+    """conv_blender_to_bf2 for arrays of (N, 4) Blender quaternions (wxyz) and (N, 3) positions, returns xyzw quaternions"""
+    rot = np.asarray(rot, dtype=np.float64)
+    pos = np.asarray(pos, dtype=np.float64)
+    bf2_rot = np.column_stack((-rot[:, 1], -rot[:, 3], -rot[:, 2], rot[:, 0]))
+    return bf2_rot, pos[:, (0, 2, 1)]
+
+def quat_to_matrix_array(quats):
+    """(N, 4) wxyz quaternions to (N, 4, 4) rotation matrices, same as Quaternion.to_matrix (no normalization)"""
+    w, x, y, z = np.asarray(quats, dtype=np.float64).T
+    m = np.zeros((len(w), 4, 4))
+    m[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    m[:, 0, 1] = 2 * (x * y - w * z)
+    m[:, 0, 2] = 2 * (x * z + w * y)
+    m[:, 1, 0] = 2 * (x * y + w * z)
+    m[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    m[:, 1, 2] = 2 * (y * z - w * x)
+    m[:, 2, 0] = 2 * (x * z - w * y)
+    m[:, 2, 1] = 2 * (y * z + w * x)
+    m[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    m[:, 3, 3] = 1
+    return m
+
+def to_matrix_array(pos, rot):
+    """to_matrix for arrays of (N, 3) positions and (N, 4) wxyz quaternions"""
+    m = quat_to_matrix_array(rot)
+    m[:, :3, 3] = pos
+    return m
+
+def matrix_decompose_array(matrices):
+    """
+    Matrix.decompose for (N, 4, 4) matrices, returns (N, 3) positions and (N, 4) wxyz quaternions,
+    quaternions are picked the same way Blender does (non-negative W)
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    pos = matrices[:, :3, 3].copy()
+    rot = matrices[:, :3, :3].copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rot /= np.linalg.norm(rot, axis=1)[:, None, :]
+    rot[np.linalg.det(rot) < 0] *= -1
+    rot = np.nan_to_num(rot)
+
+    # same branches as Blender's mat3_normalized_to_quat, they differ slightly for non orthogonal matrices
+    m = rot
+    trace = np.stack((1 + m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2],
+                      1 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2],
+                      1 - m[:, 0, 0] + m[:, 1, 1] - m[:, 2, 2],
+                      1 - m[:, 0, 0] - m[:, 1, 1] + m[:, 2, 2]), axis=1)
+    branch = np.where(m[:, 2, 2] < 0,
+                       np.where(m[:, 0, 0] > m[:, 1, 1], 1, 2),
+                       np.where(m[:, 0, 0] < -m[:, 1, 1], 3, 0))
+    s = 2 * np.sqrt(np.maximum(trace[np.arange(len(m)), branch], 1e-30))
+    quats = np.empty((len(m), 4))
+    w_diff = (m[:, 2, 1] - m[:, 1, 2], m[:, 0, 2] - m[:, 2, 0], m[:, 1, 0] - m[:, 0, 1])
+    xy = m[:, 1, 0] + m[:, 0, 1]
+    xz = m[:, 0, 2] + m[:, 2, 0]
+    yz = m[:, 2, 1] + m[:, 1, 2]
+    candidates = (np.stack((0.25 * s, w_diff[0] / s, w_diff[1] / s, w_diff[2] / s), axis=1),
+                  np.stack((w_diff[0] / s, 0.25 * s, xy / s, xz / s), axis=1),
+                  np.stack((w_diff[1] / s, xy / s, 0.25 * s, yz / s), axis=1),
+                  np.stack((w_diff[2] / s, xz / s, yz / s, 0.25 * s), axis=1))
+    for i, candidate in enumerate(candidates):
+        mask = branch == i
+        quats[mask] = candidate[mask]
+    quats[quats[:, 0] < 0] *= -1
+    quats /= np.linalg.norm(quats, axis=1)[:, None]
+    return pos, quats
+
 def find_root(obj):
     if obj.parent is None:
         return obj
@@ -258,6 +337,49 @@ def are_backfaces(face1, face2):
 
     return True
 
+def classify_faces(faces, face_materials, load_backfaces):
+    """
+    tells which faces would get created when adding them one by one with bmesh, which refuses faces
+    with duplicate verts or the same verts as an already created face (the only valid case of which is a backface).
+    `faces` is (N, 3) array of vertex indexes.
+    Returns mask of created faces, mask of faces that have a backface and number of skipped faces
+    """
+    face_count = len(faces)
+    rows = np.arange(face_count)
+    v1, v2, v3 = faces.T
+    valid = (v1 != v2) & (v2 != v3) & (v1 != v3)
+
+    # faces with the same set of verts share the key, first valid one of them gets created
+    sorted_faces = np.sort(faces, axis=1)
+    vert_count = int(faces.max(initial=0)) + 1
+    keys = (sorted_faces[:, 0] * vert_count + sorted_faces[:, 1]) * vert_count + sorted_faces[:, 2]
+    valid_idx = np.flatnonzero(valid)
+    _, first, inverse = np.unique(keys[valid_idx], return_index=True, return_inverse=True)
+    created = np.zeros(face_count, dtype=bool)
+    created[valid_idx[first]] = True
+    created_face = np.zeros(face_count, dtype=np.int64)
+    created_face[valid_idx] = valid_idx[first][inverse.reshape(-1)]
+
+    # duplicate with opposite winding is a backface
+    backfaces = np.zeros(face_count, dtype=bool)
+    if load_backfaces:
+        min_vert = np.argmin(faces, axis=1)
+        winding = faces[rows, (min_vert + 1) % 3] < faces[rows, (min_vert + 2) % 3]
+        backfaces = valid & ~created & (winding != winding[created_face])
+        if np.any(face_materials[backfaces] != face_materials[created_face[backfaces]]): # XXX: could they differ ??
+            raise ImportException("Attempted to create a backface with different material index, aborting")
+
+    double_sided_faces = np.zeros(face_count, dtype=bool)
+    double_sided_faces[created_face[backfaces]] = True
+    fucked_up_faces = face_count - int(created.sum()) - int(backfaces.sum())
+    return created, double_sided_faces, fucked_up_faces
+
+def foreach_get_array(collection, attr, dtype, size=1):
+    """reads `attr` of all elements of a bpy collection into a numpy array, shaped (N, size) when size > 1"""
+    data = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, data)
+    return data.reshape(-1, size) if size > 1 else data
+
 def show_error(context, title, text=''):
     def draw(self, context):
         self.layout.label(text=text)
@@ -1,6 +1,7 @@
 import bpy # type: ignore
 import os
-from bpy.props import StringProperty, BoolProperty, IntProperty, CollectionProperty, EnumProperty # type: ignore
+import math
+from bpy.props import StringProperty, BoolProperty, IntProperty, FloatProperty, CollectionProperty, EnumProperty # type: ignore
 from bpy_extras.io_utils import poll_file_object_drop # type: ignore
 
 from .ops_common import ImporterBase, ExporterBase
@@ -8,6 +9,7 @@ from ..utils import RegisterFactory
 
 from ...core.animation import import_animation, export_animation, get_bones_for_export, save_bones_for_export
 from ...core.skeleton import find_active_skeleton
+from ...core.utils import Reporter
 from ...core.tools.anim_utils import SUPPORTS_ACTION_SLOTS, AnimationContext
 
 # -------------------------- Import --------------------------
@@ -118,6 +120,31 @@ class EXPORT_OT_bf2_animation(bpy.types.Operator, ExporterBase, BafMeta):
         ]
     ) # type: ignore
 
+    lossy_compression: BoolProperty(
+        name="Lossy Compression",
+        description="Merge nearly constant keyframe values so they compress better, reduces file size and game memory usage",
+        default=False
+    ) # type: ignore
+
+    rot_tolerance: FloatProperty(
+        name="Rotation Tolerance",
+        description="Max angle by which exported bone rotations may differ from the original ones",
+        subtype='ANGLE',
+        default=math.radians(0.05),
+        min=0.0,
+        max=math.radians(5.0)
+    ) # type: ignore
+
+    pos_tolerance: FloatProperty(
+        name="Location Tolerance",
+        description="Max distance on each axis by which exported bone locations may differ from the original ones",
+        subtype='DISTANCE',
+        default=0.0005,
+        min=0.0,
+        max=0.1,
+        precision=4
+    ) # type: ignore
+
     actions_for_export: CollectionProperty(type=SelectableItemCollection) # type: ignore
 
     bones_for_export: CollectionProperty(type=SelectableItemCollection) # type: ignore
@@ -127,7 +154,10 @@ class EXPORT_OT_bf2_animation(bpy.types.Operator, ExporterBase, BafMeta):
         export_animation(context, rig, file,
                          bones_to_export=selected_bones,
                          world_space=self.space == 'WORLD',
-                         fstart=fstart, fend=fend)
+                         fstart=fstart, fend=fend,
+                         rot_tolerance=self.rot_tolerance if self.lossy_compression else None,
+                         pos_tolerance=self.pos_tolerance if self.lossy_compression else None,
+                         reporter=Reporter(self.report))
 
     @classmethod
     def poll(cls, context):
@@ -160,6 +190,11 @@ class EXPORT_OT_bf2_animation(bpy.types.Operator, ExporterBase, BafMeta):
     def draw(self, context):
         layout = self.layout
         layout.prop(self, 'space', text="Space:")
+        layout.prop(self, 'lossy_compression')
+        col = layout.column()
+        col.enabled = self.lossy_compression
+        col.prop(self, 'rot_tolerance')
+        col.prop(self, 'pos_tolerance')
         header, body = layout.panel("BF2_PT_actions_for_export", default_closed=True)
         header.prop(self, 'multi_action')
         header.enabled = SUPPORTS_ACTION_SLOTS
@@ -3,6 +3,7 @@ from bpy.props import StringProperty, BoolProperty # type: ignore
 from bpy_extras.io_utils import poll_file_object_drop # type: ignore
 
 from ..utils import RegisterFactory
+from ..ops_prefs import get_bsp_cache_dir
 from .ops_common import ImporterBase, ExporterBase
 
 from ...core.collision_mesh import import_collisionmesh, export_collisionmesh
@@ -58,6 +59,18 @@ class EXPORT_OT_bf2_collisionmesh(bpy.types.Operator, ExporterBase, CollisionMes
         default=True
     ) # type: ignore
 
+    parallel_bsp: BoolProperty(
+        name="Parallel BSP Build",
+        description="Build BSP trees using all CPU cores, speeds up export of large collision meshes",
+        default=False
+    ) # type: ignore
+
+    use_bsp_cache: BoolProperty(
+        name="Cache BSP",
+        description="Reuse BSP trees of unchanged collision meshes from previous exports",
+        default=True
+    ) # type: ignore
+
     @classmethod
     def poll(cls, context):
         cls.poll_message_set("No object active")
@@ -69,6 +82,8 @@ class EXPORT_OT_bf2_collisionmesh(bpy.types.Operator, ExporterBase, CollisionMes
                              save_backfaces=self.save_backfaces,
                              apply_modifiers=self.apply_modifiers,
                              triangulate=True,
+                             max_workers=None if self.parallel_bsp else 1,
+                             cache_dir=get_bsp_cache_dir() if self.use_bsp_cache else None,
                              reporter=Reporter(self.report))
 
     def invoke(self, context, _event):
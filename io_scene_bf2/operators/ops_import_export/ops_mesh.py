@@ -189,6 +189,12 @@ class MeshExportBase(ExporterBase):
         default=True
     ) # type: ignore
 
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorder faces and vertices of each material for better GPU vertex cache utilization",
+        default=False
+    ) # type: ignore
+
     @classmethod
     def poll(cls, context):
         cls.poll_message_set("No object active")
@@ -207,6 +213,7 @@ class MeshExportBase(ExporterBase):
                     save_backfaces=self.save_backfaces,
                     apply_modifiers=self.apply_modifiers,
                     triangulate=True,
+                    optimize_vertex_cache=self.optimize_vertex_cache,
                     reporter=Reporter(self.report))
 
     def invoke(self, context, _event):
@@ -10,7 +10,7 @@ from ...core.object_template import (import_object_template, export_object_templ
 from ...core.skeleton import find_all_skeletons
 from ...core.utils import Reporter, find_root, next_power_of_2, prev_power_of_2
 
-from ..ops_prefs import get_mod_dirs
+from ..ops_prefs import get_mod_dirs, get_bsp_cache_dir
 
 class ConMeta:
     FILE_DESC = "ObjectTemplate (.con)"
@@ -323,6 +323,24 @@ class EXPORT_OT_bf2_object(bpy.types.Operator, ExporterBase, ConMeta):
         default=True
     ) # type: ignore
 
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorder faces and vertices of each material for better GPU vertex cache utilization",
+        default=False
+    ) # type: ignore
+
+    parallel_bsp: BoolProperty(
+        name="Parallel BSP Build",
+        description="Build collision mesh BSP trees using all CPU cores, speeds up export of large collision meshes",
+        default=False
+    ) # type: ignore
+
+    use_bsp_cache: BoolProperty(
+        name="Cache BSP",
+        description="Reuse BSP trees of unchanged collision meshes from previous exports",
+        default=True
+    ) # type: ignore
+
     def draw(self, context):
         layout = self.layout
         is_sm = self.geom_type == 'StaticMesh'
@@ -337,6 +355,7 @@ class EXPORT_OT_bf2_object(bpy.types.Operator, ExporterBase, ConMeta):
             body.prop(self, "save_backfaces") 
             body.prop(self, "normal_weld_threshold")
             body.prop(self, "tangent_weld_threshold")
+            body.prop(self, "optimize_vertex_cache")
 
         header, body = layout.panel("BF2_PT_export_samples", default_closed=True)
         header.prop(self, "export_samples")
@@ -351,6 +370,10 @@ class EXPORT_OT_bf2_object(bpy.types.Operator, ExporterBase, ConMeta):
             body.prop(self, "sample_padding")
 
         layout.prop(self, "export_collmesh")
+        row = layout.row()
+        row.prop(self, "parallel_bsp")
+        row.prop(self, "use_bsp_cache")
+        row.enabled = self.export_collmesh
         layout.prop(self, "apply_modifiers")
 
     @classmethod
@@ -383,6 +406,9 @@ class EXPORT_OT_bf2_object(bpy.types.Operator, ExporterBase, ConMeta):
             use_edge_margin=self.use_edge_margin,
             sample_padding=self.sample_padding,
             save_backfaces=self.save_backfaces,
+            optimize_vertex_cache=self.optimize_vertex_cache,
+            collmesh_max_workers=None if self.parallel_bsp else 1,
+            collmesh_cache_dir=get_bsp_cache_dir() if self.use_bsp_cache else None,
             reporter=Reporter(self.report))
 
     def invoke(self, context, _event):
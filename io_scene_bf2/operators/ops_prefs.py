@@ -7,6 +7,9 @@ from .. import __package__
 def get_mod_dirs(context):
     return [prop.mod_directory for prop in context.preferences.addons[__package__].preferences.mod_directories if prop.mod_directory]
 
+def get_bsp_cache_dir():
+    return bpy.utils.extension_path_user(__package__, path="bsp_cache", create=True)
+
 class BF2_OT_bf2_mod_path_add(bpy.types.Operator):
     bl_idname = "bf2.mod_path_add"
     bl_label = "Add BF2 mod directory slot"
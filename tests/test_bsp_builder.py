@@ -0,0 +1,66 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'io_scene_bf2', 'core'))
+
+from bf2.bsp_builder import BspBuilder, GreedySplit, MedianSplit, SahSplit, MAX_LEAF_FACES
+
+
+def grid_with_spanning_faces(n=40, spanning=12):
+    """flat n x n vertex grid plus a few large faces crossing all of it"""
+    xs, zs = np.meshgrid(np.arange(n, dtype=float), np.arange(n, dtype=float), indexing='ij')
+    verts = np.column_stack((xs.ravel(), np.zeros(n * n), zs.ravel()))
+    idx = np.arange(n * n).reshape(n, n)
+    a, b, c, d = idx[:-1, :-1].ravel(), idx[1:, :-1].ravel(), idx[:-1, 1:].ravel(), idx[1:, 1:].ravel()
+    faces = np.concatenate((np.column_stack((a, b, c)), np.column_stack((b, d, c))))
+
+    rng = np.random.default_rng(0)
+    big = rng.uniform(-1, n, size=(spanning * 3, 3))
+    big[:, 1] = rng.uniform(-5, 5, size=spanning * 3)
+    faces = np.concatenate((faces, len(verts) + np.arange(spanning * 3).reshape(-1, 3)))
+    verts = np.concatenate((verts, big))
+    return verts, faces
+
+
+def triangle_soup(count=300):
+    rng = np.random.default_rng(1)
+    return rng.uniform(0, 10, size=(count * 3, 3)), np.arange(count * 3).reshape(-1, 3)
+
+
+def build(verts, faces, strategy, **kwargs):
+    builder = BspBuilder(verts.ravel().tolist(), faces.ravel().tolist(), strategy, **kwargs)
+    if builder.split_vals:
+        leaves = [leaf for node_leaves in builder.leaf_faces for leaf in node_leaves if leaf is not None]
+    else:
+        leaves = [list(range(len(faces)))]
+    return builder, leaves
+
+
+def check_leaves(leaves, face_count):
+    assert max(len(leaf) for leaf in leaves) <= MAX_LEAF_FACES
+    assert set().union(*map(set, leaves)) == set(range(face_count))
+
+
+def test_median_split_with_spanning_faces():
+    verts, faces = grid_with_spanning_faces()
+    for strategy in (MedianSplit(), SahSplit(), GreedySplit()):
+        builder, leaves = build(verts, faces, strategy)
+        check_leaves(leaves, len(faces))
+        assert len(builder.split_vals) < 5000
+        assert sum(map(len, leaves)) < 4 * len(faces)
+
+
+def test_median_split_triangle_soup():
+    verts, faces = triangle_soup()
+    for strategy in (MedianSplit(), SahSplit(), GreedySplit()):
+        builder, leaves = build(verts, faces, strategy)
+        check_leaves(leaves, len(faces))
+        assert sum(map(len, leaves)) < 4 * len(faces)
+
+
+def test_max_depth():
+    verts, faces = grid_with_spanning_faces()
+    for max_depth in (0, 1, 3):
+        builder, leaves = build(verts, faces, MedianSplit(max_leaf_faces=1), max_depth=max_depth)
+        check_leaves(leaves, len(faces))
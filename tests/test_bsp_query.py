@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'io_scene_bf2', 'core'))
+
+from bf2.fileutils import FileUtils
+from bf2.bf2_collmesh import BSP, Col
+from bf2.bsp_query import BspQuery, _ray_triangle, _tri_box_overlap
+
+
+def triangle_soup_col(count):
+    rng = np.random.default_rng(count)
+    verts = rng.uniform(0, 10, size=(count * 3, 3))
+    faces = np.arange(count * 3).reshape(-1, 3)
+    col = Col.from_arrays(Col.ColType.PROJECTILE, verts, faces, np.zeros(count, dtype=np.int64),
+                          np.zeros(len(verts), dtype=np.int64))
+    col.bsp = BSP.build(col.vert_array(), col.face_array()[:, :3])
+    return col
+
+
+def reloaded(bsp):
+    """same BSP as loaded from a file, which doesn't know its chunked nodes"""
+    data = io.BytesIO()
+    bsp.save(FileUtils(data))
+    data.seek(0)
+    return BSP.load(FileUtils(data))
+
+
+def check_queries(query, tri):
+    rng = np.random.default_rng(0)
+    count = 200
+    face_count = len(tri)
+
+    origins = rng.uniform(-3, 13, size=(count, 3))
+    directions = rng.normal(size=(count, 3))
+    dist, _ = query.ray_cast(origins, directions)
+    brute = _ray_triangle(np.repeat(origins, face_count, axis=0), np.repeat(directions, face_count, axis=0),
+                          np.tile(tri[:, 0], (count, 1)), np.tile(tri[:, 1] - tri[:, 0], (count, 1)),
+                          np.tile(tri[:, 2] - tri[:, 0], (count, 1))).reshape(count, face_count)
+    brute[~(brute >= 0)] = np.inf
+    assert np.allclose(dist, brute.min(axis=1))
+
+    centers = rng.uniform(-1, 11, size=(count, 3))
+    half_sizes = rng.uniform(0, 1, size=(count, 3))
+    overlaps = query.aabb_overlap(centers - half_sizes, centers + half_sizes)
+    brute = _tri_box_overlap(np.tile(tri, (count, 1, 1)) - np.repeat(centers, face_count, axis=0)[:, None, :],
+                             np.repeat(half_sizes, face_count, axis=0)).reshape(count, face_count)
+    assert np.array_equal(overlaps, brute.any(axis=1))
+
+
+def test_queries_on_chunked_nodes():
+    for face_count in (300, 1000):
+        col = triangle_soup_col(face_count)
+        assert col.bsp.chunked.any()
+        query = BspQuery(col)
+        check_queries(query, query._tri)
+
+
+def test_chunked_nodes_of_loaded_bsp():
+    col = triangle_soup_col(1000)
+    chunked = col.bsp.chunked
+    col.bsp = reloaded(col.bsp)
+    assert col.bsp.chunked is None
+    query = BspQuery(col)
+    assert np.array_equal(query._chunked, chunked)
+    check_queries(query, query._tri)